@@ -0,0 +1,363 @@
+import argparse
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from metrics import count, timed
+from model import FEATURES
+from storage import DB_PATH, get_connection
+
+# Devices whose state is kept; the least recently seen one is evicted past this
+ANOMALY_MAX_DEVICES = int(os.getenv('ANOMALY_MAX_DEVICES', 50000))
+
+# Half-lives in samples of the baseline (slow) and recent level (fast) averages
+ANOMALY_SLOW_HALF_LIFE = float(os.getenv('ANOMALY_SLOW_HALF_LIFE', 500))
+ANOMALY_FAST_HALF_LIFE = float(os.getenv('ANOMALY_FAST_HALF_LIFE', 20))
+
+# Samples a device must have before anything is flagged
+ANOMALY_WARMUP = int(os.getenv('ANOMALY_WARMUP', 50))
+
+# Standard deviations from the baseline for a spike, and of the noise around
+# the recent level between that level and the baseline for a drift
+ANOMALY_SPIKE_Z = float(os.getenv('ANOMALY_SPIKE_Z', 4.0))
+ANOMALY_DRIFT_Z = float(os.getenv('ANOMALY_DRIFT_Z', 2.0))
+
+# Quantiles tracked per metric, and how far outside the p05..p95 band (as a
+# multiple of its width) a sample must fall to be out of range
+QUANTILES = (0.05, 0.5, 0.95)
+ANOMALY_BAND_MARGIN = float(os.getenv('ANOMALY_BAND_MARGIN', 1.0))
+# Smallest quantile estimate step per sample, as a fraction of the baseline standard deviation
+QUANTILE_STEP = 0.05
+
+# Anomaly kinds; a report's anomaly_flags holds one bit per (metric, kind)
+KINDS = ('spike', 'out_of_range', 'drift')
+SPIKE, OUT_OF_RANGE, DRIFT = (1 << i for i in range(len(KINDS)))
+
+# Per-device state layout: one float32 row of len(FEATURES) per field
+FIELDS = ('fast', 'mean', 'var', 'resid', 'rate', 'last', *(f'q{int(q * 100):02d}' for q in QUANTILES))
+_FAST, _MEAN, _VAR, _RESID, _RATE, _LAST = range(6)
+_Q = slice(6, 6 + len(QUANTILES))
+
+STATE_SCHEMA = '''CREATE TABLE IF NOT EXISTS anomaly_state
+     (device_id TEXT PRIMARY KEY,
+      samples INTEGER NOT NULL,
+      last_seen REAL NOT NULL,
+      state BLOB NOT NULL)'''
+
+DEFAULT_DEVICE = 'default'
+
+
+def _alpha(half_life):
+    return 1.0 - 0.5 ** (1.0 / half_life)
+
+
+def anomaly_mask(flags):
+    """Pack an (n, len(FEATURES)) array of kind bits into one int64 per row."""
+    shifts = np.arange(len(FEATURES), dtype=np.int64) * len(KINDS)
+    return (flags.astype(np.int64) << shifts).sum(axis=1)
+
+
+def describe(mask):
+    """
+    Decode an anomaly_flags value.
+
+    Returns:
+    list: (metric, kind) pairs, in FEATURES order
+    """
+    # NULL (not run through the detector) and -1 (archive) mean no flags
+    if mask is None or pd.isna(mask) or mask < 0:
+        return []
+    mask = int(mask)
+    return [(metric, kind)
+            for i, metric in enumerate(FEATURES)
+            for j, kind in enumerate(KINDS)
+            if mask >> (i * len(KINDS) + j) & 1]
+
+
+def parse_time(value, default):
+    """Seconds since the epoch of an ISO Date_and_Time string, or `default` if it is empty or invalid."""
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return default
+
+
+class StreamingDetector:
+    """
+    Per-device, per-metric rolling statistics for catching deviations that a
+    single snapshot can't show, such as a temperature creeping up for hours.
+
+    For every device and metric it keeps:
+    - a slow EWMA mean and variance (the baseline),
+    - a fast EWMA mean (the recent level) and the slow EWMA variance of the
+      samples around it (the noise),
+    - the EWMA rate of change of the recent level, per second,
+    - stochastic-approximation estimates of the QUANTILES.
+
+    A sample is flagged as a spike when it is ANOMALY_SPIKE_Z baseline standard
+    deviations away from the baseline mean, out of range when it falls well
+    outside the device's own p05..p95 band, and as a drift when the recent
+    level has moved ANOMALY_DRIFT_Z noise deviations off the baseline and is
+    still moving away from it. The noise is used rather than the baseline
+    variance because a slow ramp inflates the latter as fast as the gap
+    grows. Flags are computed against the state before the sample is
+    applied, and only after ANOMALY_WARMUP samples.
+
+    State lives in preallocated float32 arrays of max_devices rows, so memory
+    is fixed (about 0.5 KB per device) and each update is a constant number of
+    array operations. Past max_devices the least recently seen device is
+    evicted and its row reused. Not thread-safe; use one caller at a time.
+    """
+
+    def __init__(self, max_devices=ANOMALY_MAX_DEVICES, slow_half_life=ANOMALY_SLOW_HALF_LIFE,
+                 fast_half_life=ANOMALY_FAST_HALF_LIFE, warmup=ANOMALY_WARMUP, spike_z=ANOMALY_SPIKE_Z,
+                 drift_z=ANOMALY_DRIFT_Z, band_margin=ANOMALY_BAND_MARGIN):
+        if max_devices < 1:
+            raise ValueError("max_devices must be at least 1")
+        if fast_half_life >= slow_half_life:
+            raise ValueError("fast_half_life must be shorter than slow_half_life")
+        self.max_devices = max_devices
+        self.slow_alpha = _alpha(slow_half_life)
+        self.fast_alpha = _alpha(fast_half_life)
+        self.warmup = warmup
+        self.spike_z = spike_z
+        self.drift_z = drift_z
+        self.band_margin = band_margin
+        self._quantiles = np.array(QUANTILES)[None, :, None]
+
+        # np.zeros is lazily backed, so unused rows cost no resident memory
+        self._state = np.zeros((max_devices, len(FIELDS), len(FEATURES)), dtype=np.float32)
+        self._samples = np.zeros(max_devices, dtype=np.int64)
+        self._last_seen = np.zeros(max_devices, dtype=np.float64)
+        self._dirty = np.zeros(max_devices, dtype=bool)
+        # device id -> row, least recently seen first
+        self._slots = OrderedDict()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _slot(self, device_id):
+        slot = self._slots.get(device_id)
+        if slot is not None:
+            self._slots.move_to_end(device_id)
+            return slot
+        if len(self._slots) < self.max_devices:
+            slot = len(self._slots)
+        else:
+            _, slot = self._slots.popitem(last=False)
+            count('anomaly_devices_evicted', help="Devices dropped from the streaming detector")
+        self._slots[device_id] = slot
+        self._samples[slot] = 0
+        self._dirty[slot] = True
+        return slot
+
+    @timed('anomaly_update', help="Seconds per streaming detector batch update")
+    def update(self, device_ids, data, timestamps=None):
+        """
+        Score a batch of samples, then fold them into the per-device state.
+
+        Parameters:
+        device_ids (sequence): One device id per sample
+        data: 2-D array with columns in FEATURES order, or a list of dicts keyed by FEATURES
+        timestamps (array): Sample times in epoch seconds; now if omitted
+
+        Returns:
+        tuple: (anomaly_flags int64 array as decoded by describe(),
+                score float array: largest baseline z-score across metrics, 0 during warm-up)
+        """
+        if not isinstance(data, np.ndarray):
+            data = np.array([[row[name] for name in FEATURES] for row in data], dtype=float)
+        X = np.asarray(data, dtype=float)
+        n = len(X)
+        if X.ndim != 2 or X.shape[1] != len(FEATURES) or len(device_ids) != n:
+            raise ValueError(f"Expected {len(device_ids)} rows of {len(FEATURES)} features, got shape {X.shape}")
+        ts = np.full(n, time.time()) if timestamps is None else np.asarray(timestamps, dtype=float)
+
+        # Samples of one device must be applied in order, so the batch is
+        # split into rounds in which every device appears at most once
+        slots = np.empty(n, dtype=np.int64)
+        rounds = np.empty(n, dtype=np.int64)
+        seen = {}
+        for i, device_id in enumerate(device_ids):
+            slots[i] = self._slot(device_id)
+            rounds[i] = seen[device_id] = seen.get(device_id, -1) + 1
+        if len(seen) > self.max_devices:
+            raise ValueError(f"Batch has {len(seen)} devices, more than max_devices={self.max_devices}")
+
+        flags = np.zeros((n, len(FEATURES)), dtype=np.int64)
+        scores = np.zeros(n)
+        if n == 0:
+            return anomaly_mask(flags), scores
+        if rounds.max() == 0:
+            flags[:], scores[:] = self._apply(slots, X, ts)
+        else:
+            for r in range(rounds.max() + 1):
+                rows = np.flatnonzero(rounds == r)
+                flags[rows], scores[rows] = self._apply(slots[rows], X[rows], ts[rows])
+        mask = anomaly_mask(flags)
+        count('anomaly_samples', n, help="Samples scored by the streaming detector")
+        count('anomaly_flagged', int(np.count_nonzero(mask)), help="Samples with at least one anomaly")
+        return mask, scores
+
+    def _apply(self, slots, x, ts):
+        # slots are distinct here, so gather/scatter by fancy indexing is safe
+        state = self._state[slots].astype(np.float64)
+        fast, mean, var, resid, rate, last = (state[:, i] for i in (_FAST, _MEAN, _VAR, _RESID, _RATE, _LAST))
+        q = state[:, _Q]
+        samples = self._samples[slots]
+        first = samples == 0
+        warm = (samples >= self.warmup)[:, None]
+
+        std = np.maximum(np.sqrt(var), 1e-3 * (np.abs(mean) + 1.0))
+        z = (x - mean) / std
+        spike = np.abs(z) > self.spike_z
+        width = q[:, -1] - q[:, 0]
+        out_of_range = ((x < q[:, 0] - self.band_margin * width) |
+                        (x > q[:, -1] + self.band_margin * width))
+        noise = np.maximum(np.sqrt(resid), 1e-3 * (np.abs(mean) + 1.0))
+        gap = fast - mean
+        drift = (np.abs(gap) > self.drift_z * noise) & (np.sign(rate) == np.sign(gap))
+        flags = (spike * SPIKE | out_of_range * OUT_OF_RANGE | drift * DRIFT) * warm
+        scores = np.where(warm[:, 0], np.abs(z).max(axis=1), 0.0)
+
+        # Until a device has a window's worth of samples the averages are plain
+        # running means (alpha 1/n), so they don't start out biased towards zero
+        n = (samples + 1.0)[:, None]
+        slow_alpha = np.maximum(self.slow_alpha, 1.0 / n)
+        fast_alpha = np.maximum(self.fast_alpha, 1.0 / n)
+
+        # Once warm, samples are clipped to the spike band before they feed the
+        # averages, so a single outlier neither drags the baseline nor looks like
+        # a drift; a real level shift still moves them, just more slowly
+        clipped = np.where(warm, np.clip(x, mean - self.spike_z * std, mean + self.spike_z * std), x)
+
+        # Recent level, the noise around it and its rate of change
+        residual = clipped - fast
+        resid[:] = (1.0 - slow_alpha) * (resid + slow_alpha * residual * residual)
+        new_fast = fast + fast_alpha * residual
+        dt = (ts - self._last_seen[slots])[:, None]
+        slope = np.divide(new_fast - fast, dt, out=np.zeros_like(fast), where=(dt > 0) & ~first[:, None])
+        rate += self.fast_alpha * (slope - rate)
+        fast[:] = new_fast
+        last[:] = x
+
+        # Baseline
+        delta = clipped - mean
+        mean += slow_alpha * delta
+        var[:] = (1.0 - slow_alpha) * (var + slow_alpha * delta * delta)
+        # Large quantile steps at first so the band opens up during warm-up
+        step = np.maximum(QUANTILE_STEP, 1.0 / np.sqrt(n)) * std
+        q += step[:, None] * (self._quantiles - (x[:, None] < q))
+
+        # A device's first sample (or a reused row's) starts the rest afresh
+        state[first, _RATE] = 0.0
+        state[first, _Q] = x[first][:, None]
+
+        self._state[slots] = state
+        self._samples[slots] = samples + 1
+        self._last_seen[slots] = ts
+        self._dirty[slots] = True
+        return flags, scores
+
+    def device_state(self, device_id):
+        """{field: {metric: value}} for one device, plus its sample count; None if unknown."""
+        slot = self._slots.get(device_id)
+        if slot is None:
+            return None
+        state = {field: dict(zip(FEATURES, self._state[slot, i].tolist())) for i, field in enumerate(FIELDS)}
+        state['samples'] = int(self._samples[slot])
+        return state
+
+    def checkpoint(self, db_path=DB_PATH):
+        """
+        Write the state of every device updated since the last checkpoint.
+
+        Returns:
+        int: Devices written
+        """
+        slots = np.flatnonzero(self._dirty)
+        if not len(slots):
+            return 0
+        owners = {slot: device_id for device_id, slot in self._slots.items()}
+        rows = [(owners[slot], int(self._samples[slot]), float(self._last_seen[slot]), self._state[slot].tobytes())
+                for slot in slots.tolist() if slot in owners]
+        conn = get_connection(db_path)
+        with conn:
+            conn.execute(STATE_SCHEMA)
+            conn.executemany('''INSERT INTO anomaly_state (device_id, samples, last_seen, state)
+                                VALUES (?, ?, ?, ?)
+                                ON CONFLICT (device_id) DO UPDATE SET
+                                    samples = excluded.samples,
+                                    last_seen = excluded.last_seen,
+                                    state = excluded.state''', rows)
+        self._dirty[slots] = False
+        return len(rows)
+
+    def restore(self, db_path=DB_PATH):
+        """
+        Load checkpointed state, keeping the max_devices most recently seen devices.
+
+        Returns:
+        int: Devices restored
+        """
+        conn = get_connection(db_path)
+        conn.execute(STATE_SCHEMA)
+        rows = conn.execute("SELECT device_id, samples, last_seen, state FROM anomaly_state "
+                            "ORDER BY last_seen DESC LIMIT ?", (self.max_devices,)).fetchall()
+        row_bytes = self._state[0].nbytes
+        restored = 0
+        # Oldest first, so the LRU order matches last_seen
+        for device_id, samples, last_seen, blob in reversed(rows):
+            if len(blob) != row_bytes:
+                # Written with a different FIELDS/FEATURES layout
+                continue
+            slot = self._slot(device_id)
+            self._state[slot] = np.frombuffer(blob, dtype=np.float32).reshape(self._state[slot].shape)
+            self._samples[slot] = samples
+            self._last_seen[slot] = last_seen
+            self._dirty[slot] = False
+            restored += 1
+        return restored
+
+
+def scan_reports(db_path=DB_PATH, detector=None, chunk_size=20000):
+    """
+    Replay the stored reports in time order through a detector and yield
+    (report id, anomaly_flags, score) for the flagged ones.
+    """
+    if detector is None:
+        detector = StreamingDetector()
+    sql = f"SELECT id, Date_and_Time, device_id, {', '.join(FEATURES)} FROM reports ORDER BY Date_and_Time, id"
+    for chunk in pd.read_sql_query(sql, get_connection(db_path), chunksize=chunk_size):
+        timestamps = pd.to_datetime(chunk['Date_and_Time'], errors='coerce')
+        ts = (timestamps - pd.Timestamp(0)).dt.total_seconds().fillna(0.0).to_numpy()
+        devices = chunk['device_id'].fillna(DEFAULT_DEVICE).tolist()
+        mask, scores = detector.update(devices, chunk[FEATURES].to_numpy(dtype=float), ts)
+        for report_id, flags, score in zip(chunk['id'].tolist(), mask.tolist(), scores.tolist()):
+            if flags:
+                yield report_id, flags, score
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored reports through the streaming anomaly detector")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--limit', type=int, default=50, help="Flagged reports to print")
+    args = parser.parse_args()
+
+    flagged = 0
+    for report_id, flags, score in scan_reports(args.db):
+        if flagged < args.limit:
+            found = ', '.join(f'{metric} {kind}' for metric, kind in describe(flags))
+            print(f"report {report_id}: z {score:.1f}  {found}")
+        flagged += 1
+    print(f"{flagged:,} reports flagged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import glob
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from fileio import atomic_write
+from rules import rule_sections
+from storage import (DB_PATH, LISTING_COLUMNS, REPORT_COLUMNS, REPORT_METRICS, create_database,
+                     delete_archived_reports, get_connection, get_report_details, notify_write, query_reports)
+
+ARCHIVE_DIR = 'archive'
+
+# Rows read from the hot database per archive part file
+ARCHIVE_CHUNK_ROWS = 50000
+
+TEXT_COLUMNS = ['Date_and_Time', 'device_id', 'System_State', 'predicted_state', 'feedback', 'corrected_state',
+                'corrected_at']
+
+
+def _cutoff(days):
+    # Whole days only, so a day's rollup bucket is never split between the
+    # hot database and the archive
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def _partition_dir(archive_dir, month):
+    return os.path.join(archive_dir, f'reports-{month}')
+
+
+def _write_part(frame, archive_dir, keep_report_text):
+    # One compressed, column-per-array file per month and archive run
+    month = frame['Date_and_Time'].iloc[0][:7]
+    directory = _partition_dir(archive_dir, month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{frame['id'].min():012d}-{frame['id'].max():012d}.npz")
+
+    arrays = {'id': frame['id'].to_numpy(dtype=np.int64),
+              'rule_hits': frame['rule_hits'].fillna(-1).to_numpy(dtype=np.int64),
+              'anomaly_flags': frame['anomaly_flags'].fillna(-1).to_numpy(dtype=np.int64)}
+    for column in REPORT_METRICS:
+        arrays[column] = frame[column].to_numpy(dtype=float)
+    for column in TEXT_COLUMNS + (['report_text'] if keep_report_text else []):
+        arrays[column] = frame[column].fillna('').astype(str).to_numpy(dtype=str)
+
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    atomic_write(path, write)
+    return os.path.getsize(path)
+
+
+def archive_reports(older_than_days=90, rollup_horizon_days=365, archive_dir=ARCHIVE_DIR,
+                    keep_report_text=True, vacuum=False, db_path=DB_PATH):
+    """
+    Apply the retention policy to the reports table.
+
+    - Reports older than `older_than_days` are moved out of the hot database
+      into compressed columnar files under `archive_dir`, partitioned by month.
+      Edited report_text is kept compressed, or dropped with keep_report_text=False
+      (the report is then rendered from the metrics).
+    - Archive partitions and minute rollups older than `rollup_horizon_days`
+      are deleted. Only the hour and day rollups remain for that period.
+
+    Rollups of archived reports are left untouched, so trends stay complete.
+
+    Returns:
+    dict: Rows archived, bytes written, partitions and rollups removed
+    """
+    if rollup_horizon_days < older_than_days:
+        raise ValueError("rollup_horizon_days must not be shorter than older_than_days")
+    create_database(db_path)
+    conn = get_connection(db_path)
+    cutoff = _cutoff(older_than_days)
+    columns = ', '.join(['id', *REPORT_COLUMNS])
+    stats = {'cutoff': cutoff, 'rows_archived': 0, 'bytes_written': 0}
+
+    last_id = 0
+    while True:
+        chunk = pd.read_sql_query(
+            f"SELECT {columns} FROM reports WHERE Date_and_Time < ? AND id > ? ORDER BY id LIMIT ?",
+            conn, params=(cutoff, last_id, ARCHIVE_CHUNK_ROWS))
+        if chunk.empty:
+            break
+        chunk_last = int(chunk['id'].iloc[-1])
+        for _, frame in chunk.groupby(chunk['Date_and_Time'].str[:7]):
+            stats['bytes_written'] += _write_part(frame, archive_dir, keep_report_text)
+        # Only delete once the part files are safely on disk
+        delete_archived_reports(cutoff, last_id, chunk_last, db_path)
+        stats['rows_archived'] += len(chunk)
+        last_id = chunk_last
+
+    # Beyond the second horizon only the hour/day rollups are kept
+    horizon = _cutoff(rollup_horizon_days)
+    removed = 0
+    for directory in glob.glob(os.path.join(archive_dir, 'reports-*')):
+        if os.path.basename(directory)[len('reports-'):] < horizon[:7]:
+            shutil.rmtree(directory)
+            removed += 1
+    with conn:
+        deleted = conn.execute("DELETE FROM report_rollups WHERE granularity = 'minute' AND bucket < ?",
+                               (horizon,)).rowcount
+    stats['partitions_removed'] = removed
+    stats['minute_rollups_removed'] = deleted
+
+    notify_write(db_path)
+
+    if vacuum:
+        conn.execute("VACUUM")
+        # In WAL mode the file only shrinks once the log is checkpointed
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return stats
+
+
+def _archive_parts(archive_dir):
+    # Month partitions newest first
+    directories = sorted(glob.glob(os.path.join(archive_dir, 'reports-*')), reverse=True)
+    for directory in directories:
+        yield sorted(glob.glob(os.path.join(directory, 'part-*.npz')))
+
+
+def _load_parts(paths):
+    frames = []
+    for path in paths:
+        with np.load(path, allow_pickle=False) as arrays:
+            frames.append(pd.DataFrame({key: arrays[key] for key in arrays.files}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _filter_archive(frame, states=None, start=None, end=None, metric_ranges=None, search=None):
+    mask = np.ones(len(frame), dtype=bool)
+    if states:
+        mask &= frame['System_State'].isin(states).to_numpy()
+    if start:
+        mask &= (frame['Date_and_Time'] >= start).to_numpy()
+    if end:
+        mask &= (frame['Date_and_Time'] <= (end if len(end) > 10 else end + ' 23:59:59')).to_numpy()
+    for metric, (low, high) in (metric_ranges or {}).items():
+        if low is not None:
+            mask &= (frame[metric] >= low).to_numpy()
+        if high is not None:
+            mask &= (frame[metric] <= high).to_numpy()
+    if search:
+        # No full-text index in the archive; plain case-insensitive substring
+        # match over the texts the database indexes: the edited report text,
+        # or else the rule text the report is rendered from, and the feedback
+        rule_text = {hits: "\n".join(rule_sections(hits)) if hits >= 0 else ''
+                     for hits in frame['rule_hits'].unique().tolist()}
+        text = frame['rule_hits'].map(rule_text)
+        if 'report_text' in frame.columns:
+            text = frame['report_text'].where(frame['report_text'] != '', text)
+        text = text + '\n' + frame['feedback']
+        mask &= text.str.contains(search, case=False, regex=False).to_numpy()
+    return frame[mask]
+
+
+def query_archive(states=None, start=None, end=None, metric_ranges=None, search=None,
+                  after=None, page_size=50, archive_dir=ARCHIVE_DIR):
+    """Same contract as storage.query_reports, over the archive files."""
+    rows = []
+    needed = page_size + 1
+    for paths in _archive_parts(archive_dir):
+        month = os.path.basename(os.path.dirname(paths[0]))[len('reports-'):] if paths else None
+        if month is None or (start and month < start[:7]) or (after and month > after[0][:7]):
+            continue
+        if end and month > end[:7]:
+            continue
+        frame = _filter_archive(_load_parts(paths), states, start, end, metric_ranges, search)
+        if after:
+            older = (frame['Date_and_Time'] < after[0]) | (
+                (frame['Date_and_Time'] == after[0]) & (frame['id'] < after[1]))
+            frame = frame[older]
+        frame = frame.sort_values(['Date_and_Time', 'id'], ascending=False)
+        rows.append(frame)
+        needed -= len(frame)
+        if needed <= 0:
+            break
+
+    page = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=LISTING_COLUMNS)
+    page = page.reindex(columns=LISTING_COLUMNS).assign(archived=True)
+    # Archive files store '' for a NULL device_id or predicted_state
+    for column in ('device_id', 'predicted_state'):
+        page[column] = page[column].replace('', None)
+    if len(page) <= page_size:
+        return page, None
+    page = page.iloc[:page_size]
+    last = page.iloc[-1]
+    return page, (last['Date_and_Time'], int(last['id']))
+
+
+def query_all_reports(states=None, start=None, end=None, metric_ranges=None, search=None,
+                      after=None, page_size=50, db_path=DB_PATH, archive_dir=ARCHIVE_DIR):
+    """
+    Report listing across the hot database and the archive.
+
+    Archived reports are always older than the hot ones, so pages run through
+    the database first and continue into the archive with the same cursor.
+    """
+    page, cursor = query_reports(states, start, end, metric_ranges, search, after, page_size, db_path)
+    page = page.assign(archived=False)
+    if cursor is not None:
+        return page, cursor
+    if len(page):
+        last = page.iloc[-1]
+        after = (last['Date_and_Time'], int(last['id']))
+    remaining = page_size - len(page)
+    older, cursor = query_archive(states, start, end, metric_ranges, search, after,
+                                  max(remaining, 1), archive_dir)
+    if remaining == 0:
+        # The hot page is full; point the cursor into the archive if it has more
+        return page, after if len(older) else None
+    if page.empty:
+        return older, cursor
+    return pd.concat([page, older], ignore_index=True), cursor
+
+
+def get_archived_report_details(report_id, archive_dir=ARCHIVE_DIR):
+    """Same contract as storage.get_report_details, over the archive files."""
+    for paths in _archive_parts(archive_dir):
+        for path in paths:
+            first, last = os.path.basename(path)[len('part-'):-len('.npz')].split('-')
+            if int(first) <= report_id <= int(last):
+                frame = _load_parts([path])
+                match = frame[frame['id'] == report_id]
+                if len(match):
+                    details = match.iloc[0].to_dict()
+                    # Archive files store '' and -1 for NULL
+                    for column in ('device_id', 'predicted_state', 'report_text', 'feedback', 'corrected_state', 'corrected_at'):
+                        details[column] = details.get(column) or None
+                    for column in ('rule_hits', 'anomaly_flags'):
+                        value = details.get(column, -1)
+                        details[column] = None if value < 0 else int(value)
+                    return details
+    return None
+
+
+def get_any_report_details(report_id, db_path=DB_PATH, archive_dir=ARCHIVE_DIR):
+    return get_report_details(report_id, db_path) or get_archived_report_details(report_id, archive_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old reports into compressed archive files")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--older-than-days', type=int, default=90,
+                        help="Archive reports older than this (default: %(default)s)")
+    parser.add_argument('--rollup-horizon-days', type=int, default=365,
+                        help="Past this age keep only hour/day rollups (default: %(default)s)")
+    parser.add_argument('--drop-report-text', action='store_true',
+                        help="Don't archive report_text; it can be re-rendered from the metrics")
+    parser.add_argument('--vacuum', action='store_true', help="VACUUM the database afterwards")
+    args = parser.parse_args()
+
+    size_before = os.path.getsize(args.db)
+    stats = archive_reports(args.older_than_days, args.rollup_horizon_days, args.archive_dir,
+                            not args.drop_report_text, args.vacuum, args.db)
+    print(f"Archived {stats['rows_archived']:,} reports older than {stats['cutoff']} "
+          f"({stats['bytes_written']:,} bytes written), removed {stats['partitions_removed']} "
+          f"old partitions and {stats['minute_rollups_removed']:,} minute rollups; "
+          f"database {size_before:,} -> {os.path.getsize(args.db):,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import model
+import reports
+import retrain
+import storage
+from anomaly import StreamingDetector
+from compile_model import sample_inputs
+from llm import LLMClient, StubModel
+from rules import DEFAULT_RULES
+
+# Modules that must not be imported until a code path needs them
+LAZY_MODULES = ['google.generativeai', 'sklearn', 'joblib']
+
+# Cold import budget for the Streamlit app module, in milliseconds
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', 1000))
+
+# Table sizes for the suite's scale-dependent cases
+SUITE_SIZES = [10000, 100000, 1000000]
+BENCHMARK_OUTPUT = 'benchmark_results.json'
+BENCHMARK_BASELINE = 'benchmark_baseline.json'
+
+# Words sprinkled into synthetic feedback so full-text search has matches
+FEEDBACK_WORDS = ['fan', 'disk', 'reboot', 'router', 'firmware', 'outage', 'maintenance', 'spike']
+
+STARTUP_SNIPPET = (
+    "import time; start = time.perf_counter(); import model; model.get_model(); "
+    "print(time.perf_counter() - start)"
+)
+
+
+def time_startup(model_path, repeats=5):
+    """Median seconds for a fresh interpreter to import model.py and load `model_path`."""
+    env = dict(os.environ, MODEL_PATH=model_path, PYTHONWARNINGS='ignore')
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', STARTUP_SNIPPET], env=env,
+                             capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def import_times(module):
+    """
+    Import `module` in a fresh interpreter with -X importtime.
+
+    Returns:
+    (int, list, set): Cumulative microseconds for `module`, (name, microseconds)
+                      of each of its direct imports, and every module imported
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         env=dict(os.environ, PYTHONWARNINGS='ignore'), capture_output=True, text=True)
+    if out.returncode:
+        raise RuntimeError(f"Importing {module} failed:\n{out.stderr[-2000:]}")
+
+    total, children, imported = None, [], set()
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        imported.add(name)
+        # Children are reported before their parent
+        if depth == 0:
+            if name == module:
+                total = int(cumulative)
+                break
+            children = []
+        elif depth == 1:
+            children.append((name, int(cumulative)))
+    return total, children, imported
+
+
+def time_throughput(model_path, X, chunk_size=model.DEFAULT_CHUNK_SIZE):
+    """Rows per second of predict_batch with `model_path` already loaded."""
+    registry = model.ModelRegistry(model_path)
+    registry.get()
+    previous, model._registry = model._registry, registry
+    try:
+        start = time.perf_counter()
+        labels = model.predict_batch(X, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        model._registry = previous
+    return len(X) / elapsed, labels
+
+
+def bench_model(args):
+    X = sample_inputs(args.rows, seed=0)
+    reference = None
+    for path in args.models:
+        try:
+            rows_per_second, labels = time_throughput(path, X, args.chunk_size)
+        except (OSError, ValueError) as e:
+            print(f"{path:<24} skipped: {e}")
+            continue
+        startup = time_startup(path, args.repeats)
+        if reference is None:
+            reference = labels
+        agree = (labels == reference).mean() * 100
+        print(f"{path:<24} startup {startup * 1000:8.1f} ms   "
+              f"{rows_per_second:12,.0f} rows/s   labels agree with {args.models[0]}: {agree:.2f}%")
+
+
+def bench_startup(args):
+    totals = []
+    for _ in range(args.repeats):
+        total, children, imported = import_times(args.module)
+        totals.append(total / 1000)
+    median = statistics.median(totals)
+
+    print(f"import {args.module}: median {median:.1f} ms over {args.repeats} runs (budget {args.budget_ms:.0f} ms)")
+    for name, cumulative in sorted(children, key=lambda child: -child[1])[:args.top]:
+        print(f"  {name:<32} {cumulative / 1000:8.1f} ms")
+
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in imported]
+    if eager:
+        failures.append(f"imported at startup but should be lazy: {', '.join(eager)}")
+    if median > args.budget_ms:
+        failures.append(f"cold import took {median:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def time_llm_call(client, prompt):
+    """(time to first token, total seconds, error name or None) for one streamed call."""
+    start = time.perf_counter()
+    first = None
+    try:
+        for _ in client.stream(prompt):
+            if first is None:
+                first = time.perf_counter() - start
+    except Exception as e:
+        return first, time.perf_counter() - start, type(e).__name__
+    return first, time.perf_counter() - start, None
+
+
+def bench_llm(args):
+    fake = StubModel(args.first_token, answer=" ".join(["token"] * args.tokens), token_delay=args.token_delay,
+                     jitter=args.jitter, failure_rate=args.failure_rate, seed=0)
+    client = LLMClient(fake, timeout=args.timeout, retries=args.retries, backoff=args.backoff,
+                       semaphore=threading.BoundedSemaphore(args.max_in_flight))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        results = list(pool.map(lambda i: time_llm_call(client, f"question {i}"), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    errors = {}
+    for _, _, error in results:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    ok = [(first, total) for first, total, error in results if error is None]
+    print(f"{args.requests} requests from {args.sessions} sessions, {args.max_in_flight} in flight, "
+          f"{elapsed:.1f}s ({args.requests / elapsed:,.1f} req/s)")
+    if ok:
+        for name, values in (('first token', [first for first, _ in ok]), ('total', [total for _, total in ok])):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            print(f"{name:<12} p50 {p50:8.1f} ms   p95 {p95:8.1f} ms   p99 {p99:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+    print(f"client {client.stats()}   failed {errors or 0}")
+
+
+def bench_anomaly(args):
+    detector = StreamingDetector(max_devices=args.devices)
+    X = sample_inputs(args.batch_size, seed=0)
+    devices = [f'device-{i}' for i in range(args.devices)]
+    times = []
+    for i in range(args.batches + 1):
+        # Round-robin over the devices; a batch may hold a device more than once
+        batch = [devices[(i * args.batch_size + j) % args.devices] for j in range(args.batch_size)]
+        if i == args.batches:
+            # One extra traced batch for the working memory; tracing would skew the timings
+            tracemalloc.start()
+            detector.update(batch, X, np.full(len(batch), 1.7e9 + i))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            break
+        t = time.perf_counter()
+        detector.update(batch, X, np.full(len(batch), 1.7e9 + i))
+        times.append(time.perf_counter() - t)
+    samples = args.batches * args.batch_size
+    p50, p99 = np.percentile(times, [50, 99]) * 1000
+    print(f"{samples:,} samples over {len(detector):,} devices in batches of {args.batch_size:,}: "
+          f"{samples / sum(times):,.0f} samples/s, {1e6 * sum(times) / samples:.2f} us/sample")
+    print(f"batch p50 {p50:.2f} ms   p99 {p99:.2f} ms   state {detector._state.nbytes / 2**20:.1f} MiB   "
+          f"batch working memory {peak / 2**20:.1f} MiB")
+
+
+def synthetic_training_reports(n_rows, seed=0):
+    """Reports corrected to class 0-2 by how many rules fire (uniform inputs trip 6-10)."""
+    frame = synthetic_telemetry(n_rows, seed)
+    frame['System_State'] = DEFAULT_RULES.classify(frame)
+    frame['corrected_state'] = np.digitize(DEFAULT_RULES.masks(frame).sum(axis=1), [7, 9]).astype(str)
+    return frame
+
+
+def bench_train(args):
+    holdout = synthetic_training_reports(args.holdout, seed=10**6)
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = _fresh_db(directory, 'train.db')
+        output_path = os.path.join(directory, 'noc_pipeline.joblib')
+        storage.save_reports_many(synthetic_training_reports(args.rows).to_dict('records'), db_path)
+
+        def accuracy():
+            pipeline, _ = model.as_pipeline(retrain.joblib.load(output_path))
+            predicted = pipeline.predict(holdout[model.FEATURES].to_numpy(dtype=float)).astype(str)
+            return np.mean(predicted == holdout['corrected_state'].to_numpy())
+
+        start = time.perf_counter()
+        retrain.train_full(db_path, output_path)
+        full = time.perf_counter() - start
+        print(f"full      {args.rows:>9,} rows  {full:8.2f} s   holdout accuracy {accuracy():.3f}")
+
+        times, published = [], 0
+        for i in range(args.updates):
+            records = synthetic_training_reports(args.new_rows, seed=i + 1).to_dict('records')
+            storage.save_reports_many(records, db_path)
+            start = time.perf_counter()
+            # None when the held-out check discards the update
+            published += retrain.train_incremental(db_path, output_path, min_rows=1) is not None
+            times.append(time.perf_counter() - start)
+        p50 = np.percentile(times, 50)
+        manifest = retrain.read_manifest(output_path)
+        print(f"increment {args.new_rows:>9,} rows  {p50:8.2f} s p50 over {args.updates} updates "
+              f"({full / p50:,.0f}x faster), {published} published, last {manifest['training_mode']}, "
+              f"{manifest['training_rows']:,} rows in total, holdout accuracy {accuracy():.3f}")
+
+
+def synthetic_telemetry(n_rows, seed=0):
+    """DataFrame of `n_rows` snapshots of the 14 features, uniform over the UI input ranges."""
+    return pd.DataFrame(sample_inputs(n_rows, seed), columns=model.FEATURES)
+
+
+def synthetic_reports(n_rows, seed=0, days=365):
+    """
+    Report records as saved by the app: synthetic telemetry spread over the
+    last `days` days, labelled by the rule table, with feedback on 5% of rows.
+    """
+    frame = synthetic_telemetry(n_rows, seed)
+    rng = np.random.default_rng(seed + 1)
+    end = np.datetime64(datetime.now().replace(microsecond=0))
+    offsets = np.sort(rng.integers(0, days * 86400, n_rows))[::-1].astype('timedelta64[s]')
+    frame['Date_and_Time'] = np.datetime_as_string(end - offsets, unit='s')
+    frame['Date_and_Time'] = frame['Date_and_Time'].str.replace('T', ' ')
+    frame['System_State'] = DEFAULT_RULES.classify(frame)
+    words = rng.choice(FEEDBACK_WORDS, size=(n_rows, 3))
+    frame['feedback'] = np.where(rng.random(n_rows) < 0.05, [' '.join(row) for row in words], None)
+    return frame
+
+
+def measure(fn, repeats=20, warmup=1):
+    """
+    Latency percentiles of `repeats` timed calls of `fn`, plus the peak
+    traced allocation of one extra call. tracemalloc slows allocation
+    heavily, so the memory run is kept out of the timings.
+    """
+    for _ in range(warmup):
+        fn()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    ms = np.array(samples) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'repeats': repeats, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'mean_ms': ms.mean(), 'max_ms': ms.max(), 'peak_bytes': peak}
+
+
+def _bulk_load(records, db_path):
+    storage.create_database(db_path)
+    storage.save_reports_many(records, db_path)
+
+
+def _fresh_db(directory, name):
+    path = os.path.join(directory, name)
+    storage.create_database(path)
+    return path
+
+
+def run_suite(sizes, repeats, directory):
+    """Run every case and return {case name: measurement}."""
+    results = {}
+
+    def case(name, fn, **kwargs):
+        results[name] = measure(fn, **kwargs)
+        print(f"{name:<44} p50 {results[name]['p50_ms']:10.3f} ms   "
+              f"p99 {results[name]['p99_ms']:10.3f} ms   peak {results[name]['peak_bytes'] / 2**20:8.1f} MiB")
+
+    sample = synthetic_reports(1, seed=1).iloc[0].to_dict()
+    features = {name: sample[name] for name in model.FEATURES}
+    try:
+        model.get_model()
+        predicting = True
+    except ValueError as e:
+        print(f"Skipping the predict cases: {e}")
+        predicting = False
+    if predicting:
+        case('predict/single', lambda: model.predict(**features), repeats=repeats * 10)
+    case('rules/triggered/single', lambda: DEFAULT_RULES.triggered(sample), repeats=repeats * 50)
+    case('render_report/single', lambda: reports.render_report(sample), repeats=repeats * 50)
+    single_db = _fresh_db(directory, 'single.db')
+    case('save_report_to_db/single',
+         lambda: storage.save_report_to_db(features, sample['System_State'], None, None, single_db),
+         repeats=repeats * 10)
+
+    for n_rows in sizes:
+        frame = synthetic_reports(n_rows)
+        records = frame.to_dict('records')
+        if predicting:
+            case(f'predict_batch/{n_rows}', lambda: model.predict_batch(frame[model.FEATURES]), repeats=3)
+        case(f'render_reports/{n_rows}', lambda: reports.render_reports(frame), repeats=3)
+
+        # Inserts change the table, so each measured call loads a new database
+        db_path = os.path.join(directory, f'reports-{n_rows}.db')
+        loads = iter(range(10 ** 6))
+        case(f'save_reports_many/{n_rows}',
+             lambda: _bulk_load(records, f'{db_path}.{next(loads)}'), repeats=1, warmup=0)
+        del records
+        # Closing the connections checkpoints the WAL into the database files
+        storage.close_connections()
+        os.replace(f'{db_path}.1', db_path)
+        os.remove(f'{db_path}.0')
+
+        middle = frame['Date_and_Time'].iloc[n_rows // 2][:10]
+        case(f'get_saved_reports/{n_rows}', lambda: storage.get_saved_reports(db_path), repeats=3)
+        case(f'query_reports/{n_rows}/first_page',
+             lambda: storage.query_reports(page_size=25, db_path=db_path), repeats=repeats * 5)
+        case(f'query_reports/{n_rows}/state_and_dates',
+             lambda: storage.query_reports(['Abnormal'], start=middle, page_size=25, db_path=db_path),
+             repeats=repeats * 5)
+        case(f'query_reports/{n_rows}/metric_range',
+             lambda: storage.query_reports(metric_ranges={'Latency': (900, None)}, page_size=25,
+                                           db_path=db_path), repeats=repeats * 5)
+        case(f'search_reports/{n_rows}',
+             lambda: storage.search_reports('disk reboot', page_size=25, db_path=db_path), repeats=repeats * 5)
+        storage.close_connections()
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print each case against the baseline and return the regressed ones."""
+    regressions = []
+    print(f"\n{'case':<44} {'p50 ms':>10} {'baseline':>10} {'change':>8}   {'peak MiB':>9} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<44} {current['p50_ms']:10.3f} {'-':>10}")
+            continue
+        latency = current['p50_ms'] / previous['p50_ms'] - 1 if previous['p50_ms'] else 0.0
+        memory = current['peak_bytes'] / previous['peak_bytes'] - 1 if previous['peak_bytes'] else 0.0
+        regressed = latency > tolerance or memory > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<44} {current['p50_ms']:10.3f} {previous['p50_ms']:10.3f} {latency:+8.0%}   "
+              f"{current['peak_bytes'] / 2**20:9.1f} {memory:+8.0%}{'   REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def bench_suite(args):
+    directory = tempfile.mkdtemp(prefix='noc-bench-')
+    try:
+        results = run_suite(args.sizes, args.repeats, directory)
+    finally:
+        storage.close_connections()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'model_path': model.MODEL_PATH,
+        'sizes': args.sizes,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+    print(f"Wrote {args.output}")
+
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print(f"Saved as baseline {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} cases regressed more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the prediction hot paths")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    model_parser = commands.add_parser('model', help="Cold-start time and batch throughput per model artifact")
+    model_parser.add_argument('models', nargs='*', default=[model.MODEL_PATH, model.NUMPY_MODEL_PATH],
+                              help="Artifacts to compare (.joblib or .npz)")
+    model_parser.add_argument('--rows', type=int, default=50000)
+    model_parser.add_argument('--chunk-size', type=int, default=model.DEFAULT_CHUNK_SIZE)
+    model_parser.add_argument('--repeats', type=int, default=5)
+    model_parser.set_defaults(func=bench_model)
+
+    startup_parser = commands.add_parser('startup', help="Cold import time of the app per module; "
+                                                         "exits non-zero past the budget")
+    startup_parser.add_argument('--module', default='main')
+    startup_parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS)
+    startup_parser.add_argument('--repeats', type=int, default=5)
+    startup_parser.add_argument('--top', type=int, default=15, help="Slowest direct imports to list")
+    startup_parser.set_defaults(func=bench_startup)
+
+    llm_parser = commands.add_parser('llm', help="Time to first token and tail latency of the LLM client "
+                                                 "against the local stub backend")
+    llm_parser.add_argument('--requests', type=int, default=200)
+    llm_parser.add_argument('--sessions', type=int, default=32, help="Concurrent callers")
+    llm_parser.add_argument('--max-in-flight', type=int, default=4, help="Client concurrency cap")
+    llm_parser.add_argument('--first-token', type=float, default=0.2, help="Stub seconds to first token")
+    llm_parser.add_argument('--token-delay', type=float, default=0.005, help="Stub seconds between tokens")
+    llm_parser.add_argument('--tokens', type=int, default=50)
+    llm_parser.add_argument('--jitter', type=float, default=0.1)
+    llm_parser.add_argument('--failure-rate', type=float, default=0.05)
+    llm_parser.add_argument('--timeout', type=float, default=10.0)
+    llm_parser.add_argument('--retries', type=int, default=2)
+    llm_parser.add_argument('--backoff', type=float, default=0.1)
+    llm_parser.set_defaults(func=bench_llm)
+
+    anomaly_parser = commands.add_parser('anomaly', help="Streaming anomaly detector throughput and memory "
+                                                         "across many devices")
+    anomaly_parser.add_argument('--devices', type=int, default=50000)
+    anomaly_parser.add_argument('--batch-size', type=int, default=2000)
+    anomaly_parser.add_argument('--batches', type=int, default=200)
+    anomaly_parser.set_defaults(func=bench_anomaly)
+
+    train_parser = commands.add_parser('train', help="Full retrain against incremental updates "
+                                                     "on synthetic labelled reports")
+    train_parser.add_argument('--rows', type=int, default=5000, help="Reports in the initial full fit")
+    train_parser.add_argument('--new-rows', type=int, default=1000, help="New reports per incremental update")
+    train_parser.add_argument('--updates', type=int, default=5)
+    train_parser.add_argument('--holdout', type=int, default=5000)
+    train_parser.set_defaults(func=bench_train)
+
+    suite_parser = commands.add_parser('suite', help="Prediction, report rendering and storage at scale; "
+                                                     "JSON results compared against a baseline")
+    suite_parser.add_argument('--sizes', type=int, nargs='+', default=SUITE_SIZES)
+    suite_parser.add_argument('--repeats', type=int, default=20, help="Base repeat count for fast cases")
+    suite_parser.add_argument('--output', default=BENCHMARK_OUTPUT)
+    suite_parser.add_argument('--baseline', default=BENCHMARK_BASELINE)
+    suite_parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    suite_parser.add_argument('--tolerance', type=float, default=0.2,
+                              help="Allowed slowdown or memory growth against the baseline (default: %(default)s)")
+    suite_parser.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
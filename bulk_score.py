@@ -0,0 +1,148 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import model
+from rules import DEFAULT_RULES
+from storage import DB_PATH, create_database, save_reports_many
+
+
+def read_chunks(path, chunk_size):
+    """Yield DataFrames of at most `chunk_size` rows from a CSV or JSONL file."""
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size)
+    with reader:
+        yield from reader
+
+
+def _init_worker():
+    # Load the model once per worker process instead of once per chunk
+    model.get_model()
+
+
+def _score_chunk(frame):
+    return model.predict_batch(frame, chunk_size=len(frame) or 1)
+
+
+class FileWriter:
+    """Append scored chunks to a CSV or JSONL output file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.first = True
+
+    def write(self, frame):
+        if self.path.endswith(('.jsonl', '.ndjson', '.json')):
+            with open(self.path, 'w' if self.first else 'a') as f:
+                frame.to_json(f, orient='records', lines=True)
+        else:
+            frame.to_csv(self.path, mode='w' if self.first else 'a', header=self.first, index=False)
+        self.first = False
+
+    def close(self):
+        pass
+
+
+class ReportsWriter:
+    """
+    Insert scored chunks into the reports table, one transaction per chunk.
+
+    The model's label is stored as predicted_state; System_State gets the
+    rule table's 'Normal'/'Abnormal' like every other report.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        create_database(db_path)
+
+    def write(self, frame):
+        if 'Date_and_Time' in frame.columns:
+            frame = frame.assign(Date_and_Time=frame['Date_and_Time'].astype(str))
+        frame = frame.assign(predicted_state=frame['System_State'].astype(str),
+                             System_State=DEFAULT_RULES.classify(frame))
+        if 'device_id' in frame.columns:
+            # Numeric ids are stored as text; blank ones stay missing (no device)
+            ids = frame['device_id']
+            frame = frame.assign(device_id=ids.astype(str).where(ids.notna()))
+        save_reports_many(frame.to_dict('records'), self.db_path)
+
+    def close(self):
+        pass
+
+
+def score_file(input_path, writer, chunk_size=10000, workers=None, progress=True):
+    """
+    Stream `input_path` through the model and hand each scored chunk to `writer`.
+
+    Chunks are scored on a process pool. At most two chunks per worker are in
+    flight and results are written in input order as soon as they are ready,
+    so memory stays flat regardless of the input size.
+
+    Returns:
+    int: Number of rows scored
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    scored = 0
+    pending = deque()
+
+    def drain_one():
+        nonlocal scored
+        frame, future = pending.popleft()
+        frame = frame.assign(System_State=future.result())
+        writer.write(frame)
+        scored += len(frame)
+        if progress:
+            elapsed = time.perf_counter() - start
+            print(f"\r{scored:,} rows scored, {scored / elapsed:,.0f} rows/s", end='', file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for frame in read_chunks(input_path, chunk_size):
+            pending.append((frame, pool.submit(_score_chunk, frame)))
+            if len(pending) >= 2 * workers:
+                drain_one()
+        while pending:
+            drain_one()
+
+    if progress:
+        print(file=sys.stderr)
+    return scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV or JSONL telemetry file with the trained model")
+    parser.add_argument('input', help="CSV or JSONL file with the 14 feature columns")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--output', help="CSV or JSONL file to write scored rows to")
+    output.add_argument('--db', nargs='?', const=DB_PATH,
+                        help="Insert scored rows into the reports table (default: %(const)s)")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--quiet', action='store_true', help="Don't report progress")
+    args = parser.parse_args()
+
+    try:
+        # Fail once here rather than in every worker when the model can't be served
+        model.get_model()
+    except ValueError:
+        sys.exit(1)
+
+    writer = FileWriter(args.output) if args.output else ReportsWriter(args.db)
+    start = time.perf_counter()
+    try:
+        scored = score_file(args.input, writer, args.chunk_size, args.workers, not args.quiet)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"Scored {scored:,} rows in {elapsed:.1f}s ({scored / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import os
+
+import joblib
+import numpy as np
+
+from fileio import atomic_write
+from model import FEATURE_RANGES, FEATURES, MODEL_PATH, NUMPY_MODEL_PATH, NumpyModel, _legacy_scale, as_pipeline
+
+
+def _compile_scaler(scaler):
+    if getattr(scaler, 'func', None) is _legacy_scale:
+        return {'legacy_scaling': True,
+                'scaler_mean': np.zeros(len(FEATURES)), 'scaler_scale': np.ones(len(FEATURES))}
+    mean = scaler.mean_ if getattr(scaler, 'mean_', None) is not None else np.zeros(len(FEATURES))
+    scale = scaler.scale_ if getattr(scaler, 'scale_', None) is not None else np.ones(len(FEATURES))
+    return {'legacy_scaling': False,
+            'scaler_mean': np.asarray(mean, dtype=float), 'scaler_scale': np.asarray(scale, dtype=float)}
+
+
+def _flatten_trees(trees, n_outputs):
+    # trees is a list of (sklearn Tree, output column or None, weight); a
+    # column of None means the leaf value already holds one entry per output
+    roots, feature, threshold, left, right, value = [], [], [], [], [], []
+    depth = 0
+    offset = 0
+    for tree, column, weight in trees:
+        n_nodes = tree.node_count
+        index = np.arange(offset, offset + n_nodes)
+        is_leaf = tree.children_left == -1
+
+        roots.append(offset)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+        left.append(np.where(is_leaf, index, tree.children_left + offset))
+        right.append(np.where(is_leaf, index, tree.children_right + offset))
+
+        node_value = np.zeros((n_nodes, n_outputs))
+        if column is None:
+            fractions = tree.value[:, 0, :]
+            node_value[:] = fractions / fractions.sum(axis=1, keepdims=True)
+        else:
+            node_value[:, column] = tree.value[:, 0, 0]
+        value.append(node_value * weight)
+
+        depth = max(depth, tree.max_depth)
+        offset += n_nodes
+
+    return {
+        'roots': np.array(roots, dtype=np.int64),
+        'feature': np.concatenate(feature).astype(np.int64),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int64),
+        'right': np.concatenate(right).astype(np.int64),
+        'value': np.concatenate(value),
+        'depth': np.array(depth),
+    }
+
+
+def _compile_classifier(classifier):
+    from sklearn.dummy import DummyClassifier
+    from sklearn.ensemble import GradientBoostingClassifier
+
+    classes = np.asarray(classifier.classes_)
+    if isinstance(classifier, GradientBoostingClassifier):
+        n_outputs = classifier.estimators_.shape[1]
+        if isinstance(classifier.init_, str) and classifier.init_ == 'zero':
+            init = np.zeros(n_outputs)
+        elif isinstance(classifier.init_, DummyClassifier):
+            # A prior-based init is the same for every row
+            init = classifier._raw_predict_init(np.zeros((1, len(FEATURES))))[0]
+        else:
+            raise ValueError(f"Cannot compile GradientBoostingClassifier with init={classifier.init_!r}")
+        trees = [(stage[k].tree_, k, classifier.learning_rate)
+                 for stage in classifier.estimators_ for k in range(n_outputs)]
+        arrays = {'kind': 'trees', 'init': np.asarray(init, dtype=float), **_flatten_trees(trees, n_outputs)}
+        return arrays, 'binary' if n_outputs == 1 else 'argmax', classes
+
+    estimators = getattr(classifier, 'estimators_', [classifier])
+    if all(hasattr(estimator, 'tree_') for estimator in estimators):
+        # Random forests, extra trees and single decision trees average class fractions
+        trees = [(estimator.tree_, None, 1.0 / len(estimators)) for estimator in estimators]
+        arrays = {'kind': 'trees', 'init': np.zeros(len(classes)), **_flatten_trees(trees, len(classes))}
+        return arrays, 'argmax', classes
+
+    if hasattr(classifier, 'coef_') and hasattr(classifier, 'intercept_'):
+        coef = np.atleast_2d(np.asarray(classifier.coef_, dtype=float))
+        intercept = np.atleast_1d(np.asarray(classifier.intercept_, dtype=float))
+        arrays = {'kind': 'linear', 'coef': coef, 'init': intercept}
+        return arrays, 'binary' if len(coef) == 1 else 'argmax', classes
+
+    raise ValueError(f"Don't know how to compile {type(classifier).__name__}")
+
+
+def compile_pipeline(pipeline, version=0):
+    """Flatten a scaler + classifier pipeline into the arrays NumpyModel evaluates."""
+    arrays, decision, classes = _compile_classifier(pipeline.named_steps['classifier'])
+    arrays.update(_compile_scaler(pipeline.named_steps['scaler']))
+    arrays.update({
+        'decision': np.array(decision),
+        'classes': classes,
+        'features': np.array(FEATURES),
+        'version': np.array(version),
+    })
+    return arrays
+
+
+def sample_inputs(n_rows, seed=0, pipeline=None):
+    """Random rows over the UI input ranges, plus rows sitting on tree split points."""
+    rng = np.random.default_rng(seed)
+    low = np.array([FEATURE_RANGES[name][0] for name in FEATURES], dtype=float)
+    high = np.array([FEATURE_RANGES[name][1] for name in FEATURES], dtype=float)
+    X = rng.uniform(low, high, size=(n_rows, len(FEATURES)))
+
+    if pipeline is not None:
+        arrays = compile_pipeline(pipeline)
+        if arrays['kind'] == 'trees' and not arrays['legacy_scaling']:
+            # Put some features exactly on (unscaled) split thresholds
+            internal = np.isfinite(arrays['threshold'])
+            feature = arrays['feature'][internal]
+            raw = arrays['threshold'][internal] * arrays['scaler_scale'][feature] + arrays['scaler_mean'][feature]
+            picks = rng.integers(0, len(feature), size=n_rows)
+            X[np.arange(n_rows), feature[picks]] = raw[picks]
+    return X
+
+
+def check_parity(pipeline, numpy_model, n_rows=20000, seed=0):
+    """
+    Return the number of rows where the NumPy engine and scikit-learn disagree.
+
+    The scalers are compared on the sampled inputs and the classifiers on
+    the scaled rows, calling them directly. The legacy scaling maps every
+    input to zeros, so its classifier gets rows drawn in scaled space
+    instead. Raises ValueError if the classifier inputs collapse to one row.
+    """
+    scaler, classifier = pipeline.named_steps['scaler'], pipeline.named_steps['classifier']
+    rng = np.random.default_rng(seed)
+    X = sample_inputs(n_rows, seed, pipeline)
+    scaled = scaler.transform(X)
+    scaler_mismatches = np.sum(~np.isclose(numpy_model._transform(X), scaled).all(axis=1))
+
+    if numpy_model.legacy_scaling:
+        scaled = rng.normal(scale=2.0, size=X.shape)
+        if numpy_model.kind == 'trees':
+            # Put some features exactly on split thresholds, which are in scaled space
+            internal = np.isfinite(numpy_model.threshold)
+            feature, threshold = numpy_model.feature[internal], numpy_model.threshold[internal]
+            picks = rng.integers(0, len(feature), size=n_rows)
+            scaled[np.arange(n_rows), feature[picks]] = threshold[picks]
+    if len(np.unique(scaled, axis=0)) < 2:
+        raise ValueError("Parity inputs collapse to a single row after scaling; the check would compare nothing")
+
+    expected = classifier.predict(scaled)
+    actual = numpy_model.predict(scaled, scaled=True)
+    return int(scaler_mismatches + np.sum(expected != actual))
+
+
+def export_numpy_model(model_path=MODEL_PATH, output_path=NUMPY_MODEL_PATH, parity_rows=20000):
+    """
+    Compile the joblib model into a compressed .npz for NumpyModel.
+
+    The export is refused if the compiled model disagrees with scikit-learn
+    on any of `parity_rows` generated inputs.
+    """
+    pipeline, metadata = as_pipeline(joblib.load(model_path))
+    arrays = compile_pipeline(pipeline, metadata.get('version') or 0)
+
+    numpy_model = NumpyModel(arrays)
+    if parity_rows:
+        mismatches = check_parity(pipeline, numpy_model, parity_rows)
+        if mismatches:
+            raise ValueError(f"Compiled model disagrees with scikit-learn on {mismatches}/{parity_rows} rows")
+
+    def write(path):
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    atomic_write(output_path, write)
+    return numpy_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the joblib model into a NumPy-only .npz")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--output', default=NUMPY_MODEL_PATH)
+    parser.add_argument('--parity-rows', type=int, default=20000,
+                        help="Generated rows checked against scikit-learn before saving (0 to skip)")
+    args = parser.parse_args()
+
+    numpy_model = export_numpy_model(args.model, args.output, args.parity_rows)
+    print(f"Compiled {args.model} ({numpy_model.kind}) to {args.output} "
+          f"({os.path.getsize(args.output)} bytes), parity checked on {args.parity_rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import hashlib
+import os
+import tempfile
+
+
+def atomic_write(path, write):
+    """
+    Replace `path` with the file produced by `write`, all at once.
+
+    write(tmp_path) writes the new contents to a temporary file next to the
+    target, which is then renamed over it, so readers see either the old
+    file or the complete new one, never a partial write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file's contents, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,524 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+import model
+from anomaly import DEFAULT_DEVICE, StreamingDetector, parse_time
+from metrics import REGISTRY, count, observe
+from rules import DEFAULT_RULES
+from storage import DB_PATH, create_database, get_connection, save_reports_many
+
+INGEST_HOST = os.getenv('INGEST_HOST', '127.0.0.1')
+INGEST_TCP_PORT = int(os.getenv('INGEST_TCP_PORT', 8700))
+INGEST_UDP_PORT = int(os.getenv('INGEST_UDP_PORT', 8701))
+
+# Records waiting to be scored; past this the overload policy applies
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 20000))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 2000))
+INGEST_MAX_WAIT = float(os.getenv('INGEST_MAX_WAIT', 0.2))
+
+# Overload policy when the queue is full:
+#   'block' - TCP connections and file tails stop reading until there is
+#             room, so backpressure reaches the sender through the socket
+#             buffers (or the file simply grows). Nothing is lost.
+#   'drop'  - records that don't fit are dropped and counted.
+# UDP has no way to push back, so datagrams are always dropped when full.
+INGEST_POLICY = os.getenv('INGEST_POLICY', 'block')
+POLICIES = ('block', 'drop')
+
+# Longest accepted NDJSON line
+MAX_LINE_BYTES = 64 * 1024
+
+# Scored batches waiting for the database; keeps scoring one step ahead of inserts
+WRITE_QUEUE_BATCHES = 2
+
+# Seconds between checkpoints of the streaming anomaly detector's state
+ANOMALY_CHECKPOINT_INTERVAL = float(os.getenv('ANOMALY_CHECKPOINT_INTERVAL', 60))
+
+
+def parse_record(line):
+    """
+    Parse and validate one NDJSON telemetry record.
+
+    Parameters:
+    line (bytes or str): One JSON object with the 14 feature values and
+                         optional Date_and_Time and device_id strings
+
+    Returns:
+    dict: The features as floats, Date_and_Time and device_id (None if not given)
+    """
+    try:
+        payload = json.loads(line)
+    except ValueError:
+        raise ValueError("Record is not valid JSON") from None
+    if not isinstance(payload, dict):
+        raise ValueError("Record must be a JSON object")
+    missing = [name for name in model.FEATURES if name not in payload]
+    if missing:
+        raise ValueError(f"Record is missing features: {missing}")
+    try:
+        record = {name: float(payload[name]) for name in model.FEATURES}
+    except (TypeError, ValueError):
+        raise ValueError("Feature values must be numbers") from None
+    if not all(math.isfinite(value) for value in record.values()):
+        raise ValueError("Feature values must be finite")
+    timestamp = payload.get('Date_and_Time')
+    if timestamp is not None and not isinstance(timestamp, str):
+        raise ValueError("Date_and_Time must be a string")
+    record['Date_and_Time'] = timestamp
+    device_id = payload.get('device_id')
+    if device_id is not None and not isinstance(device_id, str):
+        raise ValueError("device_id must be a string")
+    record['device_id'] = device_id
+    return record
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def datagram_received(self, data, addr):
+        # A datagram may carry several newline-separated records
+        for line in data.splitlines():
+            if line.strip():
+                self.daemon.offer_nowait(line, 'udp')
+
+
+class IngestDaemon:
+    """
+    Continuous telemetry ingestion: sources -> bounded queue -> batched
+    scoring through model.predict_batch -> batched inserts into reports.
+
+    Sources are TCP and UDP sockets carrying newline-delimited JSON, and
+    tailed JSONL files. Records are validated on arrival; invalid ones are
+    counted and skipped. Scoring and inserting run in the default executor,
+    one stage apart, so the event loop keeps accepting input meanwhile.
+
+    Each record gets the rule state in System_State and the model label in
+    predicted_state. It also goes through the streaming anomaly detector
+    (keyed by device_id) and its flags are stored in anomaly_flags.
+    The detector's state is checkpointed to the database periodically and on
+    stop, and restored on start.
+    """
+
+    def __init__(self, db_path=DB_PATH, queue_size=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE,
+                 max_wait=INGEST_MAX_WAIT, policy=INGEST_POLICY, detector=None,
+                 checkpoint_interval=ANOMALY_CHECKPOINT_INTERVAL):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}, got {policy!r}")
+        self.db_path = db_path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.policy = policy
+        # Pass detector=False to skip anomaly detection. Compared with `is`:
+        # a detector with no devices yet is falsy (it has a __len__)
+        if detector is None:
+            detector = StreamingDetector()
+        self.detector = None if detector is False else detector
+        self.checkpoint_interval = checkpoint_interval
+        self.counts = Counter()
+        self.started_at = None
+        self._servers = []
+        self._tasks = []
+        self._queue_gauge = REGISTRY.gauge('ingest_queue_depth', "Records waiting to be scored")
+
+    def _count(self, stage, source, amount=1):
+        self.counts[stage] += amount
+        count('ingest_records', amount, help="Ingested records by stage and source", stage=stage, source=source)
+
+    def _parse(self, line, source):
+        self._count('received', source)
+        try:
+            return parse_record(line), time.time()
+        except ValueError:
+            self._count('invalid', source)
+            return None
+
+    async def offer(self, line, source):
+        """Queue one line from a source that can be paused (TCP, files)."""
+        item = self._parse(line, source)
+        if item is None:
+            return
+        if self.policy == 'block':
+            await self.queue.put(item)
+            self._count('accepted', source)
+        else:
+            self._put_nowait(item, source)
+
+    def offer_nowait(self, line, source):
+        """Queue one line from a source that can't be paused (UDP); drops it when full."""
+        item = self._parse(line, source)
+        if item is not None:
+            self._put_nowait(item, source)
+
+    def _put_nowait(self, item, source):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._count('dropped', source)
+            return
+        self._count('accepted', source)
+
+    async def _collect(self):
+        # Wait for one record, then take up to batch_size arriving within max_wait
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.batch_size:
+            if self.queue.empty():
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self.queue.get_nowait())
+        self._queue_gauge.set(self.queue.qsize())
+        return batch
+
+    def _score_batch(self, batch):
+        # Runs in the executor; the matrix is built once for the model, the
+        # rule table and the detector
+        X = np.array([[record[name] for name in model.FEATURES] for record, _ in batch], dtype=float)
+        labels = model.predict_batch(X)
+        states = DEFAULT_RULES.classify(dict(zip(model.FEATURES, X.T)))
+        if self.detector is None:
+            return labels, states, np.zeros(len(batch), dtype=np.int64)
+        devices = [record['device_id'] or DEFAULT_DEVICE for record, _ in batch]
+        timestamps = [parse_time(record['Date_and_Time'], received) for record, received in batch]
+        flags, _ = self.detector.update(devices, X, timestamps)
+        return labels, states, flags
+
+    async def _checkpoint(self):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.detector.checkpoint, self.db_path)
+        except Exception as e:
+            print(f"Anomaly detector checkpoint failed: {e}")
+
+    async def _score(self):
+        loop = asyncio.get_running_loop()
+        checkpointed = time.monotonic()
+        while True:
+            batch = await self._collect()
+            try:
+                labels, states, flags = await loop.run_in_executor(None, self._score_batch, batch)
+            except Exception as e:
+                print(f"Scoring failed for {len(batch)} records: {e}")
+                self._count('failed', 'score', len(batch))
+                self._done(len(batch))
+                continue
+            self._count('scored', 'model', len(batch))
+            self._count('anomalous', 'detector', int(np.count_nonzero(flags)))
+            await self.write_queue.put((batch, labels, states, flags))
+            # Checkpoints run between batches, so the detector is never read mid-update
+            if self.detector is not None and time.monotonic() - checkpointed >= self.checkpoint_interval:
+                await self._checkpoint()
+                checkpointed = time.monotonic()
+
+    async def _write(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch, labels, states, flags = await self.write_queue.get()
+            # System_State is the rule table's verdict, as for every other
+            # report; the model's label is kept next to it
+            rows = [{**record,
+                     'Date_and_Time': record['Date_and_Time'] or
+                     datetime.fromtimestamp(received).strftime("%Y-%m-%d %H:%M:%S"),
+                     'System_State': state,
+                     'predicted_state': str(label),
+                     'anomaly_flags': anomaly_flags}
+                    for (record, received), label, state, anomaly_flags
+                    in zip(batch, labels.tolist(), states.tolist(), flags.tolist())]
+            try:
+                await loop.run_in_executor(None, save_reports_many, rows, self.db_path)
+            except Exception as e:
+                print(f"Inserting {len(rows)} reports failed: {e}")
+                self._count('failed', 'store', len(rows))
+            else:
+                self._count('stored', 'db', len(rows))
+                now = time.time()
+                for _, received in batch:
+                    observe('ingest_lag', now - received, help="Seconds from receipt to stored report")
+            self._done(len(batch))
+
+    def _done(self, n):
+        for _ in range(n):
+            self.queue.task_done()
+
+    async def _handle_tcp(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await self.offer(line, 'tcp')
+        except ValueError:
+            # Line longer than MAX_LINE_BYTES; the stream can't be resynchronised
+            self._count('invalid', 'tcp')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def tail(self, path, from_start=False, poll_interval=0.2):
+        """
+        Follow a JSONL file like tail -F: new complete lines are ingested,
+        and the file is reopened from the start when it is rotated or truncated.
+        """
+        f, inode = None, None
+        try:
+            while True:
+                if f is None:
+                    try:
+                        f = open(path, 'rb')
+                    except FileNotFoundError:
+                        await asyncio.sleep(poll_interval)
+                        continue
+                    inode = os.fstat(f.fileno()).st_ino
+                    if not from_start:
+                        f.seek(0, os.SEEK_END)
+                    # A rotated or recreated file is read from its beginning
+                    from_start = True
+
+                line = f.readline(MAX_LINE_BYTES + 1)
+                if line.endswith(b'\n'):
+                    if line.strip():
+                        await self.offer(line, 'file')
+                    continue
+                if len(line) > MAX_LINE_BYTES:
+                    self._count('invalid', 'file')
+                    f.readline()
+                    continue
+                # Partial line: wait for the writer to finish it
+                f.seek(-len(line), os.SEEK_CUR)
+                await asyncio.sleep(poll_interval)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    stat = None
+                if stat is None or stat.st_ino != inode or stat.st_size < f.tell():
+                    f.close()
+                    f = None
+        finally:
+            if f is not None:
+                f.close()
+
+    async def start(self, host=INGEST_HOST, tcp_port=INGEST_TCP_PORT, udp_port=INGEST_UDP_PORT, tail_paths=(),
+                    from_start=False):
+        """Load the model, open the sources and start the pipeline. A port of None disables that source."""
+        create_database(self.db_path)
+        await asyncio.get_running_loop().run_in_executor(None, model.get_model)
+        if self.detector is not None:
+            restored = await asyncio.get_running_loop().run_in_executor(None, self.detector.restore, self.db_path)
+            if restored:
+                print(f"Restored anomaly detector state for {restored:,} devices")
+        self.queue = asyncio.Queue(self.queue_size)
+        self.write_queue = asyncio.Queue(WRITE_QUEUE_BATCHES)
+        self.started_at = time.time()
+        self._tasks = [asyncio.create_task(self._score()), asyncio.create_task(self._write())]
+
+        if tcp_port is not None:
+            server = await asyncio.start_server(self._handle_tcp, host, tcp_port, limit=MAX_LINE_BYTES)
+            self._servers.append(server)
+            print(f"Ingesting NDJSON over TCP on {host}:{server.sockets[0].getsockname()[1]}")
+        if udp_port is not None:
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=(host, udp_port))
+            self._servers.append(transport)
+            print(f"Ingesting NDJSON over UDP on {host}:{transport.get_extra_info('sockname')[1]}")
+        for path in tail_paths:
+            self._tasks.append(asyncio.create_task(self.tail(path, from_start)))
+            print(f"Tailing {path}")
+
+    async def stop(self):
+        """Stop accepting input, finish scoring and storing what was queued, then shut down."""
+        for server in self._servers:
+            server.close()
+        for task in self._tasks[2:]:
+            task.cancel()
+        await self.queue.join()
+        for task in self._tasks[:2]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.detector is not None:
+            await self._checkpoint()
+
+    def stats(self):
+        elapsed = max(time.time() - (self.started_at or time.time()), 1e-9)
+        return {
+            **dict(self.counts),
+            'queue_depth': self.queue.qsize(),
+            'stored_per_second': self.counts['stored'] / elapsed,
+            'uptime_seconds': elapsed,
+        }
+
+
+async def serve(args):
+    daemon = IngestDaemon(args.db, args.queue_size, args.batch_size, args.max_wait_ms / 1000, args.policy,
+                          detector=False if args.no_anomaly else None,
+                          checkpoint_interval=args.checkpoint_interval)
+    await daemon.start(args.host, args.tcp_port or None, args.udp_port or None, args.tail, args.from_start)
+    # SIGTERM shuts down like Ctrl-C: queued records are stored and the detector checkpointed
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    previous = Counter()
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            stats = daemon.stats()
+            rates = {stage: (daemon.counts[stage] - previous[stage]) / args.stats_interval
+                     for stage in ('received', 'stored', 'dropped', 'invalid', 'anomalous')}
+            previous = Counter(daemon.counts)
+            print(f"received {rates['received']:,.0f}/s  stored {rates['stored']:,.0f}/s  "
+                  f"dropped {rates['dropped']:,.0f}/s  invalid {rates['invalid']:,.0f}/s  "
+                  f"anomalous {rates['anomalous']:,.0f}/s  "
+                  f"queue {stats['queue_depth']:,}  total stored {daemon.counts['stored']:,}")
+    finally:
+        await daemon.stop()
+
+
+def _replay_lines(args):
+    if args.synthetic:
+        from compile_model import sample_inputs
+        X = sample_inputs(args.synthetic, seed=args.seed)
+        for i, row in enumerate(X):
+            record = dict(zip(model.FEATURES, row.tolist()))
+            if args.devices:
+                record['device_id'] = f'device-{i % args.devices}'
+            yield json.dumps(record).encode() + b'\n'
+    elif args.input.endswith('.csv'):
+        from bulk_score import read_chunks
+        for frame in read_chunks(args.input, 10000):
+            for line in frame.to_json(orient='records', lines=True).splitlines():
+                yield line.encode() + b'\n'
+    else:
+        with open(args.input, 'rb') as f:
+            for line in f:
+                yield line if line.endswith(b'\n') else line + b'\n'
+
+
+def _report_count(db_path):
+    return get_connection(db_path).execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+
+def replay(args):
+    """Send a JSONL/CSV file or synthetic records to a running ingest daemon, optionally rate limited."""
+    scheme, _, target = args.to.partition('://')
+    if scheme not in ('tcp', 'udp', 'file'):
+        raise ValueError("--to must be tcp://host:port, udp://host:port or file://path")
+    before = _report_count(args.verify_db) if args.verify_db else None
+
+    if scheme == 'file':
+        out = open(target, 'ab')
+        send = lambda data: (out.write(data), out.flush())
+    else:
+        host, _, port = target.rpartition(':')
+        address = (host or '127.0.0.1', int(port))
+        if scheme == 'tcp':
+            out = socket.create_connection(address)
+            send = out.sendall
+        else:
+            out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            send = lambda data: out.sendto(data, address)
+
+    start = time.perf_counter()
+    sent = 0
+    pending = []
+    pending_bytes = 0
+    # UDP datagrams stay under a typical MTU; streams are written in larger blocks
+    block_bytes = 1400 if scheme == 'udp' else 64 * 1024
+    try:
+        for line in _replay_lines(args):
+            if pending and pending_bytes + len(line) > block_bytes:
+                send(b''.join(pending))
+                pending, pending_bytes = [], 0
+            pending.append(line)
+            pending_bytes += len(line)
+            sent += 1
+            if args.rate:
+                # Stay on the schedule of `rate` records per second
+                ahead = sent / args.rate - (time.perf_counter() - start)
+                if ahead > 0:
+                    if pending:
+                        send(b''.join(pending))
+                        pending, pending_bytes = [], 0
+                    time.sleep(ahead)
+        if pending:
+            send(b''.join(pending))
+    finally:
+        out.close()
+    elapsed = time.perf_counter() - start
+    print(f"Sent {sent:,} records in {elapsed:.2f}s ({sent / max(elapsed, 1e-9):,.0f}/s) to {args.to}")
+
+    if args.verify_db:
+        deadline = time.monotonic() + args.timeout
+        stored = 0
+        while time.monotonic() < deadline:
+            stored = _report_count(args.verify_db) - before
+            if stored >= sent:
+                break
+            time.sleep(0.1)
+        total = time.perf_counter() - start
+        print(f"{stored:,} of {sent:,} records stored after {total:.2f}s")
+        if stored < sent:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuous telemetry ingestion into the reports table")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="Run the ingest daemon")
+    serve_parser.add_argument('--host', default=INGEST_HOST)
+    serve_parser.add_argument('--tcp-port', type=int, default=INGEST_TCP_PORT, help="0 disables TCP")
+    serve_parser.add_argument('--udp-port', type=int, default=INGEST_UDP_PORT, help="0 disables UDP")
+    serve_parser.add_argument('--tail', action='append', default=[], help="JSONL file to follow (repeatable)")
+    serve_parser.add_argument('--from-start', action='store_true', help="Read tailed files from the beginning")
+    serve_parser.add_argument('--db', default=DB_PATH)
+    serve_parser.add_argument('--policy', choices=POLICIES, default=INGEST_POLICY,
+                              help="What TCP and file sources do when the queue is full (default: %(default)s)")
+    serve_parser.add_argument('--queue-size', type=int, default=INGEST_QUEUE_SIZE)
+    serve_parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=INGEST_MAX_WAIT * 1000)
+    serve_parser.add_argument('--stats-interval', type=float, default=10.0)
+    serve_parser.add_argument('--no-anomaly', action='store_true', help="Skip the streaming anomaly detector")
+    serve_parser.add_argument('--checkpoint-interval', type=float, default=ANOMALY_CHECKPOINT_INTERVAL,
+                              help="Seconds between anomaly detector checkpoints (default: %(default)s)")
+
+    replay_parser = commands.add_parser('replay', help="Drive a running daemon from a file or synthetic data")
+    source = replay_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('input', nargs='?', help="JSONL or CSV file with the 14 feature columns")
+    source.add_argument('--synthetic', type=int, help="Send this many random records instead")
+    replay_parser.add_argument('--to', default=f'tcp://{INGEST_HOST}:{INGEST_TCP_PORT}',
+                               help="tcp://host:port, udp://host:port or file://path (default: %(default)s)")
+    replay_parser.add_argument('--rate', type=float, default=0, help="Records per second (default: as fast as possible)")
+    replay_parser.add_argument('--seed', type=int, default=0)
+    replay_parser.add_argument('--devices', type=int, default=0,
+                               help="Spread synthetic records round-robin over this many device ids")
+    replay_parser.add_argument('--verify-db', help="Wait until this database holds every sent record")
+    replay_parser.add_argument('--timeout', type=float, default=60.0)
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+    else:
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
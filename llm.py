@@ -0,0 +1,425 @@
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from metrics import count, observe
+from rules import DEFAULT_RULES
+from storage import get_connection
+
+# Gemini answers are cached in memory and in a small SQLite file next to the
+# reports database, so a rerun with the same question is served locally
+LLM_CACHE_DB = os.getenv('LLM_CACHE_DB', 'llm_cache.db')
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', 256))
+
+# 'gemini', or 'stub' to answer offline with StubModel
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+# Simulated latency of the stub backend, in seconds
+LLM_STUB_FIRST_TOKEN = float(os.getenv('LLM_STUB_FIRST_TOKEN', 0))
+LLM_STUB_TOKEN_DELAY = float(os.getenv('LLM_STUB_TOKEN_DELAY', 0))
+
+# Per-call deadline, retries before the first token and the cap on requests
+# in flight across all sessions of this process
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_BACKOFF = float(os.getenv('LLM_BACKOFF', 0.5))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+
+CACHE_SCHEMA = '''CREATE TABLE IF NOT EXISTS llm_cache
+                  (key TEXT PRIMARY KEY,
+                   response TEXT NOT NULL,
+                   bytes INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL)'''
+
+
+def build_qa_prompt(input_data, prediction, question):
+    """
+    Build the Q&A prompt for a snapshot and a question.
+
+    Parameters:
+    input_data (dict): Dictionary containing system metrics
+    prediction (str): System state prediction
+    question (str): The user's question
+
+    Returns:
+    str: The prompt sent to the model
+    """
+    return f"""
+            You are a helpful system monitoring assistant. Here is the current system information:
+
+            System Status: {prediction}
+            CPU Utilization: {input_data['CPU_Utilization']}%
+            Memory Usage: {input_data['Memory_Usage']}%
+            Bandwidth Utilization: {input_data['Bandwidth_Utilization']} Mbps
+            Throughput: {input_data['Throughput']} Mbps
+            Latency: {input_data['Latency']} ms
+            Jitter: {input_data['Jitter']} ms
+            Packet Loss: {input_data['Packet_Loss']}%
+            Error Rates: {input_data['Error_Rates']}%
+            Connection Establishment/Termination Times: {input_data['Connection_Establishment_Termination_Times']} ms
+            Network Availability: {input_data['Network_Availability']}%
+            Transmission Delay: {input_data['Transmission_Delay']} ms
+            Grid Voltage: {input_data['Grid_Voltage']} V
+            Cooling Temperature: {input_data['Cooling_Temperature']}°C
+            Network Traffic Volume: {input_data['Network_Traffic_Volume']} GB
+
+            The system is considered abnormal if any of these conditions are met:
+{DEFAULT_RULES.describe('critical')}
+
+            Please provide a natural, conversational response to this question: {question}
+            """
+
+
+def prompt_key(prompt):
+    # Whitespace and case don't change the answer, so they don't change the key
+    normalized = re.sub(r'\s+', ' ', prompt).strip().lower()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses keyed by prompt_key().
+
+    An in-memory LRU of `memory_entries` responses sits in front of an
+    SQLite table. Entries expire `ttl` seconds after they were created, and
+    the least recently used ones are evicted once the stored responses
+    exceed `max_bytes`.
+    """
+
+    def __init__(self, db_path=LLM_CACHE_DB, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES,
+                 memory_entries=LLM_CACHE_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        # Memory hits since the last write, flushed to last_used before evicting
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0,
+                       'hit_seconds': 0.0, 'miss_seconds': 0.0}
+        conn = get_connection(db_path)
+        with conn:
+            conn.execute(CACHE_SCHEMA)
+
+    def _remember(self, key, response, created_at):
+        # Caller holds the lock
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached response for `key` and which tier it came from, or (None, None)."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._memory.move_to_end(key)
+                    self._touched[key] = now
+                    return entry[0], 'memory'
+                del self._memory[key]
+
+        conn = get_connection(self.db_path)
+        row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ? AND created_at > ?",
+                           (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None, None
+        with conn:
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self._remember(key, row[0], row[1])
+        return row[0], 'disk'
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            touched, self._touched = self._touched, {}
+        conn = get_connection(self.db_path)
+        with conn:
+            conn.executemany("UPDATE llm_cache SET last_used = ? WHERE key = ?",
+                             [(used, touched_key) for touched_key, used in touched.items()])
+            conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                         (key, response, len(response.encode('utf-8')), now, now))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        expired = conn.execute("DELETE FROM llm_cache WHERE created_at <= ? RETURNING key",
+                               (now - self.ttl,)).fetchall()
+        # Keep the most recently used entries that fit in max_bytes
+        evicted = conn.execute('''DELETE FROM llm_cache WHERE key IN (
+                                      SELECT key FROM (
+                                          SELECT key, SUM(bytes) OVER (ORDER BY last_used DESC, key) AS total
+                                          FROM llm_cache)
+                                      WHERE total > ?)
+                                  RETURNING key''', (self.max_bytes,)).fetchall()
+        with self._lock:
+            # Entries evicted from disk must not be served from memory either
+            for (key,) in expired + evicted:
+                self._memory.pop(key, None)
+                self._touched.pop(key, None)
+            self._stats['evictions'] += len(expired) + len(evicted)
+
+    def get_or_generate(self, prompt, generate):
+        """
+        Return (response, source) for `prompt`, calling `generate(prompt)`
+        only on a miss. source is 'memory', 'disk' or 'model'.
+        """
+        start = time.perf_counter()
+        key = prompt_key(prompt)
+        response, source = self.get(key)
+        if response is None:
+            response = generate(prompt)
+            self.put(key, response)
+            source = 'model'
+        self.record(source, time.perf_counter() - start)
+        return response, source
+
+    def record(self, source, seconds):
+        """Count one lookup answered by `source` ('memory', 'disk' or 'model') in `seconds`."""
+        count('llm_cache_lookups', help="Q&A answers by source (memory, disk, model)", source=source)
+        with self._lock:
+            if source == 'model':
+                self._stats['misses'] += 1
+                self._stats['miss_seconds'] += seconds
+            else:
+                self._stats[f'{source}_hits'] += 1
+                self._stats['hit_seconds'] += seconds
+
+    def stats(self, disk=True):
+        """Hit/miss counts, hit ratio, mean latency per outcome and, with disk=True, the size of the disk tier."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+        stats['mean_hit_ms'] = 1000 * stats.pop('hit_seconds') / hits if hits else 0.0
+        stats['mean_miss_ms'] = 1000 * stats.pop('miss_seconds') / stats['misses'] if stats['misses'] else 0.0
+        if not disk:
+            return stats
+        entries, size = get_connection(self.db_path).execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM llm_cache").fetchone()
+        stats['disk_entries'] = entries
+        stats['disk_bytes'] = size
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+        conn = get_connection(self.db_path)
+        with conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+class StubModel:
+    """
+    Offline stand-in for genai.GenerativeModel.
+
+    Answers every prompt with a canned response and records the prompts it
+    was sent, so the client and the cache can be exercised without an API
+    key or network access. For load tests it can simulate latency: `delay`
+    seconds (+/- `jitter`) before the first token, `token_delay` between
+    tokens, and a `failure_rate` share of calls failing before any output.
+    """
+
+    def __init__(self, delay=0.0, answer="Stub answer to: {question}", token_delay=0.0,
+                 jitter=0.0, failure_rate=0.0, seed=None):
+        self.delay = delay
+        self.answer = answer
+        self.token_delay = token_delay
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.prompts = []
+        self._random = random.Random(seed)
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        question = prompt.rsplit(':', 1)[-1].strip()
+        tokens = re.findall(r'\S+\s*', self.answer.format(question=question))
+        chunks = self._stream(tokens)
+        if stream:
+            return chunks
+        return SimpleNamespace(text=''.join(chunk.text for chunk in chunks))
+
+    def _stream(self, tokens):
+        first = self.delay + self._random.uniform(-self.jitter, self.jitter)
+        if first > 0:
+            time.sleep(first)
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError("Stub model failure")
+        for i, token in enumerate(tokens):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            yield SimpleNamespace(text=token)
+
+
+class LLMTimeout(TimeoutError):
+    pass
+
+
+# Shared by every LLMClient in the process, so the cap holds across sessions
+_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+class LLMClient:
+    """
+    Streaming wrapper around a generate_content() model.
+
+    Each call runs on a worker thread and its chunks are handed over through
+    a queue, so the caller can give up at the deadline even if the model is
+    stuck. At most LLM_MAX_CONCURRENCY calls are in flight in the process;
+    a slot is held until the model call actually returns. Calls that fail
+    before the first chunk are retried with jittered exponential backoff
+    while the deadline allows; once output has been streamed, errors are
+    raised to the caller.
+    """
+
+    def __init__(self, model, timeout=LLM_TIMEOUT, retries=LLM_MAX_RETRIES, backoff=LLM_BACKOFF,
+                 semaphore=None):
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = semaphore or _semaphore
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'retries': 0, 'timeouts': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        count('llm_client_events', help="LLM client calls, retries, timeouts and errors", event=name)
+
+    def _start(self, prompt, deadline):
+        if not self.semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise LLMTimeout("Timed out waiting for a free LLM slot")
+        chunks = queue.Queue()
+
+        def run():
+            try:
+                for chunk in self.model.generate_content(prompt, stream=True):
+                    chunks.put(('chunk', chunk.text))
+                chunks.put(('done', None))
+            except Exception as e:
+                chunks.put(('error', e))
+            finally:
+                self.semaphore.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        return chunks
+
+    def _attempt(self, prompt, deadline):
+        chunks = self._start(prompt, deadline)
+        while True:
+            try:
+                kind, value = chunks.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise LLMTimeout(f"No response within {self.timeout:g}s") from None
+            if kind == 'done':
+                return
+            if kind == 'error':
+                raise value
+            yield value
+
+    def stream(self, prompt):
+        """Yield the response text in chunks as the model produces them."""
+        self._count('calls')
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            started = False
+            try:
+                for text in self._attempt(prompt, deadline):
+                    if not started:
+                        started = True
+                        observe('llm_first_token', time.perf_counter() - start,
+                                help="Seconds from call to first streamed chunk")
+                    yield text
+                observe('llm_call', time.perf_counter() - start, help="Seconds per LLM call", outcome='ok')
+                return
+            except LLMTimeout:
+                self._count('timeouts')
+                observe('llm_call', time.perf_counter() - start, outcome='timeout')
+                raise
+            except Exception as e:
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                if started or attempt >= self.retries or time.monotonic() + delay >= deadline:
+                    self._count('errors')
+                    observe('llm_call', time.perf_counter() - start, outcome='error')
+                    raise
+                print(f"LLM call failed ({e}), retrying in {delay:.2f}s")
+                self._count('retries')
+                time.sleep(delay)
+                attempt += 1
+
+    def generate(self, prompt):
+        return ''.join(self.stream(prompt))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Process-wide ResponseCache, shared across Streamlit reruns and sessions."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def stream_answer(client, prompt, cache=None):
+    """
+    Answer `prompt` through the response cache, streaming on a miss.
+
+    Returns:
+    (iterable, str): Chunks of the cleaned answer, and where it comes from
+                     ('memory', 'disk' or 'model'). A cached answer is one chunk.
+    """
+    cache = cache or get_response_cache()
+    start = time.perf_counter()
+    key = prompt_key(prompt)
+    response, source = cache.get(key)
+    if response is not None:
+        cache.record(source, time.perf_counter() - start)
+        return [response], source
+
+    def chunks():
+        parts = []
+        for text in client.stream(prompt):
+            text = text.replace('*', '')
+            parts.append(text)
+            yield text
+        # Only complete answers are cached
+        cache.put(key, ''.join(parts).strip())
+        cache.record('model', time.perf_counter() - start)
+
+    return chunks(), 'model'
+
+
+def ask(client, prompt, cache=None):
+    """
+    Non-streaming stream_answer().
+
+    Returns:
+    (str, str): The cleaned answer and where it came from ('memory', 'disk' or 'model')
+    """
+    chunks, source = stream_answer(client, prompt, cache)
+    return ''.join(chunks).strip(), source
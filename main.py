@@ -1,65 +1,107 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 from datetime import datetime
-import google.generativeai as genai
 import os
+import subprocess
+import sys
 from dotenv import load_dotenv
-from model import predict
+from anomaly import describe
+from archive import get_any_report_details, query_all_reports
+from metrics import METRICS_HOST, PROFILER, REGISTRY, start_metrics_server
+from model import model_info, predict_batch
+from llm import (LLM_BACKEND, LLM_STUB_FIRST_TOKEN, LLM_STUB_TOKEN_DELAY, LLMClient, StubModel, build_qa_prompt,
+                 get_response_cache, stream_answer)
+from reports import render_report, report_text
+from rules import DEFAULT_RULES, classify
+from storage import (DB_PATH, REPORT_METRICS, ROLLUP_GRANULARITIES, add_write_listener, create_database,
+                     delete_report, device_history, get_correction_counts, get_fleet_state, get_saved_reports,
+                     query_reports, query_rollups, save_report_to_db, search_reports, set_corrected_state)
 
 # Load environment variables from .env file
 load_dotenv()
 
+REPORTS_PAGE_SIZE = 25
+
+# Cached report queries are dropped on every write made by this process; the
+# TTL bounds how stale they get when another process (bulk_score.py,
+# archive.py) writes to the database
+REPORTS_CACHE_TTL = int(os.getenv('REPORTS_CACHE_TTL', 60))
+
+# retrain.py runs in its own process so training never blocks the app
+RETRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'retrain.py')
+RETRAIN_LOG = 'retrain.log'
+
 def configure_genai():
+    if LLM_BACKEND == 'stub':
+        # Offline mode: canned answers, no API key needed
+        return StubModel(LLM_STUB_FIRST_TOKEN, token_delay=LLM_STUB_TOKEN_DELAY)
     api_key = os.getenv('GOOGLE_API_KEY')
     if api_key is None:
         raise ValueError("GOOGLE_API_KEY is not set in the .env file")
+    # The SDK takes about as long to import as the rest of the app together,
+    # so it is only loaded once the Q&A tab needs it
+    import google.generativeai as genai
     genai.configure(api_key=api_key)
     model = genai.GenerativeModel("gemini-pro")
     return model
 
-def create_database():
-    conn = sqlite3.connect('system_reports.db')
-    c = conn.cursor()
-    
-    # Check if the table exists
-    c.execute("""SELECT name FROM sqlite_master 
-                 WHERE type='table' AND name='reports'""")
-    table_exists = c.fetchone() is not None
-    
-    if not table_exists:
-        # Create new table with all columns
-      c.execute('''CREATE TABLE reports
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              Date_and_Time TEXT,
-              CPU_Utilization INTEGER,
-              Memory_Usage INTEGER,
-              Bandwidth_Utilization REAL,
-              Throughput REAL,
-              Latency REAL,
-              Jitter REAL,
-              Packet_Loss REAL,
-              Error_Rates REAL,
-              Connection_Establishment_Termination_Times REAL,
-              Network_Availability INTEGER,
-              Transmission_Delay REAL,
-              Grid_Voltage REAL,
-              Cooling_Temperature REAL,
-              Network_Traffic_Volume REAL,
-              System_State TEXT,
-              report_text TEXT,
-              feedback TEXT)''')
-    else:
-        # Check if feedback column exists
-        c.execute("PRAGMA table_info(reports)")
-        columns = [column[1] for column in c.fetchall()]
-        
-        if 'feedback' not in columns:
-            # Add feedback column to existing table
-            c.execute('ALTER TABLE reports ADD COLUMN feedback TEXT')
-    
-    conn.commit()
-    conn.close()
+@st.cache_resource
+def init_database():
+    # Schema check and migrations once per process, not on every rerun
+    create_database()
+    add_write_listener(invalidate_report_caches)
+
+
+@st.cache_resource
+def start_metrics_endpoint():
+    # One Prometheus endpoint per process, shared by all sessions
+    return start_metrics_server()
+
+
+@st.cache_resource
+def get_llm_client():
+    return LLMClient(configure_genai())
+
+
+@st.cache_data(ttl=REPORTS_CACHE_TTL, max_entries=500, show_spinner=False)
+def load_reports_page(filters, include_archived, after):
+    if include_archived:
+        # Newest first through the database, then on into the archive files
+        return query_all_reports(**filters, after=after, page_size=REPORTS_PAGE_SIZE)
+    if filters['search'].strip():
+        # Ranked full-text matches with highlighted snippets
+        return search_reports(**filters, after=after, page_size=REPORTS_PAGE_SIZE)
+    return query_reports(**{**filters, 'search': None}, after=after, page_size=REPORTS_PAGE_SIZE)
+
+
+@st.cache_data(ttl=REPORTS_CACHE_TTL, max_entries=1000, show_spinner=False)
+def load_report_details(report_id):
+    return get_any_report_details(report_id)
+
+
+@st.cache_data(ttl=REPORTS_CACHE_TTL, max_entries=100, show_spinner=False)
+def load_rollups(granularity, start, end, metrics):
+    return query_rollups(granularity, start=start, end=end, metrics=metrics)
+
+
+@st.cache_data(ttl=REPORTS_CACHE_TTL, show_spinner=False)
+def load_fleet():
+    return get_fleet_state()
+
+
+@st.cache_data(ttl=REPORTS_CACHE_TTL, max_entries=200, show_spinner=False)
+def load_device_history(device_id):
+    return device_history(device_id, limit=REPORTS_PAGE_SIZE)
+
+
+def invalidate_report_caches(db_path=DB_PATH):
+    """Drop cached listings, details and trends after a write; a correction changes a report's details."""
+    if db_path == DB_PATH:
+        load_reports_page.clear()
+        load_report_details.clear()
+        load_rollups.clear()
+        load_fleet.clear()
+        load_device_history.clear()
 
 def show_reports_tab():
     st.title("Saved Reports")
@@ -90,174 +132,9 @@ def show_reports_tab():
             if st.button("Delete Report", key=f"delete_{report['id']}"):
                 delete_report(report['id'])
                 st.rerun()
-def generate_remediation_suggestions(input_data, prediction):
-    suggestions = []
-    
-    if input_data['CPU_Utilization'] >= 80:
-        suggestions.append("- Identify and terminate resource-intensive processes\n- Consider upgrading CPU capacity\n- Implement better load balancing")
-    
-    if input_data['Memory_Usage'] >= 80:
-        suggestions.append("- Clear system cache\n- Optimize memory-intensive applications\n- Consider increasing RAM capacity")
-    
-    if input_data['Error_Rates'] >= 5:
-        suggestions.append("- Review system logs for error patterns\n- Update system dependencies\n- Implement error tracking and monitoring")
-    
-    if input_data['Network_Traffic_Volume'] > 1000:  # Assuming 1000 Mbps threshold
-        suggestions.append("- Review network traffic patterns\n- Implement traffic shaping\n- Consider bandwidth upgrade")
-    
-    if input_data['Cooling_Temperature'] > 30:
-        suggestions.append("- Check cooling system functionality\n- Ensure proper ventilation\n- Monitor temperature trends")
-    
-    if input_data['Bandwidth_Utilization'] > 90:
-        suggestions.append("- Analyze bandwidth consumption patterns\n- Implement QoS policies\n- Consider bandwidth optimization techniques")
-    
-    if input_data['Latency'] > 100:  # Assuming 100ms threshold
-        suggestions.append("- Check network connectivity\n- Identify network bottlenecks\n- Optimize network routing")
-    
-    if input_data['Packet_Loss'] > 2:  # Assuming 2% threshold
-        suggestions.append("- Investigate network connectivity issues\n- Check for network congestion\n- Verify network hardware functionality")
-    
-    if input_data['Jitter'] > 30:  # Assuming 30ms threshold
-        suggestions.append("- Monitor network stability\n- Implement jitter buffering\n- Check for network interference")
-    
-    if input_data['Network_Availability'] < 99:  # Assuming 99% threshold
-        suggestions.append("- Review network infrastructure\n- Implement redundancy measures\n- Check for single points of failure")
-    
-    if input_data['Transmission_Delay'] > 200:  # Assuming 200ms threshold
-        suggestions.append("- Optimize data transmission paths\n- Review network topology\n- Consider content delivery optimization")
-    
-    if input_data['Connection_Establishment_Termination_Times'] > 1000:  # Assuming 1000ms threshold
-        suggestions.append("- Check connection pooling settings\n- Optimize connection handling\n- Review connection timeout parameters")
-    
-    return "\n\n".join(suggestions) if suggestions else "No immediate actions required. Continue regular monitoring."
-
 def generate_report_text(input_data, prediction):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    remediation = generate_remediation_suggestions(input_data, prediction)
-    
-    # Generate system diagnosis
-    issues = []
-    if input_data['CPU_Utilization'] >= 80:
-        issues.append("High CPU utilization indicating system overload")
-    if input_data['Memory_Usage'] >= 80:
-        issues.append("Elevated memory usage suggesting resource constraints")
-    if input_data['Error_Rates'] >= 5:
-        issues.append("High error rates detected indicating potential system issues")
-    if input_data['Network_Traffic_Volume'] > 1000:
-        issues.append("Excessive network traffic detected suggesting potential network congestion")
-    if input_data['Cooling_Temperature'] > 30:
-        issues.append("Elevated cooling temperature indicating potential cooling system issues")
-    if input_data['Bandwidth_Utilization'] > 90:
-        issues.append("High bandwidth utilization indicating potential network bottleneck")
-    if input_data['Latency'] > 100:
-        issues.append("High network latency detected affecting system performance")
-    if input_data['Packet_Loss'] > 2:
-        issues.append("Significant packet loss detected affecting network reliability")
-    if input_data['Jitter'] > 30:
-        issues.append("High jitter levels affecting network stability")
-    if input_data['Network_Availability'] < 99:
-        issues.append("Reduced network availability affecting system reliability")
-    if input_data['Transmission_Delay'] > 200:
-        issues.append("High transmission delay affecting data transfer efficiency")
-    
-    diagnosis = "No significant issues detected." if not issues else "\n- ".join(issues)
-    
-    report = f"""System Status Report - {timestamp}
-    
-Overall Status: {prediction}
-
-Network Performance Metrics:
-- Bandwidth Utilization: {input_data['Bandwidth_Utilization']}%
-- Throughput: {input_data['Throughput']} Mbps
-- Latency: {input_data['Latency']} ms
-- Jitter: {input_data['Jitter']} ms
-- Packet Loss: {input_data['Packet_Loss']}%
-- Network Availability: {input_data['Network_Availability']}%
-
-System Resource Metrics:
-- CPU Utilization: {input_data['CPU_Utilization']}%
-- Memory Usage: {input_data['Memory_Usage']}%
-- Grid Voltage: {input_data['Grid_Voltage']} V
-- Cooling Temperature: {input_data['Cooling_Temperature']}°C
-
-Network Traffic Analysis:
-- Network Traffic Volume: {input_data['Network_Traffic_Volume']} Mbps
-- Error Rates: {input_data['Error_Rates']}
-- Transmission Delay: {input_data['Transmission_Delay']} ms
-- Connection Establishment/Termination Times: {input_data['Connection_Establishment_Termination_Times']} ms
-
-System Diagnosis:
-- {diagnosis}
-
-Recommended Actions:
-{remediation}
-"""
-    return report
-def save_report_to_db(input_data, prediction, report_text, feedback):
-    """
-    Save system report to database with updated column names.
-    
-    Parameters:
-    input_data (dict): Dictionary containing system metrics
-    prediction (str): System state prediction
-    report_text (str): Generated report text
-    feedback (str): Additional feedback and notes
-    """
-    try:
-        # Connect to SQLite database
-        conn = sqlite3.connect('system_reports.db')
-        c = conn.cursor()
-        
-        # Insert data into the reports table
-        c.execute('''INSERT INTO reports 
-                 (Date_and_Time, CPU_Utilization, Memory_Usage, Bandwidth_Utilization,
-                  Throughput, Latency, Jitter, Packet_Loss, Error_Rates,
-                  Connection_Establishment_Termination_Times, Network_Availability,
-                  Transmission_Delay, Grid_Voltage, Cooling_Temperature,
-                  Network_Traffic_Volume, System_State, report_text, feedback)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-              (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-               input_data['CPU_Utilization'],
-               input_data['Memory_Usage'],
-               input_data['Bandwidth_Utilization'],
-               input_data['Throughput'],
-               input_data['Latency'],
-               input_data['Jitter'],
-               input_data['Packet_Loss'],
-               input_data['Error_Rates'],
-               input_data['Connection_Establishment_Termination_Times'],
-               input_data['Network_Availability'],
-               input_data['Transmission_Delay'],
-               input_data['Grid_Voltage'],
-               input_data['Cooling_Temperature'],
-               input_data['Network_Traffic_Volume'],
-               prediction,
-               report_text,
-               feedback))
-        
-        # Commit the changes and close the connection
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-        raise
-    except Exception as e:
-        print(f"Error saving report: {e}")
-        raise
-    finally:
-        conn.close()
-
-def get_saved_reports():
-    conn = sqlite3.connect('system_reports.db')
-    reports = pd.read_sql_query("SELECT * FROM reports", conn)
-    conn.close()
-    return reports
-
-def delete_report(report_id):
-    conn = sqlite3.connect('system_reports.db')
-    c = conn.cursor()
-    c.execute("DELETE FROM reports WHERE id = ?", (report_id,))
-    conn.commit()
-    conn.close()
+    return render_report({**input_data, 'System_State': prediction,
+                          'Date_and_Time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
 
 def show_prediction_tab():
    st.title("System Status Prediction")
@@ -308,17 +185,8 @@ def show_prediction_tab():
                'Network_Traffic_Volume': network_traffic_volume
            }
            
-           # Updated prediction criteria
-           prediction = "Normal" if all([ 
-               input_data['CPU_Utilization'] < 80,
-               input_data['Memory_Usage'] < 80,
-               input_data['Error_Rates'] < 5,
-               input_data['Bandwidth_Utilization'] < 90,
-               input_data['Packet_Loss'] < 2,
-               input_data['Network_Availability'] > 98,
-               input_data['Latency'] < 100,
-               input_data['Jitter'] < 30
-           ]) else "Abnormal"
+           # Threshold rules shared with the report diagnosis and Q&A prompt
+           prediction = str(classify(input_data)[0])
            
            st.session_state.current_input_data = input_data
            st.session_state.current_prediction = prediction
@@ -328,6 +196,12 @@ def show_prediction_tab():
                st.success("NORMAL")
            else:
                st.error("ABNORMAL")
+
+           # The model's label is shown alongside when a pipeline can be served
+           try:
+               st.caption(f"Model label: {predict_batch([input_data])[0]}")
+           except (OSError, ValueError) as e:
+               st.caption(f"Model label unavailable ({e}); the status above comes from the threshold rules")
            
            st.markdown("### Input Summary:")
            st.dataframe(pd.DataFrame([input_data]))
@@ -339,10 +213,10 @@ def show_prediction_tab():
 def show_report_generator_tab():
     st.title("Report Generator")
     if st.session_state.current_input_data and st.session_state.current_prediction:
-        report_text = generate_report_text(st.session_state.current_input_data, 
-                                        st.session_state.current_prediction)
+        generated_report = generate_report_text(st.session_state.current_input_data,
+                                                st.session_state.current_prediction)
         
-        edited_report = st.text_area("Edit Report", report_text, height=400)
+        edited_report = st.text_area("Edit Report", generated_report, height=400)
         
         # Add feedback text box
         feedback = st.text_area("Additional Notes and Feedback", 
@@ -350,9 +224,10 @@ def show_report_generator_tab():
                               height=150)
         
         if st.button("Save Report"):
+            # Unedited reports are rendered again from the metrics when read
             save_report_to_db(st.session_state.current_input_data,
                             st.session_state.current_prediction,
-                            edited_report,
+                            edited_report if edited_report != generated_report else None,
                             feedback)
             st.success("Report saved successfully!")
     else:
@@ -360,23 +235,54 @@ def show_report_generator_tab():
 
 def show_reports_tab():
     st.title("Saved Reports")
-    reports = get_saved_reports()
 
-    # Add search and filter options
-    search_term = st.text_input("Search reports by content:")
+    # Add search and filter options; all filtering happens in SQL
+    search_term = st.text_input("Search reports by content:",
+                                help='Words must all appear; use "quotes" for a phrase and word* for a prefix')
     status_filter = st.multiselect("Filter by System State:", ["Normal", "Abnormal"])
+    from_col, to_col = st.columns(2)
+    with from_col:
+        start_date = st.date_input("From date", value=None)
+    with to_col:
+        end_date = st.date_input("To date", value=None)
+    metric_filter = st.selectbox("Filter by metric:", ["None"] + REPORT_METRICS)
+    metric_ranges = {}
+    if metric_filter != "None":
+        low_col, high_col = st.columns(2)
+        with low_col:
+            low = st.number_input(f"Minimum {metric_filter}", value=None)
+        with high_col:
+            high = st.number_input(f"Maximum {metric_filter}", value=None)
+        metric_ranges[metric_filter] = (low, high)
+    include_archived = st.checkbox("Include archived reports",
+                                   help="Also page through reports moved out of the database by archive.py")
 
-    filtered_reports = reports
-    if search_term:
-        filtered_reports = filtered_reports[
-            filtered_reports['System_State'].str.contains(search_term, case=False, na=False)
-        ]
-    if status_filter:
-        filtered_reports = filtered_reports[filtered_reports['System_State'].isin(status_filter)]
+    filters = dict(states=status_filter,
+                   start=start_date.isoformat() if start_date else None,
+                   end=end_date.isoformat() if end_date else None,
+                   metric_ranges=metric_ranges,
+                   search=search_term)
+
+    # Page cursors for the current filters; changing a filter starts over at page 1
+    if st.session_state.get('reports_filters') != {**filters, 'archived': include_archived}:
+        st.session_state.reports_filters = {**filters, 'archived': include_archived}
+        st.session_state.reports_cursors = [None]
+    cursors = st.session_state.reports_cursors
+
+    reports, next_cursor = load_reports_page(filters, include_archived, cursors[-1])
+    st.caption(f"Page {len(cursors)}")
 
     # Display reports in an expandable format
-    for _, report in filtered_reports.iterrows():
-        with st.expander(f"Report from {report['Date_and_Time']} - System State: {report['System_State']}"):
+    for report in reports.to_dict('records'):
+        if report.get('snippet'):
+            st.markdown(f"> {report['snippet']}")
+        anomalies = describe(report.get('anomaly_flags'))
+        title = f"Report from {report['Date_and_Time']} - System State: {report['System_State']}"
+        if pd.notna(report.get('predicted_state')):
+            title += f" - Model: {report['predicted_state']}"
+        if anomalies:
+            title += f" - Anomalies: {len(anomalies)}"
+        with st.expander(title):
             # System Metrics Section
             st.markdown("### System Metrics")
             col1, col2 = st.columns(2)
@@ -407,66 +313,210 @@ def show_reports_tab():
                 st.text(f"Connection Times: {report['Connection_Establishment_Termination_Times']} ms")
                 st.text(f"Transmission Delay: {report['Transmission_Delay']} ms")
 
-            # Report Text Section
-            if report['report_text']:
-                st.markdown("### Full Report")
-                st.text(report['report_text'])
+            # Deviations from this device's own history, found by the ingest daemon
+            if anomalies:
+                st.markdown("### Streaming Anomalies")
+                for metric, kind in anomalies:
+                    st.text(f"{metric.replace('_', ' ')}: {kind.replace('_', ' ')}")
 
-            # Feedback Section
-            if report['feedback'] and pd.notna(report['feedback']):
-                st.markdown("### Additional Feedback")
-                st.text(report['feedback'])
+            # The report text and feedback are only loaded when asked for
+            if st.checkbox("Show full report and feedback", key=f"details_{report['id']}"):
+                details = load_report_details(report['id']) or {}
 
-            # Delete Button
-            if st.button("Delete Report", key=f"delete_{report['id']}"):
+                # Report Text Section
+                if details:
+                    st.markdown("### Full Report")
+                    st.text(report_text(details))
+
+                # Feedback Section
+                if details.get('feedback'):
+                    st.markdown("### Additional Feedback")
+                    st.text(details['feedback'])
+
+                # Corrections become training labels for retrain.py
+                try:
+                    classes = model_info()['classes']
+                except ValueError:
+                    classes = []
+                if details and classes and not report.get('archived'):
+                    options = ["No correction"] + classes
+                    current = details.get('corrected_state')
+                    correction = st.selectbox("Correct the model label", options,
+                                              index=options.index(current) if current in options else 0,
+                                              key=f"correct_{report['id']}")
+                    if st.button("Save correction", key=f"save_correction_{report['id']}"):
+                        set_corrected_state(report['id'], None if correction == "No correction" else correction)
+                        st.rerun()
+
+            # Delete Button; archived reports are read-only
+            if not report.get('archived') and st.button("Delete Report", key=f"delete_{report['id']}"):
                 delete_report(report['id'])
                 st.rerun()
 
-def show_qa_tab(model):
+    # Page navigation
+    prev_col, next_col = st.columns(2)
+    with prev_col:
+        if len(cursors) > 1 and st.button("Previous page"):
+            cursors.pop()
+            st.rerun()
+    with next_col:
+        if next_cursor is not None and st.button("Next page"):
+            cursors.append(next_cursor)
+            st.rerun()
+
+def show_trends_tab():
+    st.title("Metric Trends")
+
+    # Everything here is read from the rollup tables, never from raw reports
+    granularity = st.radio("Bucket size:", list(ROLLUP_GRANULARITIES), index=1, horizontal=True)
+    metrics = st.multiselect("Metrics:", REPORT_METRICS, default=["CPU_Utilization"])
+    from_col, to_col = st.columns(2)
+    with from_col:
+        start_date = st.date_input("From date", value=None, key="trends_from")
+    with to_col:
+        end_date = st.date_input("To date", value=None, key="trends_to")
+
+    trends = load_rollups(granularity,
+                          start=start_date.isoformat() if start_date else None,
+                          end=end_date.isoformat() + ' 23:59:59' if end_date else None,
+                          metrics=metrics or None)
+    if trends.empty:
+        st.info("No reports in this period yet.")
+        return
+    trends = trends.set_index('bucket')
+
+    st.markdown("### Abnormal Rate")
+    st.bar_chart(trends['abnormal_rate'])
+    st.caption(f"{int(trends['count'].sum())} reports in {len(trends)} buckets")
+
+    for metric in metrics:
+        st.markdown(f"### {metric.replace('_', ' ')}")
+        st.line_chart(trends[[f'{metric}_mean', f'{metric}_max']])
+
+def show_fleet_tab():
+    st.title("Fleet Overview")
+
+    # One row per device from the device_state index, never the report history
+    fleet = load_fleet()
+    if fleet.empty:
+        st.info("No device has reported yet. Devices send telemetry with a device_id through ingest.py.")
+        return
+    states = fleet['System_State'].value_counts()
+    st.caption(f"{len(fleet)} devices: " + ", ".join(f"{count} {state}" for state, count in states.items()))
+
+    if st.checkbox("Only devices past a threshold"):
+        fleet = fleet[fleet['worst_ratio'] > 1]
+    overview = pd.DataFrame({
+        'Device': fleet['device_id'],
+        'State': fleet['System_State'],
+        'Last seen': fleet['last_seen'],
+        'Worst metric': fleet['worst_metric'].str.replace('_', ' '),
+        'Value': fleet['worst_value'],
+        '% of threshold': (100 * fleet['worst_ratio']).round(1),
+        'Anomalies': fleet['anomaly_flags'].map(lambda flags: len(describe(flags))),
+        'Reports': fleet['report_count'],
+    })
+    st.dataframe(overview, hide_index=True)
+
+    if len(fleet):
+        device = st.selectbox("Recent reports for device:", fleet['device_id'])
+        history = load_device_history(device)
+        st.dataframe(history.drop(columns=['device_id']), hide_index=True)
+
+def show_admin_tab():
+    st.title("Admin")
+
+    server = start_metrics_endpoint()
+    if server:
+        st.caption(f"Prometheus metrics: http://{METRICS_HOST}:{server.server_address[1]}/metrics")
+    else:
+        st.caption("Prometheus endpoint disabled (METRICS_PORT=0 or port in use)")
+
+    st.markdown("### Model")
+    try:
+        info = model_info()
+    except ValueError as e:
+        info = None
+        st.error(str(e))
+    if info:
+        st.caption(f"{os.path.basename(info['path'])} version {info['pipeline_version'] or 'legacy'} "
+                   f"({info['version'][:12]}), classes {', '.join(info['classes'])}")
+    if info and info['training_mode']:
+        st.caption(f"Trained {info['training_mode']} on {info['training_rows']:,} labelled reports, "
+                   f"corrections up to {(info['trained_at'] or 'none')[:19]}, published {info['created_at']}")
+    corrections = get_correction_counts()
+    if corrections:
+        st.caption("Corrected reports by label: " +
+                   ", ".join(f"{label}: {n:,}" for label, n in corrections.items()))
+    else:
+        st.caption("No corrected reports yet. Retraining learns only from corrections, made in the "
+                   "Reports tab; until there are some the shipped model keeps serving")
+    if st.button("Retrain in background",
+                 help="Adds trees for reports corrected since the last version; "
+                      "the app switches to the new version once it is published"):
+        with open(RETRAIN_LOG, 'a') as log:
+            subprocess.Popen([sys.executable, RETRAIN_SCRIPT, '--db', DB_PATH, 'once'],
+                             stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        st.info(f"Retraining started; progress is written to {RETRAIN_LOG}")
+    if os.path.exists(RETRAIN_LOG):
+        with st.expander("Retrain log"):
+            with open(RETRAIN_LOG) as f:
+                st.code(''.join(f.readlines()[-20:]), language='text')
+
+    st.markdown("### Latency")
+    summary = pd.DataFrame(REGISTRY.summary())
+    if summary.empty:
+        st.info("Nothing recorded yet.")
+    else:
+        st.dataframe(summary.round(3), hide_index=True)
+
+    st.markdown("### Counters and Gauges")
+    counters = [{'metric': metric.name, 'labels': ', '.join(f'{name}={value}' for name, value in key),
+                 'value': value}
+                for metric in REGISTRY.metrics() if metric.kind in ('counter', 'gauge')
+                for key, value in sorted(metric.samples().items())]
+    if counters:
+        st.dataframe(pd.DataFrame(counters), hide_index=True)
+
+    # The profiler is process-wide, so toggling it here affects every session
+    st.markdown("### Slow Operation Profiler")
+    threshold = st.number_input("Capture operations slower than (s)", min_value=0.0,
+                                value=float(PROFILER.threshold), step=0.1)
+    enabled = st.toggle("Sample stacks of slow operations", value=PROFILER.enabled)
+    if enabled:
+        PROFILER.enable(threshold=threshold)
+    elif PROFILER.enabled:
+        PROFILER.disable()
+    for capture in reversed(PROFILER.captures):
+        with st.expander(f"{capture['at']} {capture['name']} - {capture['seconds'] * 1000:.0f} ms, "
+                         f"{capture['samples']} samples"):
+            for stack, samples in capture['stacks']:
+                st.text(f"{samples:5d}  {stack.replace(';', ' > ')}")
+
+    with st.expander("Prometheus text"):
+        st.code(REGISTRY.render_prometheus(), language='text')
+
+def show_qa_tab(client):
     st.title("Q&A System")
     
     user_question = st.text_input("Ask a question about the system status:")
     
     if user_question:
         if st.session_state.current_input_data and st.session_state.current_prediction:
-            system_context = f"""
-            You are a helpful system monitoring assistant. Here is the current system information:
-            
-            System Status: {st.session_state.current_prediction}
-            Date and Time: {st.session_state.current_input_data['Date_and_Time']}
-            CPU Utilization: {st.session_state.current_input_data['CPU_Utilization']}%
-            Memory Usage: {st.session_state.current_input_data['Memory_Usage']}%
-            Bandwidth Utilization: {st.session_state.current_input_data['Bandwidth_Utilization']} Mbps
-            Throughput: {st.session_state.current_input_data['Throughput']} Mbps
-            Latency: {st.session_state.current_input_data['Latency']} ms
-            Jitter: {st.session_state.current_input_data['Jitter']} ms
-            Packet Loss: {st.session_state.current_input_data['Packet_Loss']}%
-            Error Rates: {st.session_state.current_input_data['Error_Rates']}%
-            Connection Establishment/Termination Times: {st.session_state.current_input_data['Connection_Establishment_Termination_Times']} ms
-            Network Availability: {st.session_state.current_input_data['Network_Availability']}%
-            Transmission Delay: {st.session_state.current_input_data['Transmission_Delay']} ms
-            Grid Voltage: {st.session_state.current_input_data['Grid_Voltage']} V
-            Cooling Temperature: {st.session_state.current_input_data['Cooling_Temperature']}°C
-            Network Traffic Volume: {st.session_state.current_input_data['Network_Traffic_Volume']} GB
-            System State: {st.session_state.current_input_data['System_State']}
-
-            The system is considered abnormal if any of these conditions are met:
-            - CPU Utilization >= 80%
-            - Memory Usage >= 80%
-            - Latency >= 200 ms
-            - Packet Loss >= 1%
-            - Error Rates >= 5%
-            - Transmission Delay >= 100 ms
-            - Network Availability < 99.9%
-
-            Please provide a natural, conversational response to this question: {user_question}
-            """
+            system_context = build_qa_prompt(st.session_state.current_input_data,
+                                             st.session_state.current_prediction,
+                                             user_question)
             
             try:
-                response = model.generate_content(system_context)
-                cleaned_response = response.text.replace('*', '').strip()
+                # Reruns with the same snapshot and question are answered from the
+                # cache; otherwise the answer is shown as it streams in
+                chunks, source = stream_answer(client, system_context)
                 st.markdown("### Answer:")
-                st.write(cleaned_response)
+                st.write_stream(chunks)
+                stats = get_response_cache().stats(disk=False)
+                st.caption(f"Answered from {'the model' if source == 'model' else f'cache ({source})'}; "
+                           f"cache hit ratio {stats['hit_ratio']:.0%} over "
+                           f"{stats['memory_hits'] + stats['disk_hits'] + stats['misses']} questions")
                 
             except Exception as e:
                 st.error(f"Error generating response: {str(e)}")
@@ -484,12 +534,12 @@ def main():
     if 'current_prediction' not in st.session_state:
         st.session_state.current_prediction = None
     
-    # Initialize database and model
-    create_database()
-    model = configure_genai()
+    # Initialize the database and metrics endpoint; cached for the process
+    init_database()
+    start_metrics_endpoint()
     
     # Tab selection
-    tab_options = ["Prediction", "Report Generator", "Q&A", "View Reports"]
+    tab_options = ["Prediction", "Report Generator", "Q&A", "View Reports", "Trends", "Fleet", "Admin"]
     st.session_state.current_tab = st.radio("Navigation", tab_options, horizontal=True)
     
     # Show appropriate tab
@@ -514,9 +564,20 @@ def main():
             # ]
         )
     elif st.session_state.current_tab == "Q&A":
-        show_qa_tab(model)
+        try:
+            client = get_llm_client()
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            show_qa_tab(client)
     elif st.session_state.current_tab == "View Reports":
         show_reports_tab()
+    elif st.session_state.current_tab == "Trends":
+        show_trends_tab()
+    elif st.session_state.current_tab == "Fleet":
+        show_fleet_tab()
+    elif st.session_state.current_tab == "Admin":
+        show_admin_tab()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,361 @@
+import functools
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local Prometheus endpoint; METRICS_PORT=0 disables it
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))
+
+# Latency buckets in seconds, from sub-millisecond SQLite reads to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class CounterMetric:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return [f'{self.name}{_format_labels(key)} {value}' for key, value in sorted(self.samples().items())]
+
+
+class GaugeMetric(CounterMetric):
+    """Current value per label set, e.g. a queue depth."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, as Prometheus expects."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        self.observe_key(value, _label_key(labels))
+
+    def observe_key(self, value, key):
+        # Hot path: one bisect and one short critical section
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        """{label key: (per-bucket counts, sum, count)}; the last count is the +Inf bucket."""
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q, counts):
+        # Linear interpolation inside the bucket holding the q-th observation
+        count = sum(counts)
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def render(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide set of named counters, gauges and histograms."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name!r} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get(CounterMetric, name, help)
+
+    def gauge(self, name, help=''):
+        return self._get(GaugeMetric, name, help)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in sorted(self.metrics(), key=lambda metric: metric.name):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """One row per histogram series with count, errors, mean and estimated p50/p95/p99 in ms."""
+        rows = []
+        for metric in self.metrics():
+            if not isinstance(metric, Histogram):
+                continue
+            errors = self._metrics.get(metric.name.replace('_seconds', '_errors_total'))
+            error_counts = errors.samples() if errors else {}
+            for key, (counts, total, count) in sorted(metric.samples().items()):
+                rows.append({
+                    'metric': metric.name,
+                    'labels': ', '.join(f'{name}={value}' for name, value in key),
+                    'count': count,
+                    'errors': error_counts.get(key, 0),
+                    'mean_ms': 1000 * total / count if count else 0.0,
+                    'p50_ms': 1000 * metric.quantile(0.5, counts),
+                    'p95_ms': 1000 * metric.quantile(0.95, counts),
+                    'p99_ms': 1000 * metric.quantile(0.99, counts),
+                })
+        return rows
+
+
+REGISTRY = MetricsRegistry()
+
+
+class SamplingProfiler:
+    """
+    Optional stack sampler for slow operations.
+
+    While enabled, a background thread samples the stack of every thread
+    inside an outermost timed() block every `interval` seconds. Blocks that
+    take at least `threshold` seconds keep their most frequent stacks in
+    `captures`; faster ones are discarded. Disabled, it costs one attribute
+    check per timed() block.
+    """
+
+    def __init__(self, interval=0.005, threshold=0.5, max_captures=50):
+        self.interval = interval
+        self.threshold = threshold
+        self.enabled = False
+        self.captures = deque(maxlen=max_captures)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enable(self, threshold=None, interval=None):
+        if threshold is not None:
+            self.threshold = threshold
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            self.enabled = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def disable(self):
+        self.enabled = False
+
+    def begin(self, name):
+        ident = threading.get_ident()
+        with self._lock:
+            if ident in self._active:
+                # Only the outermost block on a thread is profiled
+                return None
+            self._active[ident] = (name, Counter())
+        return ident
+
+    def end(self, ident, seconds):
+        with self._lock:
+            name, stacks = self._active.pop(ident)
+        if seconds >= self.threshold:
+            self.captures.append({
+                'name': name,
+                'seconds': seconds,
+                'at': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'samples': sum(stacks.values()),
+                'stacks': stacks.most_common(10),
+            })
+
+    def _run(self):
+        while self.enabled:
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, (_, stacks) in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_folded_stack(frame)] += 1
+            time.sleep(self.interval)
+
+
+def _folded_stack(frame, limit=30):
+    # Outermost call first, 'file:function:line' joined by ';' (flame graph input)
+    parts = []
+    while frame is not None and len(parts) < limit:
+        code = frame.f_code
+        parts.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+PROFILER = SamplingProfiler()
+
+
+class timed:
+    """
+    Time a block or function into the `<name>_seconds` histogram and count
+    exceptions in `<name>_errors_total`, both labelled with `labels`.
+
+        with timed('sqlite_operation', op='delete_report'):
+            ...
+
+        @timed('report_render', mode='single')
+        def render_report(...):
+    """
+
+    def __init__(self, name, help='', registry=REGISTRY, **labels):
+        self.name = name
+        self.histogram = registry.histogram(f'{name}_seconds', help)
+        self.errors = registry.counter(f'{name}_errors_total', f'Exceptions raised in {name}')
+        self.labels = labels
+        self.key = _label_key(labels)
+
+    def __enter__(self):
+        self._profile = PROFILER.begin(f'{self.name}{_format_labels(self.key)}') if PROFILER.enabled else None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        self.histogram.observe_key(seconds, self.key)
+        if exc_type is not None:
+            self.errors.inc(**self.labels)
+        if self._profile is not None:
+            PROFILER.end(self._profile, seconds)
+        return False
+
+    def __call__(self, fn):
+        histogram, errors, key, labels, name = self.histogram, self.errors, self.key, self.labels, self.name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Inlined __enter__/__exit__; the instance can't hold per-call state
+            # when the function runs on several threads at once
+            profile = PROFILER.begin(f'{name}{_format_labels(key)}') if PROFILER.enabled else None
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                errors.inc(**labels)
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                histogram.observe_key(seconds, key)
+                if profile is not None:
+                    PROFILER.end(profile, seconds)
+
+        return wrapper
+
+
+def count(name, amount=1, help='', **labels):
+    """Add `amount` to the `<name>_total` counter."""
+    REGISTRY.counter(f'{name}_total', help).inc(amount, **labels)
+
+
+def observe(name, seconds, help='', **labels):
+    """Record one duration in the `<name>_seconds` histogram."""
+    REGISTRY.histogram(f'{name}_seconds', help).observe(seconds, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve GET /metrics from a daemon thread.
+
+    Returns:
+    ThreadingHTTPServer: The running server, or None if disabled or the port is taken
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -1,58 +1,416 @@
-import joblib
-from sklearn.preprocessing import StandardScaler
+import os
+import threading
+import time
+import warnings
+from itertools import islice
 
+import numpy as np
+
+from fileio import file_sha256
+from metrics import count, timed
+
+# Fitted scaler + classifier written by train.py and replaced by retrain.py.
+# The shipped one bundles the bare classifier in noc_new.joblib with a scaler
+# estimated from the input ranges (python train.py, see export_pipeline)
+PIPELINE_PATH = 'noc_pipeline.joblib'
+LEGACY_MODEL_PATH = 'noc_new.joblib'
+# Flat-array export of the pipeline written by compile_model.py; set
+# MODEL_PATH=noc_model.npz to score without importing scikit-learn or joblib
+NUMPY_MODEL_PATH = 'noc_model.npz'
+
+
+def _default_model_path():
+    return os.getenv('MODEL_PATH') or (
+        PIPELINE_PATH if os.path.exists(PIPELINE_PATH) else LEGACY_MODEL_PATH)
+
+
+MODEL_PATH = _default_model_path()
+
+# The bare classifier has no fitted scaler and its legacy scaling maps every
+# input to zeros, so it would give every snapshot the same label. It is
+# refused unless MODEL_ALLOW_LEGACY=1, e.g. to benchmark tree evaluation
+MODEL_ALLOW_LEGACY = os.getenv('MODEL_ALLOW_LEGACY') == '1'
+
+# Set MODEL_MMAP_MODE=r to memory-map the model arrays so several worker
+# processes share the same pages instead of each holding a private copy
+MODEL_MMAP_MODE = os.getenv('MODEL_MMAP_MODE') or None
+
+# Feature order the classifier was trained on
+FEATURES = [
+    'Grid_Voltage',
+    'Cooling_Temperature',
+    'CPU_Utilization',
+    'Memory_Usage',
+    'Bandwidth_Utilization',
+    'Throughput',
+    'Latency',
+    'Jitter',
+    'Packet_Loss',
+    'Error_Rates',
+    'Connection_Establishment_Termination_Times',
+    'Network_Availability',
+    'Transmission_Delay',
+    'Network_Traffic_Volume',
+]
+
+# Input ranges accepted by the prediction tab, used to generate test telemetry
+FEATURE_RANGES = {
+    'Grid_Voltage': (0.0, 500.0),
+    'Cooling_Temperature': (0.0, 100.0),
+    'CPU_Utilization': (0, 100),
+    'Memory_Usage': (0, 100),
+    'Bandwidth_Utilization': (0, 100),
+    'Throughput': (0.0, 10000.0),
+    'Latency': (0.0, 1000.0),
+    'Jitter': (0.0, 100.0),
+    'Packet_Loss': (0.0, 100.0),
+    'Error_Rates': (0.0, 100.0),
+    'Connection_Establishment_Termination_Times': (0.0, 5000.0),
+    'Network_Availability': (0, 100),
+    'Transmission_Delay': (0.0, 1000.0),
+    'Network_Traffic_Volume': (0.0, 10000.0),
+}
+
+# Rows scored per model.predict call in predict_batch
+DEFAULT_CHUNK_SIZE = int(os.getenv('PREDICT_CHUNK_SIZE', '10000'))
+
+# How often (seconds) the registry stats the artifact to look for a new version
+MODEL_CHECK_INTERVAL = float(os.getenv('MODEL_CHECK_INTERVAL', '1.0'))
+
+
+def _rss_bytes():
+    # Resident set size from /proc; None where that isn't available. Cheap
+    # enough to read around every load, unlike tracemalloc, which slows
+    # unpickling several times over
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _legacy_scale(X):
+    # Equivalent to StandardScaler().fit_transform() applied to each row on
+    # its own, which is what predict() did before a fitted scaler was saved
+    return np.zeros_like(X)
+
+
+def as_pipeline(artifact, allow_legacy=None):
+    """
+    Normalize a loaded artifact to a (pipeline, metadata) pair.
+
+    Pipeline bundles written by train.py carry a fitted scaler and a feature
+    schema. A bare classifier is only wrapped with the legacy per-row scaling
+    when `allow_legacy` (default: MODEL_ALLOW_LEGACY) is set; that wrapper
+    predicts one constant label, so otherwise a ValueError is raised.
+    """
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import FunctionTransformer
+
+    if isinstance(artifact, dict) and 'pipeline' in artifact:
+        features = list(artifact.get('features', FEATURES))
+        if features != FEATURES:
+            raise ValueError(f"Model feature schema {features} does not match {FEATURES}")
+        metadata = {key: value for key, value in artifact.items() if key != 'pipeline'}
+        return artifact['pipeline'], metadata
+
+    if not (MODEL_ALLOW_LEGACY if allow_legacy is None else allow_legacy):
+        raise ValueError("Model artifact has no fitted scaler, so it would give every input the same label; "
+                         "run train.py or retrain.py to publish a pipeline (MODEL_ALLOW_LEGACY=1 loads it anyway)")
+    warnings.warn("Model artifact has no fitted scaler; run train.py to export a pipeline")
+    pipeline = Pipeline([
+        ('scaler', FunctionTransformer(_legacy_scale)),
+        ('classifier', artifact),
+    ])
+    return pipeline, {'format': 'legacy', 'features': FEATURES}
+
+
+class NumpyModel:
+    """
+    Pure-NumPy evaluator for pipelines compiled by compile_model.py.
+
+    Tree ensembles are stored as flat node arrays (all trees concatenated,
+    leaves pointing at themselves) and evaluated for every row and every
+    tree at once, one tree level per step. Linear models are a single
+    matrix product. Labels match the scikit-learn pipeline they came from.
+    """
+
+    block_rows = 2048
+
+    def __init__(self, arrays):
+        self.kind = str(arrays['kind'])
+        self.decision = str(arrays['decision'])
+        self.classes_ = arrays['classes']
+        self.mean = arrays['scaler_mean']
+        self.scale = arrays['scaler_scale']
+        self.legacy_scaling = bool(arrays['legacy_scaling'])
+        self.init = arrays['init']
+        if self.kind == 'trees':
+            self.roots = arrays['roots']
+            self.feature = arrays['feature']
+            self.threshold = arrays['threshold']
+            self.left = arrays['left']
+            self.right = arrays['right']
+            self.value = arrays['value']
+            self.depth = int(arrays['depth'])
+        else:
+            self.coef = arrays['coef']
+        features = [str(name) for name in arrays['features']]
+        if features != FEATURES:
+            raise ValueError(f"Model feature schema {features} does not match {FEATURES}")
+        self.metadata = {
+            'format': 'numpy',
+            'kind': self.kind,
+            'version': int(arrays['version']),
+            'features': features,
+        }
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def _transform(self, X):
+        if self.legacy_scaling:
+            return _legacy_scale(X)
+        return (X - self.mean) / self.scale
+
+    def _apply_trees(self, X):
+        # scikit-learn compares float32 features against float64 thresholds
+        X = X.astype(np.float32).astype(np.float64)
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        # One flat (row, tree) slot per entry, indexing into the raveled rows
+        row_offset = np.repeat(np.arange(n_rows) * n_features, n_trees)
+        nodes = np.tile(self.roots, n_rows)
+        X = X.ravel()
+        for _ in range(self.depth):
+            go_left = X[row_offset + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes].reshape(n_rows, n_trees, -1).sum(axis=1)
+
+    def decision_function(self, X, scaled=False):
+        # scaled=True skips the scaler, for inputs that are already scaled
+        X = np.asarray(X, dtype=float)
+        if not scaled:
+            X = self._transform(X)
+        if self.kind != 'trees':
+            return X @ self.coef.T + self.init
+        # Node indices are rows x trees, so walk the ensemble in blocks of rows
+        raw = np.empty((len(X), len(self.init)))
+        for start in range(0, len(X), self.block_rows):
+            raw[start:start + self.block_rows] = self._apply_trees(X[start:start + self.block_rows])
+        return raw + self.init
+
+    def predict(self, X, scaled=False):
+        raw = self.decision_function(X, scaled)
+        if self.decision == 'binary':
+            return self.classes_[(raw[:, 0] > 0).astype(int)]
+        return self.classes_[np.argmax(raw, axis=1)]
+
+
+class ModelRegistry:
+    """
+    Process-wide cache for the trained model.
+
+    The artifact is unpickled once and reused by every call. The file is
+    re-checked at most every `check_interval` seconds and only reloaded when
+    its mtime/size changed and its content hash differs from the loaded one.
+    Without an explicit `path` the default is re-resolved on every check, so
+    a pipeline published by retrain.py replaces the legacy classifier live.
+    """
+
+    def __init__(self, path=None, mmap_mode=MODEL_MMAP_MODE,
+                 check_interval=MODEL_CHECK_INTERVAL):
+        self._follow_default = path is None
+        self.path = path or MODEL_PATH
+        self.mmap_mode = mmap_mode
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._model = None
+        self._stat = None
+        self._last_check = 0.0
+        self._info = {}
+
+    @timed('model_load', help="Seconds spent checking and loading the model artifact")
+    def _load(self, stat):
+        sha256 = file_sha256(self.path)
+        if self._model is not None and sha256 == self._info.get('version'):
+            # Touched but unchanged, keep the loaded model
+            self._stat = stat
+            return
+
+        before = _rss_bytes()
+        start = time.perf_counter()
+        if self.path.endswith('.npz'):
+            model = NumpyModel.load(self.path)
+            metadata = model.metadata
+        else:
+            import joblib
+            try:
+                model, metadata = as_pipeline(joblib.load(self.path, mmap_mode=self.mmap_mode))
+            except ValueError as e:
+                print(f"Refusing to serve {self.path}: {e}")
+                raise
+        load_seconds = time.perf_counter() - start
+        after = _rss_bytes()
+        # Approximate: pages freed by other threads meanwhile shrink it, and
+        # memory-mapped arrays only count once they are touched
+        footprint = max(after - before, 0) if before is not None and after is not None else None
+
+        self._model = model
+        self._stat = stat
+        self._info = {
+            'path': os.path.abspath(self.path),
+            'version': sha256,
+            'mtime': stat.st_mtime,
+            'file_bytes': stat.st_size,
+            'memory_bytes': footprint,
+            'mmap_mode': self.mmap_mode,
+            'load_seconds': load_seconds,
+            'loaded_at': time.time(),
+            'load_count': self._info.get('load_count', 0) + 1,
+            'pipeline_version': metadata.get('version'),
+            'format': metadata.get('format'),
+            'classes': [str(label) for label in getattr(model, 'classes_', [])],
+            'created_at': metadata.get('created_at'),
+            'training_mode': metadata.get('training_mode'),
+            'training_rows': metadata.get('training_rows'),
+            'trained_at': metadata.get('trained_at'),
+        }
+
+    def get(self):
+        now = time.monotonic()
+        if self._model is not None and now - self._last_check < self.check_interval:
+            return self._model
+
+        with self._lock:
+            if self._model is None or now - self._last_check >= self.check_interval:
+                if self._follow_default:
+                    self.path = _default_model_path()
+                stat = os.stat(self.path)
+                changed = (self._stat is None
+                           or stat.st_mtime_ns != self._stat.st_mtime_ns
+                           or stat.st_size != self._stat.st_size)
+                if changed:
+                    self._load(stat)
+                self._last_check = now
+            return self._model
+
+    def info(self):
+        self.get()
+        return dict(self._info)
+
+    def clear(self):
+        with self._lock:
+            self._model = None
+            self._stat = None
+            self._last_check = 0.0
+
+
+_registry = ModelRegistry()
+
+
+def get_model():
+    """Return the shared scaler + classifier pipeline, loading or reloading it only when needed."""
+    return _registry.get()
+
+
+def model_info():
+    """Return load time, version (sha256), and memory footprint of the loaded model."""
+    return _registry.info()
+
+
+def _predict_matrix(model, X):
+    # The pipeline only calls transform on its fitted scaler, never fit
+    return model.predict(X)
+
+
+def _to_matrix(rows):
+    # rows is a list of mappings keyed by FEATURES
+    try:
+        return np.array([[row[name] for name in FEATURES] for row in rows], dtype=float)
+    except KeyError as e:
+        raise ValueError(f"Missing feature {e.args[0]!r} in input record") from None
+
+
+def _iter_record_chunks(records, chunk_size):
+    records = iter(records)
+    while True:
+        rows = list(islice(records, chunk_size))
+        if not rows:
+            return
+        yield _to_matrix(rows)
+
+
+@timed('model_predict', help="Seconds per predict call", mode='batch')
+def predict_batch(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Score many snapshots with one model.predict call per chunk.
+
+    Parameters:
+    data: pandas DataFrame with the FEATURES columns, 2-D ndarray whose
+          columns are already in FEATURES order, or an iterable of dicts
+          keyed by the feature names
+    chunk_size (int): Maximum number of rows scored at once
+
+    Returns:
+    numpy.ndarray: One label per input row, in input order
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    model = get_model()
+
+    if hasattr(data, 'columns') and hasattr(data, 'to_numpy'):
+        missing = [name for name in FEATURES if name not in data.columns]
+        if missing:
+            raise ValueError(f"DataFrame is missing feature columns: {missing}")
+        data = data[FEATURES].to_numpy(dtype=float)
+
+    if isinstance(data, np.ndarray):
+        if data.ndim != 2 or data.shape[1] != len(FEATURES):
+            raise ValueError(f"Expected a 2-D array with {len(FEATURES)} columns, got shape {data.shape}")
+        chunks = (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+    else:
+        chunks = _iter_record_chunks(data, chunk_size)
+
+    labels = []
+    for X in chunks:
+        labels.append(_predict_matrix(model, X.astype(float, copy=False)))
+        count('model_predicted_rows', len(X), help="Rows scored by predict_batch")
+    if not labels:
+        return np.empty(0, dtype=getattr(model, 'classes_', np.empty(0)).dtype)
+    return np.concatenate(labels)
+
+
+@timed('model_predict', mode='single')
 def predict(Grid_Voltage, Cooling_Temperature, CPU_Utilization, Memory_Usage, Bandwidth_Utilization,
-            Throughput, Latency, Jitter, Packet_Loss, Error_Rates, 
-            Connection_Establishment_Termination_Times, Network_Availability, 
+            Throughput, Latency, Jitter, Packet_Loss, Error_Rates,
+            Connection_Establishment_Termination_Times, Network_Availability,
             Transmission_Delay, Network_Traffic_Volume):
-    # Load the trained model and scaler
-    model = joblib.load('noc_new.joblib')
-    scaler = StandardScaler()
-
-    # Create a dictionary from the input arguments
-    input_data = {
-        'Grid_Voltage': Grid_Voltage,
-        'Cooling_Temperature': Cooling_Temperature,
-        'CPU_Utilization': CPU_Utilization,
-        'Memory_Usage': Memory_Usage,
-        'Bandwidth_Utilization': Bandwidth_Utilization,
-        'Throughput': Throughput,
-        'Latency': Latency,
-        'Jitter': Jitter,
-        'Packet_Loss': Packet_Loss,
-        'Error_Rates': Error_Rates,
-        'Connection_Establishment_Termination_Times': Connection_Establishment_Termination_Times,
-        'Network_Availability': Network_Availability,
-        'Transmission_Delay': Transmission_Delay,
-        'Network_Traffic_Volume': Network_Traffic_Volume,
-    }
-
-    # Convert the input data into a list that matches the order of your features
-    input = [
-        input_data['Grid_Voltage'],
-        input_data['Cooling_Temperature'],
-        input_data['CPU_Utilization'],
-        input_data['Memory_Usage'],
-        input_data['Bandwidth_Utilization'],
-        input_data['Throughput'],
-        input_data['Latency'],
-        input_data['Jitter'],
-        input_data['Packet_Loss'],
-        input_data['Error_Rates'],
-        input_data['Connection_Establishment_Termination_Times'],
-        input_data['Network_Availability'],
-        input_data['Transmission_Delay'],
-        input_data['Network_Traffic_Volume'],
-    ]
-
-    # Reshape input for scaling (it should be a 2D array)
-    input_reshaped = [input]  # Make it a list of lists
-
-    # Scale the input data
-    scaled_input = scaler.fit_transform(input_reshaped)
+    # Get the trained model from the registry (loaded once per process)
+    model = get_model()
+
+    # Build a single row that matches the order of the features
+    input = np.array([[
+        Grid_Voltage,
+        Cooling_Temperature,
+        CPU_Utilization,
+        Memory_Usage,
+        Bandwidth_Utilization,
+        Throughput,
+        Latency,
+        Jitter,
+        Packet_Loss,
+        Error_Rates,
+        Connection_Establishment_Termination_Times,
+        Network_Availability,
+        Transmission_Delay,
+        Network_Traffic_Volume,
+    ]], dtype=float)
 
     # Make a prediction
-    prediction = model.predict(scaled_input)
+    prediction = _predict_matrix(model, input)
 
     # Output the prediction
-    return prediction[0]  # Will return 'Normal' or 'Abnormal'
\ No newline at end of file
+    return prediction[0]  # Will return 'Normal' or 'Abnormal'
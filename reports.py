@@ -0,0 +1,163 @@
+import argparse
+import json
+from datetime import datetime
+
+import pandas as pd
+
+from metrics import timed
+from rules import DEFAULT_RULES, rule_sections
+from storage import DB_PATH, REPORT_METRICS, get_connection
+
+# Reports are rendered from the stored metrics and rule hits when they are
+# read; only text the user edited is stored. Placeholders are report columns
+# plus the diagnosis and remediation sections derived from the rule hits.
+REPORT_TEMPLATE = """System Status Report - {Date_and_Time}
+
+Overall Status: {System_State}
+
+Network Performance Metrics:
+- Bandwidth Utilization: {Bandwidth_Utilization}%
+- Throughput: {Throughput} Mbps
+- Latency: {Latency} ms
+- Jitter: {Jitter} ms
+- Packet Loss: {Packet_Loss}%
+- Network Availability: {Network_Availability}%
+
+System Resource Metrics:
+- CPU Utilization: {CPU_Utilization}%
+- Memory Usage: {Memory_Usage}%
+- Grid Voltage: {Grid_Voltage} V
+- Cooling Temperature: {Cooling_Temperature}°C
+
+Network Traffic Analysis:
+- Network Traffic Volume: {Network_Traffic_Volume} Mbps
+- Error Rates: {Error_Rates}
+- Transmission Delay: {Transmission_Delay} ms
+- Connection Establishment/Termination Times: {Connection_Establishment_Termination_Times} ms
+
+System Diagnosis:
+- {diagnosis}
+
+Recommended Actions:
+{remediation}
+"""
+
+# Bound once; str.format parses the template in C on every call
+_format = REPORT_TEMPLATE.format
+
+EXPORT_CHUNK_ROWS = 20000
+
+
+def _stored_hits(value):
+    # NULL (reports saved before rule hits were stored) or -1 (archive) means unknown
+    if value is None or pd.isna(value) or value < 0:
+        return None
+    return int(value)
+
+
+@timed('report_render', help="Seconds to render report text", mode='single')
+def render_report(record, rule_hits=None):
+    """
+    Render the report text for one report.
+
+    Parameters:
+    record (dict): The metric columns, System_State and Date_and_Time
+    rule_hits (int): Rule bitmask from rules.RuleSet.bitmask, computed from the metrics if omitted
+
+    Returns:
+    str: The report text
+    """
+    if rule_hits is None:
+        rule_hits = _stored_hits(record.get('rule_hits'))
+    if rule_hits is None:
+        rule_hits = int(DEFAULT_RULES.bitmask(record)[0])
+    diagnosis, remediation = rule_sections(rule_hits)
+    if not record.get('Date_and_Time'):
+        record = {**record, 'Date_and_Time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    return _format(**record, diagnosis=diagnosis, remediation=remediation)
+
+
+def report_text(details):
+    """The user's edited text if one was saved, otherwise the rendered report."""
+    return details.get('report_text') or render_report(details)
+
+
+@timed('report_render', mode='batch')
+def render_reports(frame):
+    """
+    Render many reports at once.
+
+    Rule hits missing from `frame` are computed in one vectorized pass and
+    the rule sections come from the rule_sections cache, so the per-row work
+    is a single str.format call. Edited report_text is used where present.
+
+    Returns:
+    list: Report texts in row order
+    """
+    if frame.empty:
+        return []
+    hits = frame['rule_hits'] if 'rule_hits' in frame.columns else pd.Series(-1, index=frame.index)
+    hits = hits.fillna(-1).astype('int64').to_numpy(copy=True)
+    missing = hits < 0
+    if missing.any():
+        hits[missing] = DEFAULT_RULES.bitmask(frame.loc[missing, REPORT_METRICS])
+    edited = frame['report_text'] if 'report_text' in frame.columns else [None] * len(frame)
+    columns = ['Date_and_Time', 'System_State', *REPORT_METRICS]
+
+    texts = []
+    for values, rule_hits, text in zip(frame[columns].itertuples(index=False), hits, edited):
+        if isinstance(text, str) and text:
+            texts.append(text)
+            continue
+        diagnosis, remediation = rule_sections(int(rule_hits))
+        texts.append(_format(**values._asdict(), diagnosis=diagnosis, remediation=remediation))
+    return texts
+
+
+def export_reports(output_path, start=None, end=None, db_path=DB_PATH):
+    """
+    Write every report (optionally within [start, end]) to a JSONL file with
+    its rendered text, streaming the table in chunks.
+
+    Returns:
+    int: Number of reports exported
+    """
+    where, params = [], []
+    if start:
+        where.append("Date_and_Time >= ?")
+        params.append(start)
+    if end:
+        where.append("Date_and_Time <= ?")
+        params.append(end if len(end) > 10 else end + ' 23:59:59')
+    sql = f"""SELECT id, Date_and_Time, {', '.join(REPORT_METRICS)}, System_State,
+                     rule_hits, report_text, feedback FROM reports"""
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY Date_and_Time, id"
+
+    exported = 0
+    with open(output_path, 'w') as f:
+        for chunk in pd.read_sql_query(sql, get_connection(db_path), params=params,
+                                       chunksize=EXPORT_CHUNK_ROWS):
+            texts = render_reports(chunk)
+            for row, text in zip(chunk[['id', 'Date_and_Time', 'System_State', 'feedback']]
+                                 .itertuples(index=False), texts):
+                f.write(json.dumps({'id': row.id, 'Date_and_Time': row.Date_and_Time,
+                                    'System_State': row.System_State, 'report_text': text,
+                                    'feedback': row.feedback}) + '\n')
+            exported += len(chunk)
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export saved reports with their rendered text")
+    parser.add_argument('output', help="JSONL file to write")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--start', help="Earliest Date_and_Time (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Latest Date_and_Time (YYYY-MM-DD)")
+    args = parser.parse_args()
+    print(f"Exported {export_reports(args.output, args.start, args.end, args.db):,} reports to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import fcntl
+import os
+import signal
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from metrics import count, observe
+from model import FEATURES, NUMPY_MODEL_PATH, PIPELINE_PATH, as_pipeline
+from storage import DB_PATH, create_database, get_connection
+from train import CLASSIFIER_PARAMS, LABEL_COLUMN, load_training_data, read_manifest, save_pipeline
+
+# Worker schedule: check every RETRAIN_INTERVAL seconds and only update once
+# at least RETRAIN_MIN_ROWS reports have been corrected since the last version
+RETRAIN_INTERVAL = float(os.getenv('RETRAIN_INTERVAL', 300))
+RETRAIN_MIN_ROWS = int(os.getenv('RETRAIN_MIN_ROWS', 50))
+
+# Trees added per incremental update; past RETRAIN_MAX_ESTIMATORS the model
+# is refit from scratch so it doesn't grow without bound. The added trees are
+# stumps: the full-depth trees are so confident that deep trees fitted to a
+# small batch take huge steps and cost more accuracy than they gain
+INCREMENTAL_ESTIMATORS = int(os.getenv('INCREMENTAL_ESTIMATORS', 10))
+INCREMENTAL_MAX_DEPTH = int(os.getenv('INCREMENTAL_MAX_DEPTH', 1))
+RETRAIN_MAX_ESTIMATORS = int(os.getenv('RETRAIN_MAX_ESTIMATORS', 400))
+
+# Share of the new rows held out to check an update before it is published;
+# an update that loses more than RETRAIN_MAX_REGRESSION accuracy on them is
+# discarded and the current version kept
+VALIDATION_FRACTION = float(os.getenv('VALIDATION_FRACTION', 0.2))
+RETRAIN_MAX_REGRESSION = float(os.getenv('RETRAIN_MAX_REGRESSION', 0.01))
+
+# The only labels learned from the reports are operator corrections: the
+# model's own predicted_state would just teach it what it already believes.
+# A full retrain can also start from a labelled CSV (the 14 feature columns
+# and train.LABEL_COLUMN), e.g. the data the shipped classifier came from;
+# each correction then counts CORRECTION_WEIGHT times as much as a CSV row
+RETRAIN_DATA = os.getenv('RETRAIN_DATA')
+CORRECTION_WEIGHT = float(os.getenv('CORRECTION_WEIGHT', 5.0))
+
+# Older corrections replayed per class missing from an incremental batch
+REPLAY_ROWS_PER_CLASS = int(os.getenv('REPLAY_ROWS_PER_CLASS', 50))
+
+FIRST_RUN_HELP = ("Correct the model label of reports of at least two classes in the Reports tab, "
+                  "or pass a labelled CSV with --data (or RETRAIN_DATA)")
+
+
+def _label_map(classes):
+    # Labels are stored as str(label); map them back to the classifier's dtype
+    return {str(label): label for label in classes}
+
+
+def load_labelled_reports(where, params=(), classes=None, db_path=DB_PATH):
+    """
+    Training rows from the operator corrections in the reports table.
+
+    Parameters:
+    where (str): SQL condition selecting the rows; only corrected ones are used
+    params (tuple): Parameters of `where`
+    classes (array): Label vocabulary of the model being extended; labels
+                     outside it are dropped. None keeps every label as a string
+
+    Returns:
+    tuple: (X, y, ids)
+    """
+    frame = pd.read_sql_query(
+        f"SELECT id, {', '.join(FEATURES)}, corrected_state AS label "
+        f"FROM reports WHERE corrected_state IS NOT NULL AND ({where}) ORDER BY id",
+        get_connection(db_path), params=params)
+    labels = frame['label'] if classes is None else frame['label'].map(_label_map(classes))
+    frame = frame[labels.notna()]
+    X = frame[FEATURES].to_numpy(dtype=float)
+    y = np.asarray(labels[labels.notna()].tolist())
+    return X, y, frame['id'].to_numpy()
+
+
+def _last_correction(db_path=DB_PATH):
+    # (corrected_at, id) of the newest correction; a run learns the
+    # corrections up to it and the next run continues after it
+    row = get_connection(db_path).execute(
+        "SELECT corrected_at, id FROM reports WHERE corrected_state IS NOT NULL "
+        "ORDER BY corrected_at DESC, id DESC LIMIT 1").fetchone()
+    return tuple(row) if row else ('', 0)
+
+
+def _replay_rows(classes, trained_through, db_path=DB_PATH):
+    # A warm-started boosting model must see every class it was trained on
+    # in each fit, so borrow a few older corrections of the classes a batch lacks
+    where = ("id IN (SELECT id FROM reports WHERE corrected_state = ? AND (corrected_at, id) <= (?, ?) "
+             "ORDER BY corrected_at DESC, id DESC LIMIT ?)")
+    parts = [load_labelled_reports(where, (str(label), *trained_through, REPLAY_ROWS_PER_CLASS), classes, db_path)
+             for label in classes]
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def _score(pipeline, X, y):
+    if not len(X):
+        return 1.0
+    return float(np.mean(pipeline.predict(X) == y))
+
+
+def train_full(db_path=DB_PATH, output_path=PIPELINE_PATH, data_path=RETRAIN_DATA, label_column=LABEL_COLUMN):
+    """
+    Fit a new scaler + classifier on every corrected report, plus the
+    labelled CSV at `data_path` if given, and publish it.
+
+    On a new installation there are no corrections yet; the shipped pipeline
+    keeps serving until there are corrections of two classes or a CSV.
+
+    Returns:
+    dict: The manifest of the published version
+    """
+    through = _last_correction(db_path)
+    X, y, _ = load_labelled_reports("(corrected_at, id) <= (?, ?)", through, db_path=db_path)
+    weights = np.ones(len(X))
+    training_data = f'reports:{os.path.basename(db_path)}'
+    if data_path:
+        seed_X, seed_y = load_training_data(data_path, label_column)
+        if seed_y is None:
+            raise ValueError(f"{data_path} has no {label_column!r} label column")
+        X, y = np.vstack([seed_X, X]), np.concatenate([seed_y.astype(str).to_numpy(), y])
+        weights = np.concatenate([np.ones(len(seed_X)), np.full(len(weights), CORRECTION_WEIGHT)])
+        training_data = f'{os.path.basename(data_path)}+{training_data}'
+    if len(np.unique(y)) < 2:
+        raise ValueError(f"Need labelled reports of at least two classes to train on, found "
+                         f"{np.unique(y).tolist()}. {FIRST_RUN_HELP}")
+
+    start = time.perf_counter()
+    scaler = StandardScaler().fit(X)
+    classifier = GradientBoostingClassifier(**CLASSIFIER_PARAMS).fit(scaler.transform(X), y, sample_weight=weights)
+    seconds = time.perf_counter() - start
+    observe('retrain', seconds, help="Seconds spent fitting the classifier", mode='full')
+
+    pipeline = Pipeline([('scaler', scaler), ('classifier', classifier)])
+    return save_pipeline(pipeline, output_path, training_data=training_data, training_rows=len(X),
+                         training_mode='full', training_seconds=seconds, trained_at=through[0],
+                         trained_through_id=through[1])
+
+
+def train_incremental(db_path=DB_PATH, output_path=PIPELINE_PATH, min_rows=RETRAIN_MIN_ROWS,
+                      data_path=RETRAIN_DATA):
+    """
+    Add trees for the reports corrected since the last run and publish the result.
+
+    The scaler stays frozen and the classifier is warm-started with
+    INCREMENTAL_ESTIMATORS more trees fitted on the new corrections only.
+    The first run extends the shipped pipeline with every correction so far.
+    Falls back to train_full (with `data_path`) when there is no pipeline
+    to extend or it has reached RETRAIN_MAX_ESTIMATORS. An update that does
+    worse than the current version on the held-out share of the new rows is
+    discarded.
+
+    Returns:
+    dict: The manifest of the published version, or None if fewer than
+    `min_rows` reports were corrected or the update was discarded
+    """
+    if not os.path.exists(output_path):
+        return train_full(db_path, output_path, data_path)
+    manifest = read_manifest(output_path) or {}
+    pipeline, _ = as_pipeline(joblib.load(output_path))
+    scaler, classifier = pipeline.named_steps['scaler'], pipeline.named_steps['classifier']
+    if not isinstance(classifier, GradientBoostingClassifier) or not isinstance(scaler, StandardScaler):
+        return train_full(db_path, output_path, data_path)
+
+    # The shipped pipeline was never trained on corrections, so it takes all of them
+    previous = (manifest.get('trained_at') or '', manifest.get('trained_through_id') or 0)
+    through = _last_correction(db_path)
+    X, y, _ = load_labelled_reports("(corrected_at, id) > (?, ?) AND (corrected_at, id) <= (?, ?)",
+                                    (*previous, *through), classifier.classes_, db_path)
+    new_rows = len(X)
+    if new_rows < min_rows:
+        return None
+    if classifier.n_estimators_ + INCREMENTAL_ESTIMATORS > RETRAIN_MAX_ESTIMATORS:
+        return train_full(db_path, output_path, data_path)
+
+    held_out = np.random.default_rng(new_rows).random(len(X)) < VALIDATION_FRACTION
+    X_val, y_val = X[held_out], y[held_out]
+    X, y = X[~held_out], y[~held_out]
+    missing = [label for label in classifier.classes_ if label not in set(y.tolist())]
+    if missing:
+        replay_X, replay_y, _ = _replay_rows(missing, previous, db_path)
+        X, y = np.vstack([X, replay_X]), np.concatenate([y, replay_y])
+        missing = [label for label in classifier.classes_ if label not in set(y.tolist())]
+        if missing:
+            raise ValueError(f"No corrections of class {', '.join(map(str, missing))} yet; extending the model "
+                             f"needs corrections of all of {[str(label) for label in classifier.classes_]}. "
+                             f"Correct reports of those classes, or run a full retrain (--full)")
+
+    score_before = _score(pipeline, X_val, y_val)
+    start = time.perf_counter()
+    max_depth = classifier.max_depth
+    classifier.set_params(warm_start=True, n_estimators=classifier.n_estimators_ + INCREMENTAL_ESTIMATORS,
+                          max_depth=INCREMENTAL_MAX_DEPTH)
+    classifier.fit(scaler.transform(X), y)
+    classifier.set_params(warm_start=False, max_depth=max_depth)
+    seconds = time.perf_counter() - start
+    score_after = _score(pipeline, X_val, y_val)
+    if score_after < score_before - RETRAIN_MAX_REGRESSION:
+        print(f"Incremental update dropped held-out accuracy from {score_before:.3f} to {score_after:.3f}; "
+              f"keeping version {manifest.get('version')}")
+        count('retrain_rejected', help="Incremental updates discarded by the held-out check")
+        return None
+    observe('retrain', seconds, help="Seconds spent fitting the classifier", mode='incremental')
+
+    return save_pipeline(pipeline, output_path, training_data=f'reports:{os.path.basename(db_path)}',
+                         training_rows=manifest.get('training_rows', 0) + new_rows, training_mode='incremental',
+                         training_seconds=seconds, trained_at=through[0], trained_through_id=through[1],
+                         base_version=manifest.get('version'),
+                         validation_accuracy=score_after, validation_rows=len(X_val))
+
+
+def retrain_once(db_path=DB_PATH, output_path=PIPELINE_PATH, full=False, min_rows=RETRAIN_MIN_ROWS,
+                 numpy_path=None, data_path=RETRAIN_DATA):
+    """
+    Run one full or incremental update, holding a lock so only one runs at a time.
+
+    The artifact and its manifest are replaced atomically; predictors pick up
+    the new version on their next ModelRegistry check without a restart.
+
+    Returns:
+    dict: The published manifest, or None if there was nothing to do
+    """
+    create_database(db_path)
+    with open(output_path + '.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"Another retrain of {output_path} is running")
+            return None
+        if full:
+            manifest = train_full(db_path, output_path, data_path)
+        else:
+            manifest = train_incremental(db_path, output_path, min_rows, data_path)
+        if manifest is not None:
+            count('retrain', help="Model versions published by retrain.py", mode=manifest['training_mode'])
+            if numpy_path:
+                from compile_model import export_numpy_model
+                export_numpy_model(output_path, numpy_path)
+    return manifest
+
+
+def run_worker(db_path=DB_PATH, output_path=PIPELINE_PATH, interval=RETRAIN_INTERVAL,
+               min_rows=RETRAIN_MIN_ROWS, numpy_path=None, data_path=RETRAIN_DATA):
+    """Retrain incrementally every `interval` seconds until interrupted or terminated."""
+    # SIGTERM stops like Ctrl-C; a fit in progress is abandoned, never half-published
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Retraining {output_path} from {db_path} every {interval:g}s (min {min_rows} new corrections)")
+    try:
+        while True:
+            try:
+                manifest = retrain_once(db_path, output_path, min_rows=min_rows, numpy_path=numpy_path,
+                                        data_path=data_path)
+                if manifest is not None:
+                    _print_manifest(manifest, output_path)
+            except Exception as e:
+                # Keep serving the last published version and try again next round
+                print(f"Retrain failed: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Retrain worker stopped")
+
+
+def _print_manifest(manifest, output_path):
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} published {output_path} version {manifest['version']} "
+          f"({manifest['training_mode']}, {manifest['training_rows']:,} rows, "
+          f"{manifest['training_seconds']:.2f}s, corrections up to {(manifest['trained_at'] or 'none')[:19]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the classifier from stored reports and operator corrections")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--output', default=PIPELINE_PATH)
+    parser.add_argument('--min-rows', type=int, default=RETRAIN_MIN_ROWS,
+                        help="New corrections needed for an incremental update (default: %(default)s)")
+    parser.add_argument('--data', default=RETRAIN_DATA,
+                        help=f"Labelled CSV (feature columns and {LABEL_COLUMN!r}) to fit on alongside the "
+                             "corrections in a full retrain; needed until reports of two classes are corrected")
+    parser.add_argument('--numpy', action='store_true',
+                        help=f"Also compile each published version to {NUMPY_MODEL_PATH}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    once_parser = subparsers.add_parser('once', help="Run a single update")
+    once_parser.add_argument('--full', action='store_true', help="Refit from scratch instead of adding trees")
+
+    worker_parser = subparsers.add_parser('worker', help="Keep retraining in the background")
+    worker_parser.add_argument('--interval', type=float, default=RETRAIN_INTERVAL,
+                               help="Seconds between checks (default: %(default)s)")
+    args = parser.parse_args()
+
+    numpy_path = NUMPY_MODEL_PATH if args.numpy else None
+    if args.command == 'worker':
+        run_worker(args.db, args.output, args.interval, args.min_rows, numpy_path, args.data)
+        return
+    try:
+        manifest = retrain_once(args.db, args.output, args.full, args.min_rows, numpy_path, args.data)
+    except ValueError as e:
+        print(f"Retrain failed: {e}")
+        raise
+    if manifest is None:
+        print(f"No new version published (fewer than {args.min_rows} new corrections, the update did worse "
+              f"on held-out corrections, or another retrain is running)")
+    else:
+        _print_manifest(manifest, args.output)
+
+
+if __name__ == "__main__":
+    main()
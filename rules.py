@@ -0,0 +1,207 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+Rule = namedtuple('Rule', ['metric', 'operator', 'threshold', 'severity', 'diagnosis', 'remediation', 'abnormal'],
+                  defaults=(None,))
+
+# Single source of truth for the threshold checks used by the prediction tab,
+# the report diagnosis, the remediation suggestions and the Q&A prompt.
+# Any 'critical' rule that fires makes a snapshot Abnormal. Where the state
+# check has a different boundary from the report check, it is given as
+# abnormal=(operator, threshold); a rule without a diagnosis only adds its
+# remediation to the report.
+RULES = [
+    Rule('CPU_Utilization', '>=', 80, 'critical',
+         "High CPU utilization indicating system overload",
+         "- Identify and terminate resource-intensive processes\n- Consider upgrading CPU capacity\n- Implement better load balancing"),
+    Rule('Memory_Usage', '>=', 80, 'critical',
+         "Elevated memory usage suggesting resource constraints",
+         "- Clear system cache\n- Optimize memory-intensive applications\n- Consider increasing RAM capacity"),
+    Rule('Error_Rates', '>=', 5, 'critical',
+         "High error rates detected indicating potential system issues",
+         "- Review system logs for error patterns\n- Update system dependencies\n- Implement error tracking and monitoring"),
+    Rule('Network_Traffic_Volume', '>', 1000, 'warning',
+         "Excessive network traffic detected suggesting potential network congestion",
+         "- Review network traffic patterns\n- Implement traffic shaping\n- Consider bandwidth upgrade"),
+    Rule('Cooling_Temperature', '>', 30, 'warning',
+         "Elevated cooling temperature indicating potential cooling system issues",
+         "- Check cooling system functionality\n- Ensure proper ventilation\n- Monitor temperature trends"),
+    Rule('Bandwidth_Utilization', '>', 90, 'critical',
+         "High bandwidth utilization indicating potential network bottleneck",
+         "- Analyze bandwidth consumption patterns\n- Implement QoS policies\n- Consider bandwidth optimization techniques",
+         abnormal=('>=', 90)),
+    Rule('Latency', '>', 100, 'critical',
+         "High network latency detected affecting system performance",
+         "- Check network connectivity\n- Identify network bottlenecks\n- Optimize network routing",
+         abnormal=('>=', 100)),
+    Rule('Packet_Loss', '>', 2, 'critical',
+         "Significant packet loss detected affecting network reliability",
+         "- Investigate network connectivity issues\n- Check for network congestion\n- Verify network hardware functionality",
+         abnormal=('>=', 2)),
+    Rule('Jitter', '>', 30, 'critical',
+         "High jitter levels affecting network stability",
+         "- Monitor network stability\n- Implement jitter buffering\n- Check for network interference",
+         abnormal=('>=', 30)),
+    Rule('Network_Availability', '<', 99, 'critical',
+         "Reduced network availability affecting system reliability",
+         "- Review network infrastructure\n- Implement redundancy measures\n- Check for single points of failure",
+         abnormal=('<=', 98)),
+    Rule('Transmission_Delay', '>', 200, 'warning',
+         "High transmission delay affecting data transfer efficiency",
+         "- Optimize data transmission paths\n- Review network topology\n- Consider content delivery optimization"),
+    Rule('Connection_Establishment_Termination_Times', '>', 1000, 'warning',
+         None,
+         "- Check connection pooling settings\n- Optimize connection handling\n- Review connection timeout parameters"),
+]
+
+_COMPARE = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+}
+
+
+def _group(operators):
+    # Column indices per operator, so each operator is one comparison
+    return [(_COMPARE[op], np.array([j for j, other in enumerate(operators) if other == op]))
+            for op in _COMPARE if op in operators]
+
+
+def _compare(X, groups, thresholds):
+    hits = np.zeros(X.shape, dtype=bool)
+    for compare, index in groups:
+        hits[:, index] = compare(X[:, index], thresholds[index])
+    return hits
+
+
+class RuleSet:
+    """
+    Rule table compiled to one comparison per operator.
+
+    Rules are grouped by operator when the set is built, so evaluating N
+    snapshots is at most four vectorized comparisons over an (N, rules)
+    matrix rather than a Python loop per row and rule.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        # State check of each critical rule, as (rule index, operator, threshold)
+        self.states = [(j, *(rule.abnormal or (rule.operator, rule.threshold)))
+                       for j, rule in enumerate(self.rules) if rule.severity == 'critical']
+        unknown = ({rule.operator for rule in self.rules} | {op for _, op, _ in self.states}) - set(_COMPARE)
+        if unknown:
+            raise ValueError(f"Unsupported rule operators: {sorted(unknown)}")
+        self.metrics = [rule.metric for rule in self.rules]
+        self.thresholds = np.array([rule.threshold for rule in self.rules], dtype=float)
+        self.critical = np.array([rule.severity == 'critical' for rule in self.rules])
+        self.upper = np.array([rule.operator in ('>', '>=') for rule in self.rules])
+        self._groups = _group([rule.operator for rule in self.rules])
+        self._state_columns = np.array([j for j, _, _ in self.states], dtype=int)
+        self._state_thresholds = np.array([threshold for _, _, threshold in self.states], dtype=float)
+        self._state_groups = _group([op for _, op, _ in self.states])
+
+    def _matrix(self, data):
+        # Columns in rule order; accepts a DataFrame, a dict of scalars or
+        # arrays, or a list of dicts
+        if isinstance(data, list):
+            return np.array([[row[metric] for metric in self.metrics] for row in data], dtype=float)
+        try:
+            columns = [np.asarray(data[metric], dtype=float) for metric in self.metrics]
+        except KeyError as e:
+            raise ValueError(f"Missing metric {e.args[0]!r} for rule evaluation") from None
+        return np.atleast_2d(np.column_stack(columns))
+
+    def masks(self, data):
+        """Boolean (rows, rules) matrix; column j is True where rule j fires."""
+        return _compare(self._matrix(data), self._groups, self.thresholds)
+
+    def hits(self, data):
+        """Map each metric to the boolean mask of rows where its rule fires."""
+        masks = self.masks(data)
+        return {metric: masks[:, j] for j, metric in enumerate(self.metrics)}
+
+    def classify(self, data):
+        """'Abnormal' where the state check of any critical rule holds, 'Normal' elsewhere."""
+        X = self._matrix(data)[:, self._state_columns]
+        abnormal = _compare(X, self._state_groups, self._state_thresholds).any(axis=1)
+        return np.where(abnormal, 'Abnormal', 'Normal')
+
+    def pressure(self, data):
+        """
+        (rows, rules) matrix of how far each metric is towards its threshold:
+        1.0 at the threshold and above 1 past it, for upper and lower bounds alike.
+        """
+        X = self._matrix(data)
+        # Lower-bound rules (e.g. availability < 99) get worse as the value falls
+        return np.where(self.upper, X / self.thresholds, self.thresholds / np.maximum(X, 1e-9))
+
+    def worst(self, data):
+        """
+        The metric closest to (or furthest past) its threshold in each row.
+
+        Returns:
+        tuple: (metric name array, pressure array; above 1 is past the threshold)
+        """
+        pressure = self.pressure(data)
+        index = pressure.argmax(axis=1)
+        return np.array(self.metrics)[index], pressure[np.arange(len(pressure)), index]
+
+    def bitmask(self, data):
+        """Integer per row with bit j set where rule j fires, for compact storage."""
+        weights = np.left_shift(1, np.arange(len(self.rules), dtype=np.int64))
+        return self.masks(data) @ weights
+
+    def from_bitmask(self, mask):
+        """Rules encoded in a value returned by bitmask(), in table order."""
+        return [rule for j, rule in enumerate(self.rules) if int(mask) >> j & 1]
+
+    def triggered(self, row):
+        """Rules that fire for a single snapshot, in table order."""
+        fired = self.masks(row)[0]
+        return [rule for rule, hit in zip(self.rules, fired) if hit]
+
+    def describe(self, severity=None):
+        """
+        Human-readable conditions, e.g. '- CPU Utilization >= 80'.
+
+        For severity='critical' these are the state checks used by classify().
+        """
+        if severity == 'critical':
+            checks = [(self.rules[j].metric, op, threshold) for j, op, threshold in self.states]
+        else:
+            checks = [(rule.metric, rule.operator, rule.threshold)
+                      for rule in self.rules if severity is None or rule.severity == severity]
+        return "\n".join(f"- {metric.replace('_', ' ')} {op} {threshold}" for metric, op, threshold in checks)
+
+
+DEFAULT_RULES = RuleSet(RULES)
+
+
+@lru_cache(maxsize=None)
+def rule_sections(rule_hits):
+    """
+    Diagnosis and remediation text for a rule-hit bitmask.
+
+    There are at most 2**len(RULES) combinations and in practice a handful,
+    so each one is built once and shared by every report that has it.
+    """
+    fired = DEFAULT_RULES.from_bitmask(rule_hits)
+    diagnosis = "\n- ".join(rule.diagnosis for rule in fired if rule.diagnosis) or "No significant issues detected."
+    remediation = ("\n\n".join(rule.remediation for rule in fired)
+                   or "No immediate actions required. Continue regular monitoring.")
+    return diagnosis, remediation
+
+
+def evaluate(data):
+    return DEFAULT_RULES.hits(data)
+
+
+def classify(data):
+    return DEFAULT_RULES.classify(data)
+
+
+def triggered_rules(row):
+    return DEFAULT_RULES.triggered(row)
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import numpy as np
+
+import model
+from metrics import REGISTRY, observe
+
+# Reason phrases for the status codes the service sends
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# Request metrics are labelled by route; anything else counts as 'other'
+ROUTES = ('/predict', '/predict/batch', '/health', '/metrics')
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _batch_bucket(size):
+    # Power-of-two buckets: 1, 2, 4, 8, ...
+    return 1 << (size - 1).bit_length()
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-row predictions into micro-batches.
+
+    A batch is closed when it reaches `max_batch` rows or `max_wait`
+    seconds after its first row arrived, whichever comes first, and is
+    scored with one predict_batch call off the event loop. The request
+    queue holds at most `queue_size` rows; beyond that submit() raises
+    Overloaded so callers can shed load instead of queueing forever.
+    """
+
+    def __init__(self, max_batch=256, max_wait=0.005, queue_size=10000):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.batch_sizes = Counter()
+        self.rows_scored = 0
+        self.rejected = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, row):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((row, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded() from None
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Take whatever else is already waiting without blocking
+        while len(batch) < self.max_batch and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            rows = [row for row, _ in batch]
+            try:
+                labels = await loop.run_in_executor(None, model.predict_batch, rows)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), label in zip(batch, labels.tolist()):
+                if not future.done():
+                    future.set_result(label)
+            self.batch_sizes[_batch_bucket(len(batch))] += 1
+            self.rows_scored += len(batch)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'rows_scored': self.rows_scored,
+            'rejected': self.rejected,
+            'batch_size_distribution': {f'<={size}': count for size, count in sorted(self.batch_sizes.items())},
+        }
+
+
+class PredictionService:
+    """
+    Minimal HTTP/1.1 JSON service: POST /predict, POST /predict/batch, GET /health,
+    and GET /metrics in the Prometheus text format.
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.started_at = time.time()
+
+    async def handle(self, method, path, body):
+        if path == '/metrics':
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            return 200, REGISTRY.render_prometheus()
+
+        if path == '/health':
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            return 200, {
+                'status': 'ok',
+                'uptime_seconds': time.time() - self.started_at,
+                'model': {key: value for key, value in model.model_info().items()
+                          if key in ('version', 'pipeline_version', 'format', 'load_seconds')},
+                **self.batcher.stats(),
+            }
+
+        if path not in ('/predict', '/predict/batch'):
+            return 404, {'error': f'No route for {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            payload = json.loads(body or b'null')
+        except ValueError:
+            return 400, {'error': 'Body is not valid JSON'}
+
+        if path == '/predict':
+            if not isinstance(payload, dict):
+                return 400, {'error': 'Expected a JSON object with the feature values'}
+            missing = [name for name in model.FEATURES if name not in payload]
+            if missing:
+                return 400, {'error': f'Missing features: {missing}'}
+            try:
+                # Reject bad values here so one malformed row can't fail a whole micro-batch
+                row = {name: float(payload[name]) for name in model.FEATURES}
+            except (TypeError, ValueError):
+                return 400, {'error': 'Feature values must be numbers'}
+            try:
+                label = await self.batcher.submit(row)
+            except Overloaded:
+                return 503, {'error': 'Prediction queue is full, retry later'}
+            return 200, {'System_State': label}
+
+        rows = payload.get('rows') if isinstance(payload, dict) else payload
+        if not isinstance(rows, list):
+            return 400, {'error': 'Expected a JSON list of rows or {"rows": [...]}'}
+        try:
+            if rows and isinstance(rows[0], list):
+                rows = np.asarray(rows, dtype=float)
+            labels = await asyncio.get_running_loop().run_in_executor(None, model.predict_batch, rows)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        return 200, {'System_State': labels.tolist()}
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, result = 413, {'error': 'Request body too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    route = path.split('?', 1)[0]
+                    start = time.perf_counter()
+                    try:
+                        status, result = await self.handle(method, route, body)
+                    except Exception as e:
+                        status, result = 500, {'error': str(e)}
+                    observe('http_request', time.perf_counter() - start, help="Seconds per service request",
+                            route=route if route in ROUTES else 'other', status=status)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+
+                if isinstance(result, str):
+                    data, content_type = result.encode(), 'text/plain; version=0.0.4; charset=utf-8'
+                else:
+                    data, content_type = json.dumps(result).encode(), 'application/json'
+                head = [f'HTTP/1.1 {status} {REASONS[status]}',
+                        f'Content-Type: {content_type}',
+                        f'Content-Length: {len(data)}',
+                        f'Connection: {"keep-alive" if keep_alive else "close"}']
+                if status == 503:
+                    head.append('Retry-After: 1')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8600, max_batch=256, max_wait=0.005, queue_size=10000):
+    # Load the model before accepting requests so the first caller doesn't pay for it
+    model.get_model()
+    batcher = MicroBatcher(max_batch, max_wait, queue_size)
+    batcher.start()
+    service = PredictionService(batcher)
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    print(f"Prediction service listening on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP prediction service with micro-batching")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--max-batch', type=int, default=256, help="Rows per micro-batch at most")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help="How long a micro-batch waits for more rows after the first one")
+    parser.add_argument('--queue-size', type=int, default=10000,
+                        help="Queued single-row requests before new ones get 503")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.max_batch, args.max_wait_ms / 1000, args.queue_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,846 @@
+import argparse
+import queue
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from metrics import timed
+from rules import DEFAULT_RULES, rule_sections
+
+DB_PATH = 'system_reports.db'
+
+# Metric columns of the reports table, in insert order
+REPORT_METRICS = [
+    'CPU_Utilization', 'Memory_Usage', 'Bandwidth_Utilization',
+    'Throughput', 'Latency', 'Jitter', 'Packet_Loss', 'Error_Rates',
+    'Connection_Establishment_Termination_Times', 'Network_Availability',
+    'Transmission_Delay', 'Grid_Voltage', 'Cooling_Temperature',
+    'Network_Traffic_Volume',
+]
+
+# report_text only holds text the user edited; otherwise the report is
+# rendered from the metrics and rule_hits (see reports.py)
+# anomaly_flags is set by the ingest daemon's streaming detector (see anomaly.py).
+# device_id is NULL for reports made in the app rather than sent by a device.
+# System_State is always the rule table's 'Normal'/'Abnormal'; predicted_state
+# is the model's label for reports scored by bulk_score.py or ingest.py.
+# corrected_state is an operator's fix of predicted_state; retrain.py learns from it
+REPORT_COLUMNS = ['Date_and_Time', 'device_id', *REPORT_METRICS, 'System_State', 'predicted_state', 'rule_hits',
+                  'anomaly_flags', 'report_text', 'feedback', 'corrected_state', 'corrected_at']
+
+# Columns shown in the report listing; report_text and feedback are only
+# fetched by get_report_details when a report is opened
+LISTING_COLUMNS = ['id', 'Date_and_Time', 'device_id', 'System_State', 'predicted_state', *REPORT_METRICS,
+                   'anomaly_flags']
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_reports_time ON reports (Date_and_Time, id)',
+    'CREATE INDEX IF NOT EXISTS idx_reports_state_time ON reports (System_State, Date_and_Time, id)',
+    'CREATE INDEX IF NOT EXISTS idx_reports_device_time ON reports (device_id, Date_and_Time, id)',
+    # Operator corrections, the labels retrain.py reads in (corrected_at, id) order
+    'CREATE INDEX IF NOT EXISTS idx_reports_corrected ON reports (corrected_at, id) WHERE corrected_state IS NOT NULL',
+]
+
+# Diagnosis and remediation text per rule-hit bitmask. Unedited reports are
+# rendered on read (see reports.py), so this is the text they are searched by.
+# Rows are only ever added while the index exists: deleting a report from the
+# index needs the exact text it was indexed with
+RULE_TEXT_SCHEMA = '''CREATE TABLE IF NOT EXISTS rule_text
+     (rule_hits INTEGER PRIMARY KEY, text TEXT NOT NULL)'''
+
+SEARCH_VIEW_SCHEMA = '''CREATE VIEW IF NOT EXISTS reports_search AS
+     SELECT r.id, r.report_text, r.feedback,
+            CASE WHEN r.report_text IS NULL THEN t.text END AS rule_text
+     FROM reports r LEFT JOIN rule_text t ON t.rule_hits = r.rule_hits'''
+
+# The rule text a report is indexed with; an edited report_text replaces it
+_RULE_TEXT_OF = '''CASE WHEN {row}.report_text IS NULL THEN
+           (SELECT text FROM rule_text WHERE rule_hits = {row}.rule_hits) END'''
+
+# Full-text index over the report text, feedback and rule text. It is an
+# external content table (the text lives only in reports and rule_text, read
+# through reports_search) kept in sync by triggers
+FTS_SCHEMA = [
+    '''CREATE VIRTUAL TABLE reports_fts USING fts5(
+           report_text, feedback, rule_text, content='reports_search', content_rowid='id',
+           tokenize='porter unicode61')''',
+    f'''CREATE TRIGGER reports_fts_insert AFTER INSERT ON reports BEGIN
+           INSERT INTO reports_fts (rowid, report_text, feedback, rule_text)
+           VALUES (new.id, new.report_text, new.feedback, {_RULE_TEXT_OF.format(row='new')});
+       END''',
+    f'''CREATE TRIGGER reports_fts_delete AFTER DELETE ON reports BEGIN
+           INSERT INTO reports_fts (reports_fts, rowid, report_text, feedback, rule_text)
+           VALUES ('delete', old.id, old.report_text, old.feedback, {_RULE_TEXT_OF.format(row='old')});
+       END''',
+    f'''CREATE TRIGGER reports_fts_update AFTER UPDATE OF report_text, feedback, rule_hits ON reports BEGIN
+           INSERT INTO reports_fts (reports_fts, rowid, report_text, feedback, rule_text)
+           VALUES ('delete', old.id, old.report_text, old.feedback, {_RULE_TEXT_OF.format(row='old')});
+           INSERT INTO reports_fts (rowid, report_text, feedback, rule_text)
+           VALUES (new.id, new.report_text, new.feedback, {_RULE_TEXT_OF.format(row='new')});
+       END''',
+    # Index whatever was stored before the FTS table existed
+    "INSERT INTO reports_fts (reports_fts) VALUES ('rebuild')",
+]
+
+# Time-bucket rollups of the report metrics. A bucket is the Date_and_Time
+# prefix of the given length, e.g. '2025-01-31 14' for the hour granularity
+ROLLUP_GRANULARITIES = {'minute': 16, 'hour': 13, 'day': 10}
+
+ROLLUP_SCHEMA = f'''CREATE TABLE IF NOT EXISTS report_rollups
+     (granularity TEXT NOT NULL,
+      bucket TEXT NOT NULL,
+      count INTEGER NOT NULL,
+      abnormal INTEGER NOT NULL,
+      {', '.join(f'{m}_sum REAL, {m}_min REAL, {m}_max REAL, {m}_sumsq REAL' for m in REPORT_METRICS)},
+      PRIMARY KEY (granularity, bucket)) WITHOUT ROWID'''
+
+_ROLLUP_AGGREGATES = ', '.join(
+    f"TOTAL({m}), MIN({m}), MAX({m}), TOTAL({m} * {m})" for m in REPORT_METRICS)
+_ROLLUP_MERGE = ',\n            '.join(
+    f"{m}_sum = {m}_sum + excluded.{m}_sum, "
+    f"{m}_min = MIN(COALESCE({m}_min, excluded.{m}_min), COALESCE(excluded.{m}_min, {m}_min)), "
+    f"{m}_max = MAX(COALESCE({m}_max, excluded.{m}_max), COALESCE(excluded.{m}_max, {m}_max)), "
+    f"{m}_sumsq = {m}_sumsq + excluded.{m}_sumsq" for m in REPORT_METRICS)
+
+# Aggregates the reports matching {where} into rollup rows, adding to any
+# existing bucket. Parameters: granularity, bucket length, then the WHERE params
+ROLLUP_UPSERT_SQL = f'''INSERT INTO report_rollups
+     SELECT ?, substr(Date_and_Time, 1, ?), COUNT(*), TOTAL(System_State = 'Abnormal'),
+            {_ROLLUP_AGGREGATES}
+     FROM reports WHERE {{where}} GROUP BY 2
+     ON CONFLICT (granularity, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            abnormal = abnormal + excluded.abnormal,
+            {_ROLLUP_MERGE}'''
+
+# Latest report per device, kept up to date on every insert and delete so the
+# fleet overview reads one row per device instead of scanning the history.
+# worst_metric is the metric furthest towards its rule threshold (see RuleSet.worst)
+DEVICE_STATE_COLUMNS = ['report_id', 'last_seen', 'System_State', 'worst_metric', 'worst_value', 'worst_ratio',
+                        'rule_hits', 'anomaly_flags']
+
+DEVICE_STATE_SCHEMA = '''CREATE TABLE IF NOT EXISTS device_state
+     (device_id TEXT PRIMARY KEY,
+      report_id INTEGER NOT NULL,
+      last_seen TEXT NOT NULL,
+      System_State TEXT,
+      worst_metric TEXT,
+      worst_value REAL,
+      worst_ratio REAL,
+      rule_hits INTEGER,
+      anomaly_flags INTEGER,
+      report_count INTEGER NOT NULL) WITHOUT ROWID'''
+
+# Out-of-order arrivals still count, but only replace the state if newer
+_DEVICE_NEWER = "(excluded.last_seen, excluded.report_id) > (device_state.last_seen, device_state.report_id)"
+DEVICE_STATE_UPSERT_SQL = f'''INSERT INTO device_state (device_id, {', '.join(DEVICE_STATE_COLUMNS)}, report_count)
+     VALUES ({', '.join('?' * (len(DEVICE_STATE_COLUMNS) + 2))})
+     ON CONFLICT (device_id) DO UPDATE SET
+            {', '.join(f'{c} = CASE WHEN {_DEVICE_NEWER} THEN excluded.{c} ELSE {c} END'
+                       for c in DEVICE_STATE_COLUMNS)},
+            report_count = report_count + excluded.report_count'''
+
+INSERT_REPORT_SQL = f'''INSERT INTO reports ({', '.join(REPORT_COLUMNS)})
+                        VALUES ({', '.join('?' * len(REPORT_COLUMNS))})'''
+
+# Applied to every new connection. WAL lets readers run alongside a
+# writer, and NORMAL sync is durable across application crashes in WAL mode
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=134217728',
+]
+
+# Idle connections per database, shared by every thread in the process. A
+# thread borrows one connection per database on first use and keeps it until
+# it exits, when the connection goes back here. Streamlit runs each rerun on
+# a new thread, so reruns reuse a few configured connections instead of
+# opening one and re-running the PRAGMAs every time
+_idle = {}
+_idle_lock = threading.Lock()
+_local = threading.local()
+
+
+class _Borrowed(dict):
+    # db_path -> connection held by one thread; dropped with the thread's
+    # locals when it exits. SimpleQueue.put is safe to call from __del__
+    def __del__(self):
+        for db_path, conn in self.items():
+            if conn.in_transaction:
+                conn.rollback()
+            _idle[db_path].put(conn)
+
+
+def get_connection(db_path=DB_PATH):
+    """
+    Return this thread's connection to `db_path`, borrowing one on first use.
+
+    A thread keeps the connection it borrowed for every later call, so a
+    connection is only ever used by one thread at a time. When the thread
+    exits the connection returns to a process-wide pool for the next thread,
+    and a new one is only opened when none is idle.
+    """
+    borrowed = getattr(_local, 'connections', None)
+    if borrowed is None:
+        borrowed = _local.connections = _Borrowed()
+    conn = borrowed.get(db_path)
+    if conn is None:
+        with _idle_lock:
+            idle = _idle.setdefault(db_path, queue.SimpleQueue())
+        try:
+            conn = idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+        borrowed[db_path] = conn
+    return conn
+
+
+def close_connections():
+    """Close the calling thread's connections and the idle ones in the pool."""
+    borrowed = getattr(_local, 'connections', {})
+    for conn in borrowed.values():
+        conn.close()
+    borrowed.clear()
+    with _idle_lock:
+        pools = list(_idle.values())
+    for idle in pools:
+        while True:
+            try:
+                idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Callbacks run after reports are written or deleted in this process, e.g.
+# to drop cached query results; called as listener(db_path)
+_write_listeners = []
+
+
+def add_write_listener(listener):
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+def notify_write(db_path=DB_PATH):
+    for listener in list(_write_listeners):
+        try:
+            listener(db_path)
+        except Exception as e:
+            print(f"Write listener failed: {e}")
+
+
+def create_database(db_path=DB_PATH):
+    conn = get_connection(db_path)
+    c = conn.cursor()
+
+    # Check if the table exists
+    c.execute("""SELECT name FROM sqlite_master
+                 WHERE type='table' AND name='reports'""")
+    table_exists = c.fetchone() is not None
+
+    if not table_exists:
+        # Create new table with all columns
+        c.execute('''CREATE TABLE reports
+             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+              Date_and_Time TEXT,
+              device_id TEXT,
+              CPU_Utilization INTEGER,
+              Memory_Usage INTEGER,
+              Bandwidth_Utilization REAL,
+              Throughput REAL,
+              Latency REAL,
+              Jitter REAL,
+              Packet_Loss REAL,
+              Error_Rates REAL,
+              Connection_Establishment_Termination_Times REAL,
+              Network_Availability INTEGER,
+              Transmission_Delay REAL,
+              Grid_Voltage REAL,
+              Cooling_Temperature REAL,
+              Network_Traffic_Volume REAL,
+              System_State TEXT,
+              predicted_state TEXT,
+              rule_hits INTEGER,
+              anomaly_flags INTEGER,
+              report_text TEXT,
+              feedback TEXT,
+              corrected_state TEXT,
+              corrected_at TEXT)''')
+    else:
+        # Check if feedback column exists
+        c.execute("PRAGMA table_info(reports)")
+        columns = [column[1] for column in c.fetchall()]
+
+        if 'feedback' not in columns:
+            # Add feedback column to existing table
+            c.execute('ALTER TABLE reports ADD COLUMN feedback TEXT')
+        if 'rule_hits' not in columns:
+            # Older rows keep NULL and have their rule hits computed when rendered
+            c.execute('ALTER TABLE reports ADD COLUMN rule_hits INTEGER')
+        if 'anomaly_flags' not in columns:
+            c.execute('ALTER TABLE reports ADD COLUMN anomaly_flags INTEGER')
+        if 'device_id' not in columns:
+            c.execute('ALTER TABLE reports ADD COLUMN device_id TEXT')
+        if 'predicted_state' not in columns:
+            c.execute('ALTER TABLE reports ADD COLUMN predicted_state TEXT')
+        if 'corrected_state' not in columns:
+            c.execute('ALTER TABLE reports ADD COLUMN corrected_state TEXT')
+            c.execute('ALTER TABLE reports ADD COLUMN corrected_at TEXT')
+
+    for index in INDEXES:
+        c.execute(index)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='report_rollups'")
+    fill_rollups = c.fetchone() is None
+    c.execute(ROLLUP_SCHEMA)
+    if fill_rollups:
+        # Roll up the reports stored before the table existed
+        _update_rollups(conn, "Date_and_Time IS NOT NULL", ())
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='device_state'")
+    fill_device_state = c.fetchone() is None
+    c.execute(DEVICE_STATE_SCHEMA)
+    if fill_device_state:
+        _refresh_devices(conn)
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='rule_text'")
+    fill_rule_text = c.fetchone() is None
+    c.execute(RULE_TEXT_SCHEMA)
+    c.execute(SEARCH_VIEW_SCHEMA)
+    if fill_rule_text:
+        _fill_rule_text(conn)
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='reports_fts'")
+    if c.fetchone() is None:
+        # Keep the migration above if the index can't be created
+        conn.commit()
+        try:
+            for statement in FTS_SCHEMA:
+                c.execute(statement)
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5; search falls back to LIKE
+            conn.rollback()
+            print(f"Full-text search unavailable: {e}")
+
+    conn.commit()
+
+
+def _fill_rule_text(conn):
+    # Reports saved before rule hits were stored get them now, so that every
+    # report has an entry in rule_text
+    stale = pd.read_sql_query(
+        f"SELECT id, {', '.join(REPORT_METRICS)} FROM reports WHERE rule_hits IS NULL", conn)
+    if not stale.empty:
+        hits = DEFAULT_RULES.bitmask(stale[REPORT_METRICS]).tolist()
+        _add_rule_text(conn, set(hits))
+        conn.executemany("UPDATE reports SET rule_hits = ? WHERE id = ?", zip(hits, stale['id'].tolist()))
+    masks = [row[0] for row in conn.execute(
+        "SELECT DISTINCT rule_hits FROM reports WHERE rule_hits >= 0")]
+    _add_rule_text(conn, masks)
+
+
+def _add_rule_text(conn, masks):
+    conn.executemany("INSERT OR IGNORE INTO rule_text (rule_hits, text) VALUES (?, ?)",
+                     [(mask, "\n".join(rule_sections(mask))) for mask in masks])
+
+
+# Search without FTS5: the same three texts, matched as a substring
+_LIKE_SEARCH = """{row}.report_text LIKE ? OR {row}.feedback LIKE ?
+    OR ({row}.report_text IS NULL AND EXISTS (SELECT 1 FROM rule_text t
+        WHERE t.rule_hits = {row}.rule_hits AND t.text LIKE ?))"""
+
+
+def has_fts(db_path=DB_PATH):
+    return get_connection(db_path).execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='reports_fts'").fetchone() is not None
+
+
+def fts_query(text):
+    """
+    Turn search box input into an FTS5 query.
+
+    Words are matched as terms (all must appear), "quoted text" as a phrase
+    and a trailing * as a prefix, e.g. 'cpu "packet loss" overl*'. Anything
+    else is quoted so user input can't produce an FTS5 syntax error.
+    """
+    terms = []
+    for token in re.findall(r'"[^"]*"|\S+', text):
+        prefix = token.endswith('*') and not token.startswith('"')
+        word = token.strip('"*').replace('"', '')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def _report_row(record, timestamp, rule_hits):
+    # record is a mapping with the metric columns and System_State;
+    # Date_and_Time, device_id, predicted_state, anomaly_flags, report_text,
+    # feedback and corrected_state are optional
+    return (record.get('Date_and_Time') or timestamp,
+            record.get('device_id'),
+            *(record[name] for name in REPORT_METRICS),
+            record['System_State'],
+            record.get('predicted_state'),
+            int(rule_hits),
+            record.get('anomaly_flags'),
+            record.get('report_text'),
+            record.get('feedback'),
+            record.get('corrected_state'),
+            timestamp if record.get('corrected_state') is not None else None)
+
+
+@timed('sqlite_operation', help="Seconds per SQLite operation", op='save_reports_many')
+def save_reports_many(records, db_path=DB_PATH):
+    """
+    Insert many reports in a single transaction.
+
+    Parameters:
+    records (iterable): Mappings with the 14 metric columns and System_State,
+                        optionally Date_and_Time, device_id, predicted_state, anomaly_flags,
+                        report_text (edited text only) and feedback
+    db_path (str): SQLite database file
+
+    Returns:
+    int: Number of rows inserted
+    """
+    records = list(records)
+    if not records:
+        return 0
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rule_hits = DEFAULT_RULES.bitmask(records)
+    rows = [_report_row(record, timestamp, hits) for record, hits in zip(records, rule_hits)]
+    conn = get_connection(db_path)
+    with conn:
+        # Take the write lock first so the new rows are exactly the ids above last_id
+        conn.execute("BEGIN IMMEDIATE")
+        last_id = _last_id(conn)
+        _add_rule_text(conn, set(rule_hits.tolist()))
+        conn.executemany(INSERT_REPORT_SQL, rows)
+        _update_rollups(conn, "id > ?", (last_id,))
+        conn.executemany(DEVICE_STATE_UPSERT_SQL, _device_state_rows(records, rows, rule_hits, last_id))
+    notify_write(db_path)
+    return len(rows)
+
+
+def _last_id(conn):
+    # AUTOINCREMENT continues after the largest id ever handed out, which
+    # sqlite_sequence records; MAX(id) is lower once the newest reports were
+    # deleted or archived. A table without AUTOINCREMENT has no entry there
+    # and continues after MAX(id)
+    return conn.execute("""SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'reports'), 0),
+                                      COALESCE((SELECT MAX(id) FROM reports), 0))""").fetchone()[0]
+
+
+def _device_state_rows(records, rows, rule_hits, last_id):
+    # The new reports have ids last_id + 1, last_id + 2, ... in records order;
+    # rows[i][0] is the Date_and_Time actually stored
+    latest, counts = {}, {}
+    for i, record in enumerate(records):
+        device_id = record.get('device_id')
+        # None, or NaN in records that came from a DataFrame, means no device
+        if device_id is None or device_id != device_id:
+            continue
+        counts[device_id] = counts.get(device_id, 0) + 1
+        if device_id not in latest or rows[i][0] >= rows[latest[device_id]][0]:
+            latest[device_id] = i
+    if not latest:
+        return []
+    worst, ratios = DEFAULT_RULES.worst([records[i] for i in latest.values()])
+    return [(device_id, last_id + 1 + i, rows[i][0], records[i]['System_State'], metric,
+             float(records[i][metric]), float(ratio), int(rule_hits[i]), records[i].get('anomaly_flags'),
+             counts[device_id])
+            for (device_id, i), metric, ratio in zip(latest.items(), worst.tolist(), ratios.tolist())]
+
+
+@timed('sqlite_operation', op='save_report_to_db')
+def save_report_to_db(input_data, prediction, report_text, feedback, db_path=DB_PATH):
+    """
+    Save system report to database with updated column names.
+
+    Parameters:
+    input_data (dict): Dictionary containing system metrics
+    prediction (str): System state prediction
+    report_text (str): Report text if the user edited it, else None to render it on read
+    feedback (str): Additional feedback and notes
+    """
+    try:
+        save_reports_many([{**input_data, 'System_State': prediction,
+                            'report_text': report_text, 'feedback': feedback}], db_path)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise
+    except Exception as e:
+        print(f"Error saving report: {e}")
+        raise
+
+
+@timed('sqlite_operation', op='get_saved_reports')
+def get_saved_reports(db_path=DB_PATH):
+    return pd.read_sql_query("SELECT * FROM reports", get_connection(db_path))
+
+
+def _filter_sql(states=None, start=None, end=None, metric_ranges=None, prefix=''):
+    where, params = [], []
+    if states:
+        where.append(f"{prefix}System_State IN ({', '.join('?' * len(states))})")
+        params.extend(states)
+    if start:
+        where.append(f"{prefix}Date_and_Time >= ?")
+        params.append(start)
+    if end:
+        # A bare date includes the whole day
+        where.append(f"{prefix}Date_and_Time <= ?")
+        params.append(end if len(end) > 10 else end + ' 23:59:59')
+    for metric, (low, high) in (metric_ranges or {}).items():
+        if metric not in REPORT_METRICS:
+            raise ValueError(f"Unknown metric {metric!r}")
+        if low is not None:
+            where.append(f"{prefix}{metric} >= ?")
+            params.append(low)
+        if high is not None:
+            where.append(f"{prefix}{metric} <= ?")
+            params.append(high)
+    return where, params
+
+
+@timed('sqlite_operation', op='query_reports')
+def query_reports(states=None, start=None, end=None, metric_ranges=None, search=None,
+                  after=None, page_size=50, db_path=DB_PATH):
+    """
+    Fetch one page of the report listing, newest first, filtered in SQL.
+
+    Parameters:
+    states (list): System_State values to keep, e.g. ['Abnormal']
+    start, end (str): Inclusive Date_and_Time bounds ("YYYY-MM-DD HH:MM:SS" or a prefix)
+    metric_ranges (dict): Metric name -> (low, high); either bound may be None
+    search (str): Only keep reports whose text, rule text or feedback matches (see fts_query)
+    after (tuple): Cursor returned with the previous page
+    page_size (int): Rows per page
+
+    Returns:
+    (DataFrame, tuple): The page with LISTING_COLUMNS, and the cursor for the
+    next page (None when this is the last page)
+    """
+    where, params = _filter_sql(states, start, end, metric_ranges)
+    if search and fts_query(search):
+        if has_fts(db_path):
+            where.append("id IN (SELECT rowid FROM reports_fts WHERE reports_fts MATCH ?)")
+            params.append(fts_query(search))
+        else:
+            where.append(f"({_LIKE_SEARCH.format(row='reports')})")
+            params.extend([f"%{search}%"] * 3)
+    if after:
+        # Keyset pagination: continue strictly below the last row shown
+        where.append("(Date_and_Time, id) < (?, ?)")
+        params.extend(after)
+
+    sql = f"SELECT {', '.join(LISTING_COLUMNS)} FROM reports"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY Date_and_Time DESC, id DESC LIMIT ?"
+    params.append(page_size + 1)
+
+    page = pd.read_sql_query(sql, get_connection(db_path), params=params)
+    if len(page) <= page_size:
+        return page, None
+    page = page.iloc[:page_size]
+    last = page.iloc[-1]
+    return page, (last['Date_and_Time'], int(last['id']))
+
+
+@timed('sqlite_operation', op='search_reports')
+def search_reports(search, states=None, start=None, end=None, metric_ranges=None,
+                   after=None, page_size=50, db_path=DB_PATH):
+    """
+    Full-text search over report text, rule text and feedback, best matches first.
+
+    Takes the same filters as query_reports. Each row also has a `snippet`
+    column with the matching terms wrapped in ** for markdown. `after` is
+    the row offset returned with the previous page.
+
+    Returns:
+    (DataFrame, int): The page, and the offset of the next page (or None)
+    """
+    if not fts_query(search):
+        return pd.DataFrame(columns=[*LISTING_COLUMNS, 'snippet']), None
+
+    where, params = _filter_sql(states, start, end, metric_ranges, prefix='r.')
+    filters = ''.join(' AND ' + clause for clause in where)
+    columns = ', '.join(f'r.{column}' for column in LISTING_COLUMNS)
+    if has_fts(db_path):
+        sql = f"""SELECT {columns},
+                         snippet(reports_fts, -1, '**', '**', '…', 16) AS snippet
+                  FROM reports_fts JOIN reports r ON r.id = reports_fts.rowid
+                  WHERE reports_fts MATCH ?{filters}
+                  ORDER BY bm25(reports_fts) LIMIT ? OFFSET ?"""
+        params = [fts_query(search), *params]
+    else:
+        sql = f"""SELECT {columns}, '' AS snippet FROM reports r
+                  WHERE ({_LIKE_SEARCH.format(row='r')}){filters}
+                  ORDER BY r.Date_and_Time DESC, r.id DESC LIMIT ? OFFSET ?"""
+        params = [*[f"%{search}%"] * 3, *params]
+
+    page = pd.read_sql_query(sql, get_connection(db_path), params=[*params, page_size + 1, after or 0])
+    if len(page) <= page_size:
+        return page, None
+    return page.iloc[:page_size], (after or 0) + page_size
+
+
+@timed('sqlite_operation', op='get_report_details')
+def get_report_details(report_id, db_path=DB_PATH):
+    """
+    Return one report as a dict of its columns, or None.
+
+    report_text is None unless the user edited it; reports.report_text()
+    renders it from the other columns.
+    """
+    cursor = get_connection(db_path).execute(
+        f"SELECT id, {', '.join(REPORT_COLUMNS)} FROM reports WHERE id = ?", (report_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+@timed('sqlite_operation', op='set_corrected_state')
+def set_corrected_state(report_id, state, db_path=DB_PATH):
+    """
+    Record an operator's correction of a report's model label.
+
+    The original predicted_state is kept. Corrections are the only labels
+    retrain.py learns from the reports; it picks up the ones made since its
+    last run by corrected_at. Pass state=None to withdraw a correction;
+    the next full retrain no longer uses it.
+    """
+    # Microseconds, so a report re-corrected in the second retrain.py last
+    # read up to still sorts after it
+    corrected_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute("UPDATE reports SET corrected_state = ?, corrected_at = ? WHERE id = ?",
+                     (state, corrected_at, report_id))
+    notify_write(db_path)
+
+
+def get_correction_counts(db_path=DB_PATH):
+    """Number of corrected reports per corrected_state, the labels retrain.py learns from."""
+    rows = get_connection(db_path).execute(
+        "SELECT corrected_state, COUNT(*) FROM reports WHERE corrected_state IS NOT NULL "
+        "GROUP BY corrected_state ORDER BY corrected_state").fetchall()
+    return dict(rows)
+
+
+@timed('sqlite_operation', op='delete_report')
+def delete_report(report_id, db_path=DB_PATH):
+    conn = get_connection(db_path)
+    with conn:
+        row = conn.execute("SELECT Date_and_Time, device_id FROM reports WHERE id = ?", (report_id,)).fetchone()
+        conn.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+        if row and row[1] is not None:
+            _refresh_devices(conn, [row[1]])
+        if row and row[0]:
+            # min/max can't be decremented, so recompute the report's buckets
+            for granularity, length in ROLLUP_GRANULARITIES.items():
+                bucket = row[0][:length]
+                conn.execute("DELETE FROM report_rollups WHERE granularity = ? AND bucket = ?",
+                             (granularity, bucket))
+                conn.execute(ROLLUP_UPSERT_SQL.format(where="Date_and_Time >= ? AND Date_and_Time < ?"),
+                             (granularity, length, bucket, bucket + '~'))
+    notify_write(db_path)
+
+
+@timed('sqlite_operation', op='delete_archived_reports')
+def delete_archived_reports(cutoff, after_id, last_id, db_path=DB_PATH):
+    """
+    Delete reports that archive.py has written out: those older than `cutoff`
+    with after_id < id <= last_id.
+
+    Their rollups are kept, being the only copy of the archived days, and
+    the state of their devices is recomputed from the reports left.
+
+    Returns:
+    int: Number of reports deleted
+    """
+    conn = get_connection(db_path)
+    where, params = "Date_and_Time < ? AND id > ? AND id <= ?", (cutoff, after_id, last_id)
+    with conn:
+        devices = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT device_id FROM reports WHERE {where} AND device_id IS NOT NULL", params)]
+        deleted = conn.execute(f"DELETE FROM reports WHERE {where}", params).rowcount
+        if devices:
+            _refresh_devices(conn, devices)
+    notify_write(db_path)
+    return deleted
+
+
+def _refresh_devices(conn, device_ids=None):
+    # Recompute device_state from the reports table, for the given devices or all
+    # of them; the device index keeps this proportional to their own history
+    if device_ids is None:
+        where, params = "device_id IS NOT NULL", []
+    else:
+        where, params = f"device_id IN ({', '.join('?' * len(device_ids))})", list(device_ids)
+    conn.execute(f"DELETE FROM device_state WHERE {where}", params)
+    latest = pd.read_sql_query(
+        f'''SELECT * FROM (
+                SELECT id, device_id, COALESCE(Date_and_Time, '') AS last_seen, System_State, rule_hits,
+                       anomaly_flags, {', '.join(REPORT_METRICS)},
+                       ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY Date_and_Time DESC, id DESC) AS rank,
+                       COUNT(*) OVER (PARTITION BY device_id) AS report_count
+                FROM reports WHERE {where})
+            WHERE rank = 1''', conn, params=params)
+    if latest.empty:
+        return
+    worst, ratios = DEFAULT_RULES.worst(latest)
+    values = latest[REPORT_METRICS].to_numpy(dtype=float)[np.arange(len(latest)),
+                                                           [REPORT_METRICS.index(m) for m in worst]]
+    latest = latest.astype(object).where(latest.notna(), None)
+    conn.executemany(DEVICE_STATE_UPSERT_SQL, [
+        (row.device_id, int(row.id), row.last_seen, row.System_State, metric, float(value), float(ratio),
+         row.rule_hits, row.anomaly_flags, int(row.report_count))
+        for row, metric, value, ratio in zip(latest.itertuples(index=False), worst.tolist(), values.tolist(),
+                                             ratios.tolist())])
+
+
+def rebuild_device_state(db_path=DB_PATH):
+    """
+    Recompute the latest-state-per-device table from the reports, e.g. after a
+    backfill. Reports already moved to the archive are no longer counted.
+    """
+    conn = get_connection(db_path)
+    with conn:
+        _refresh_devices(conn)
+    notify_write(db_path)
+
+
+@timed('sqlite_operation', op='get_fleet_state')
+def get_fleet_state(db_path=DB_PATH):
+    """
+    One row per device: its latest report's state, when it was last seen, its
+    worst offending metric and how many reports it has sent. Read only from
+    the device_state table, so the cost follows the number of devices.
+
+    Returns:
+    DataFrame: device_id, DEVICE_STATE_COLUMNS and report_count, worst first
+    """
+    return pd.read_sql_query(
+        f"SELECT device_id, {', '.join(DEVICE_STATE_COLUMNS)}, report_count FROM device_state "
+        "ORDER BY worst_ratio DESC, device_id", get_connection(db_path))
+
+
+@timed('sqlite_operation', op='device_history')
+def device_history(device_id, limit=50, db_path=DB_PATH):
+    """The newest `limit` reports of one device, with LISTING_COLUMNS."""
+    return pd.read_sql_query(
+        f"SELECT {', '.join(LISTING_COLUMNS)} FROM reports WHERE device_id = ? "
+        "ORDER BY Date_and_Time DESC, id DESC LIMIT ?", get_connection(db_path), params=(device_id, limit))
+
+
+def _update_rollups(conn, where, params):
+    for granularity, length in ROLLUP_GRANULARITIES.items():
+        conn.execute(ROLLUP_UPSERT_SQL.format(where=where), (granularity, length, *params))
+
+
+def _rebuild_rollup_days(conn, low, high):
+    # Only days that still have raw reports are rebuilt: archive.py moves
+    # whole days, and an archived day's rollups are the only copy left
+    days = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(Date_and_Time, 1, 10) FROM reports WHERE Date_and_Time >= ? AND Date_and_Time < ?",
+        (low, high))]
+    conn.executemany("DELETE FROM report_rollups WHERE bucket >= ? AND bucket < ?",
+                     [(day, day + '~') for day in days])
+    _update_rollups(conn, "Date_and_Time >= ? AND Date_and_Time < ?", (low, high))
+    return len(days)
+
+
+def rebuild_rollups(start=None, end=None, db_path=DB_PATH):
+    """
+    Recompute rollups from the raw reports, e.g. after a backfill.
+
+    Without bounds every day that still has reports in the database is
+    rebuilt; with `start`/`end` only those days in that range. Rollups of
+    archived days are left alone.
+
+    Returns:
+    int: Number of days rebuilt
+    """
+    low = start[:10] if start else ''
+    high = (end[:10] if end else '9999-12-31') + '~'
+    conn = get_connection(db_path)
+    with conn:
+        days = _rebuild_rollup_days(conn, low, high)
+    notify_write(db_path)
+    return days
+
+
+@timed('sqlite_operation', op='query_rollups')
+def query_rollups(granularity='hour', start=None, end=None, metrics=None, db_path=DB_PATH):
+    """
+    Trend data for each bucket, read only from the rollup table.
+
+    Returns:
+    DataFrame: bucket, count, abnormal, abnormal_rate and, per metric,
+    <metric>_mean, <metric>_min, <metric>_max and <metric>_std
+    """
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity!r}")
+    metrics = metrics or REPORT_METRICS
+    unknown = [metric for metric in metrics if metric not in REPORT_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+
+    where, params = ["granularity = ?"], [granularity]
+    if start:
+        where.append("bucket >= ?")
+        params.append(start[:ROLLUP_GRANULARITIES[granularity]])
+    if end:
+        where.append("bucket <= ?")
+        params.append(end[:ROLLUP_GRANULARITIES[granularity]])
+    columns = ', '.join(f'{m}_sum, {m}_min, {m}_max, {m}_sumsq' for m in metrics)
+    rollups = pd.read_sql_query(
+        f"SELECT bucket, count, abnormal, {columns} FROM report_rollups "
+        f"WHERE {' AND '.join(where)} ORDER BY bucket", get_connection(db_path), params=params)
+
+    trends = rollups[['bucket', 'count', 'abnormal']].copy()
+    trends['abnormal_rate'] = rollups['abnormal'] / rollups['count']
+    for m in metrics:
+        mean = rollups[f'{m}_sum'] / rollups['count']
+        variance = (rollups[f'{m}_sumsq'] / rollups['count'] - mean ** 2).clip(lower=0)
+        trends[f'{m}_mean'] = mean
+        trends[f'{m}_min'] = rollups[f'{m}_min']
+        trends[f'{m}_max'] = rollups[f'{m}_max']
+        trends[f'{m}_std'] = variance ** 0.5
+    return trends
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the reports database")
+    parser.add_argument('--db', default=DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = commands.add_parser('rebuild-rollups', help="Recompute metric rollups from the raw reports")
+    rebuild.add_argument('--start', help="First day to rebuild (YYYY-MM-DD); default: all days still in the database")
+    rebuild.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD); default: all days still in the database")
+    commands.add_parser('rebuild-devices', help="Recompute the latest state per device from the raw reports")
+
+    args = parser.parse_args()
+    create_database(args.db)
+    if args.command == 'rebuild-rollups':
+        days = rebuild_rollups(args.start, args.end, args.db)
+        count = get_connection(args.db).execute("SELECT COUNT(*) FROM report_rollups").fetchone()[0]
+        print(f"Rebuilt the rollups of {days} days with reports in the database; {count} buckets in total")
+    elif args.command == 'rebuild-devices':
+        rebuild_device_state(args.db)
+        count = get_connection(args.db).execute("SELECT COUNT(*) FROM device_state").fetchone()[0]
+        print(f"Rebuilt device state: {count} devices")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from rules import DEFAULT_RULES  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'reports.db')
+    storage.create_database(path)
+    yield path
+    storage.close_connections()
+
+
+def make_records(n, seed=0, **fields):
+    """n report records, a minute apart, with metrics drawn from 0..100 and the rule state."""
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(n):
+        record = {metric: float(value) for metric, value in zip(storage.REPORT_METRICS, rng.uniform(0, 100, 14))}
+        record['Date_and_Time'] = f'2025-01-01 {i // 60 % 24:02d}:{i % 60:02d}:00'
+        record.update(fields)
+        records.append(record)
+    for record, state in zip(records, DEFAULT_RULES.classify(records)):
+        record['System_State'] = state
+    return records
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+import storage
+from anomaly import (DEFAULT_DEVICE, DRIFT, KINDS, OUT_OF_RANGE, SPIKE, StreamingDetector, anomaly_mask, describe,
+                     parse_time, scan_reports)
+from conftest import make_records
+from ingest import IngestDaemon
+from model import FEATURES
+
+
+def noise(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 50.0 + rng.normal(size=(n, len(FEATURES)))
+
+
+def run(detector, X, device='dev', start=0):
+    ts = np.arange(start, start + len(X), dtype=float)
+    return detector.update([device] * len(X), X, ts)
+
+
+def test_describe_decodes_anomaly_mask():
+    flags = np.zeros((1, len(FEATURES)), dtype=np.int64)
+    flags[0, 0] = SPIKE
+    flags[0, 3] = OUT_OF_RANGE | DRIFT
+    assert describe(anomaly_mask(flags)[0]) == [(FEATURES[0], 'spike'), (FEATURES[3], 'out_of_range'),
+                                                 (FEATURES[3], 'drift')]
+    assert describe(None) == describe(-1) == []
+    assert len(KINDS) == 3
+
+
+def test_stationary_noise_is_rarely_flagged():
+    mask, _ = run(StreamingDetector(max_devices=4), noise(5000))
+    assert np.count_nonzero(mask[50:]) / len(mask[50:]) < 0.01
+
+
+def test_spike_is_flagged_after_warmup():
+    detector = StreamingDetector(max_devices=4)
+    run(detector, noise(500))
+    X = noise(1, seed=1)
+    X[0, 2] += 20.0
+    mask, scores = run(detector, X, start=500)
+    assert (FEATURES[2], 'spike') in describe(mask[0])
+    assert scores[0] > detector.spike_z
+
+
+@pytest.mark.parametrize('slope', [0.005, 0.01])
+def test_slow_ramp_is_flagged_as_drift(slope):
+    # A rise of well under one noise deviation per hundred samples: no single
+    # sample stands out, and the baseline variance grows along with the ramp
+    X = noise(2000)
+    X[500:, 0] += slope * np.arange(1500)
+    mask, _ = run(StreamingDetector(max_devices=4), X)
+    drifting = np.array([(FEATURES[0], 'drift') in describe(flags) for flags in mask])
+    assert not drifting[:500].any()
+    # Once the recent level is clear of the baseline it stays flagged
+    assert drifting[-500:].mean() > 0.9
+
+
+def test_nothing_is_flagged_during_warmup():
+    X = noise(30)
+    X[10] += 100.0
+    mask, scores = run(StreamingDetector(max_devices=4, warmup=50), X)
+    assert not mask.any() and not scores.any()
+
+
+def test_devices_are_tracked_separately_and_evicted():
+    detector = StreamingDetector(max_devices=2)
+    detector.update(['a', 'b', 'a'], noise(3), [0.0, 0.0, 1.0])
+    assert detector.device_state('a')['samples'] == 2
+    detector.update(['c'], noise(1), [2.0])
+    assert len(detector) == 2
+    assert detector.device_state('b') is None
+
+
+def test_checkpoint_round_trip(db_path):
+    detector = StreamingDetector(max_devices=4)
+    run(detector, noise(200))
+    assert detector.checkpoint(db_path) == 1
+    assert detector.checkpoint(db_path) == 0
+
+    restored = StreamingDetector(max_devices=4)
+    assert restored.restore(db_path) == 1
+    assert restored.device_state('dev') == detector.device_state('dev')
+
+
+def test_rejects_misshapen_batches():
+    with pytest.raises(ValueError):
+        StreamingDetector(max_devices=4).update(['a'], np.zeros((1, 3)))
+
+
+def test_scan_reports_keys_each_report_by_its_device(db_path):
+    records = make_records(20)
+    for i, record in enumerate(records):
+        record['device_id'] = f'dev-{i % 2}' if i < 16 else None
+    storage.save_reports_many(records, db_path=db_path)
+
+    # A new detector has no devices, so it is falsy; it must still be used
+    detector = StreamingDetector(max_devices=4)
+    assert IngestDaemon(db_path, detector=detector).detector is detector
+    list(scan_reports(db_path, detector))
+    assert detector.device_state('dev-0')['samples'] == 8
+    assert detector.device_state('dev-1')['samples'] == 8
+    assert detector.device_state(DEFAULT_DEVICE)['samples'] == 4
+
+
+def test_parse_time_falls_back_to_the_default():
+    assert parse_time('1970-01-02T00:00:00+00:00', 0.0) == 86400.0
+    assert parse_time('', 5.0) == parse_time('yesterday', 5.0) == parse_time(None, 5.0) == 5.0
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import archive
+import storage
+from conftest import make_records
+
+
+def save_old_and_recent(db_path):
+    # dev-a has old and recent reports, dev-b only old ones
+    today = datetime.now().strftime("%Y-%m-%d")
+    old = make_records(30, CPU_Utilization=95.0)
+    for i, record in enumerate(old):
+        record['device_id'] = 'dev-a' if i % 2 else 'dev-b'
+    old[0]['report_text'] = 'Edited by hand'
+    recent = make_records(10, seed=1, device_id='dev-a', CPU_Utilization=10.0,
+                          Date_and_Time=f'{today} 00:00:00')
+    storage.save_reports_many(old, db_path=db_path)
+    storage.save_reports_many(recent, db_path=db_path)
+    return old, recent
+
+
+def test_archive_moves_old_reports_and_keeps_them_listed(db_path, tmp_path):
+    save_old_and_recent(db_path)
+    daily = storage.query_rollups('day', db_path=db_path)
+
+    stats = archive.archive_reports(older_than_days=90, rollup_horizon_days=3650,
+                                    archive_dir=str(tmp_path / 'archive'), db_path=db_path)
+    assert stats['rows_archived'] == 30
+    assert len(storage.get_saved_reports(db_path)) == 10
+    assert storage.query_rollups('day', db_path=db_path).equals(daily)
+
+    seen, after = [], None
+    while True:
+        page, after = archive.query_all_reports(after=after, page_size=7, db_path=db_path,
+                                                archive_dir=str(tmp_path / 'archive'))
+        seen.extend(page['id'].tolist())
+        if after is None:
+            break
+    assert sorted(seen) == list(range(1, 41))
+
+
+def test_archive_refreshes_the_device_state(db_path, tmp_path):
+    save_old_and_recent(db_path)
+    archive.archive_reports(older_than_days=90, rollup_horizon_days=3650,
+                            archive_dir=str(tmp_path / 'archive'), db_path=db_path)
+
+    fleet = storage.get_fleet_state(db_path).set_index('device_id')
+    assert fleet.index.tolist() == ['dev-a']
+    assert fleet.loc['dev-a', 'report_count'] == 10
+
+
+def test_archive_search_matches_rule_text(db_path, tmp_path):
+    save_old_and_recent(db_path)
+    archive_dir = str(tmp_path / 'archive')
+    archive.archive_reports(older_than_days=90, rollup_horizon_days=3650, archive_dir=archive_dir,
+                            db_path=db_path)
+
+    # The unedited archived reports are found by their CPU diagnosis, the
+    # edited one by its own text only
+    page, _ = archive.query_archive(search='cpu utilization', page_size=100, archive_dir=archive_dir)
+    assert len(page) == 29
+    page, _ = archive.query_archive(search='by hand', page_size=100, archive_dir=archive_dir)
+    assert len(page) == 1
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
+
+from compile_model import check_parity, compile_pipeline, sample_inputs
+from model import FEATURES, NumpyModel
+from rules import DEFAULT_RULES
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    X = sample_inputs(2000, seed=1)
+    # Three classes by how many rules fire, so the multi-class trees are exercised
+    y = np.digitize(DEFAULT_RULES.masks(pd.DataFrame(X, columns=FEATURES)).sum(axis=1), [7, 9])
+    scaler = StandardScaler().fit(X)
+    classifier = GradientBoostingClassifier(n_estimators=20, max_depth=3, random_state=0)
+    return Pipeline([('scaler', scaler), ('classifier', classifier.fit(scaler.transform(X), y))])
+
+
+def test_compiled_model_matches_scikit_learn(pipeline):
+    numpy_model = NumpyModel(compile_pipeline(pipeline))
+    assert check_parity(pipeline, numpy_model, n_rows=5000) == 0
+
+    X = sample_inputs(1000, seed=2)
+    assert (numpy_model.predict(X) == pipeline.predict(X)).all()
+
+
+def test_parity_catches_a_wrong_scaler(pipeline):
+    arrays = compile_pipeline(pipeline)
+    arrays['scaler_mean'] = arrays['scaler_mean'] + 1.0
+    assert check_parity(pipeline, NumpyModel(arrays), n_rows=1000) > 0
+
+
+def test_parity_refuses_inputs_that_collapse(pipeline):
+    # A scaler that maps every row to the same point leaves nothing to compare
+    collapsing = Pipeline([('scaler', FunctionTransformer(np.zeros_like)),
+                           ('classifier', pipeline.named_steps['classifier'])])
+    with pytest.raises(ValueError, match='collapse'):
+        check_parity(collapsing, NumpyModel(compile_pipeline(collapsing)), n_rows=100)
@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+import model
+import storage
+from conftest import make_records
+from ingest import IngestDaemon, parse_record, replay
+from rules import DEFAULT_RULES
+
+
+def write_jsonl(path, records, invalid=()):
+    with open(path, 'w') as f:
+        for record in records:
+            fields = [*model.FEATURES, 'Date_and_Time', 'device_id']
+            f.write(json.dumps({name: record[name] for name in fields}) + '\n')
+        for line in invalid:
+            f.write(line + '\n')
+
+
+async def wait_until(condition, timeout=30):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def telemetry(n):
+    records = make_records(n)
+    for i, record in enumerate(records):
+        record['device_id'] = f'dev-{i % 3}'
+    return records
+
+
+def test_parse_record_accepts_only_string_device_ids():
+    line = {name: 1.0 for name in model.FEATURES}
+    assert parse_record(json.dumps({**line, 'device_id': 'dev-1'}))['device_id'] == 'dev-1'
+    assert parse_record(json.dumps(line))['device_id'] is None
+    for device_id in (7, True):
+        with pytest.raises(ValueError, match="device_id must be a string"):
+            parse_record(json.dumps({**line, 'device_id': device_id}))
+
+
+def test_replay_over_tcp_stores_every_valid_record(db_path, tmp_path):
+    records = telemetry(300)
+    path = str(tmp_path / 'telemetry.jsonl')
+    write_jsonl(path, records, invalid=['not json', '{"CPU_Utilization": 1}'])
+
+    async def run():
+        # A small queue so the sender is held back rather than dropped
+        daemon = IngestDaemon(db_path, queue_size=16, batch_size=50, max_wait=0.01, policy='block',
+                              detector=False)
+        await daemon.start('127.0.0.1', tcp_port=0, udp_port=None)
+        port = daemon._servers[0].sockets[0].getsockname()[1]
+        args = argparse.Namespace(to=f'tcp://127.0.0.1:{port}', input=path, synthetic=None, rate=0, seed=0,
+                                  devices=0, verify_db=None, timeout=30)
+        await asyncio.get_running_loop().run_in_executor(None, replay, args)
+        # stop() only drains what was queued, so let the connection be read first
+        await wait_until(lambda: daemon.counts['received'] == 302)
+        await daemon.stop()
+        return daemon.counts
+
+    counts = asyncio.run(run())
+    assert counts['received'] == 302
+    assert counts['invalid'] == 2
+    assert counts['accepted'] == counts['stored'] == 300
+    assert counts['dropped'] == 0
+
+    stored = storage.get_saved_reports(db_path).sort_values('id')
+    assert stored['device_id'].tolist() == [record['device_id'] for record in records]
+    assert stored['System_State'].tolist() == DEFAULT_RULES.classify(records).tolist()
+    labels = model.predict_batch([{name: record[name] for name in model.FEATURES} for record in records])
+    assert stored['predicted_state'].tolist() == [str(label) for label in labels]
+
+
+def test_drop_policy_counts_what_did_not_fit(db_path, tmp_path):
+    path = str(tmp_path / 'telemetry.jsonl')
+    write_jsonl(path, telemetry(200))
+
+    async def run():
+        daemon = IngestDaemon(db_path, queue_size=10, batch_size=50, max_wait=0.01, policy='drop', detector=False)
+        await daemon.start('127.0.0.1', tcp_port=None, udp_port=None, tail_paths=[path], from_start=True)
+        await wait_until(lambda: daemon.counts['accepted'] + daemon.counts['dropped'] == 200)
+        await daemon.stop()
+        return daemon.counts
+
+    counts = asyncio.run(run())
+    assert counts['dropped'] > 0
+    assert counts['accepted'] + counts['dropped'] == 200
+    assert counts['stored'] == counts['accepted'] == len(storage.get_saved_reports(db_path))
@@ -0,0 +1,109 @@
+import pytest
+
+import llm
+import storage
+from llm import ResponseCache, StubModel, prompt_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    yield str(tmp_path / 'llm_cache.db')
+    storage.close_connections()
+
+
+def test_memory_tier_keeps_the_most_recently_used(cache_path, clock):
+    cache = ResponseCache(cache_path, memory_entries=2)
+    for key in 'abc':
+        cache.put(key, f'answer {key}')
+        clock.now += 1
+
+    assert cache.stats(disk=False)['memory_entries'] == 2
+    # 'a' fell out of memory but is still on disk, and is remembered again
+    assert cache.get('a') == ('answer a', 'disk')
+    assert cache.get('a') == ('answer a', 'memory')
+    assert cache.get('c') == ('answer c', 'memory')
+    assert cache.get('b') == ('answer b', 'disk')
+
+
+def test_disk_tier_survives_a_new_cache(cache_path, clock):
+    ResponseCache(cache_path).put('key', 'stored answer')
+
+    cache = ResponseCache(cache_path)
+    assert cache.get('key') == ('stored answer', 'disk')
+    assert cache.get('key') == ('stored answer', 'memory')
+    assert cache.get('other') == (None, None)
+
+
+def test_entries_expire_after_the_ttl(cache_path, clock):
+    cache = ResponseCache(cache_path, ttl=60)
+    cache.put('old', 'old answer')
+    clock.now += 30
+    assert cache.get('old') == ('old answer', 'memory')
+
+    clock.now += 31
+    assert cache.get('old') == (None, None)
+    # The next write removes the expired row from disk
+    cache.put('new', 'new answer')
+    stats = cache.stats()
+    assert stats['disk_entries'] == 1
+    assert stats['evictions'] == 1
+
+
+def test_least_recently_used_are_evicted_past_max_bytes(cache_path, clock):
+    cache = ResponseCache(cache_path, max_bytes=10)
+    cache.put('first', 'x' * 4)
+    clock.now += 1
+    cache.put('second', 'y' * 4)
+    clock.now += 1
+    # Reading 'first' makes 'second' the least recently used
+    assert cache.get('first')[0] == 'x' * 4
+    clock.now += 1
+    cache.put('third', 'z' * 4)
+
+    assert cache.get('second') == (None, None)
+    assert cache.get('first')[0] == 'x' * 4
+    stats = cache.stats()
+    assert stats['disk_bytes'] == 8
+    assert stats['evictions'] == 1
+
+
+def test_get_or_generate_counts_hits_and_misses(cache_path, clock):
+    cache = ResponseCache(cache_path)
+    model = StubModel()
+
+    def generate(prompt):
+        return model.generate_content(prompt).text
+
+    assert cache.get_or_generate('Status: Normal. Question: why?', generate) == (
+        'Stub answer to: why?', 'model')
+    # Case and whitespace don't change the key
+    assert cache.get_or_generate('status:  normal.\nquestion: WHY?', generate)[1] == 'memory'
+    assert len(model.prompts) == 1
+
+    stats = cache.stats()
+    assert (stats['misses'], stats['memory_hits'], stats['disk_hits']) == (1, 1, 0)
+    assert stats['hit_ratio'] == 0.5
+    assert prompt_key('a  b') == prompt_key('A b')
+
+
+def test_stub_model_streams_tokens_and_fails_on_demand():
+    chunks = StubModel(answer="one two three").generate_content("prompt", stream=True)
+    assert [chunk.text for chunk in chunks] == ['one ', 'two ', 'three']
+
+    with pytest.raises(ConnectionError):
+        list(StubModel(failure_rate=1.0).generate_content("prompt", stream=True))
@@ -0,0 +1,70 @@
+import socket
+import urllib.request
+
+import pytest
+
+from metrics import MetricsRegistry, count, start_metrics_server, timed
+
+
+def test_timed_records_durations_and_errors():
+    registry = MetricsRegistry()
+
+    @timed('work', registry=registry, mode='single')
+    def work(fail=False):
+        if fail:
+            raise RuntimeError("boom")
+        return 42
+
+    assert work() == 42
+    with pytest.raises(RuntimeError):
+        work(fail=True)
+    with timed('work', registry=registry, mode='block'):
+        pass
+
+    rows = {row['labels']: row for row in registry.summary()}
+    assert rows['mode=single']['count'] == 2
+    assert rows['mode=single']['errors'] == 1
+    assert rows['mode=block']['count'] == 1
+
+
+def test_histogram_quantiles_follow_the_buckets():
+    histogram = MetricsRegistry().histogram('latency_seconds', buckets=(0.1, 0.2, 0.4))
+    for value in [0.05] * 50 + [0.3] * 50:
+        histogram.observe(value)
+    counts, total, count = histogram.samples()[()]
+    assert counts == [50, 0, 50, 0] and count == 100
+    assert 0.0 < histogram.quantile(0.25, counts) <= 0.1
+    assert 0.2 < histogram.quantile(0.99, counts) <= 0.4
+
+
+def test_prometheus_rendering():
+    registry = MetricsRegistry()
+    registry.counter('requests_total', 'Requests').inc(3, path='/a "b"')
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1,)).observe(0.05)
+    text = registry.render_prometheus()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{path="/a \\"b\\""} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text
+    assert 'latency_seconds_count 1' in text
+
+
+def test_a_name_keeps_its_kind():
+    registry = MetricsRegistry()
+    registry.counter('things_total')
+    with pytest.raises(ValueError):
+        registry.histogram('things_total')
+
+
+def test_metrics_endpoint_serves_the_registry():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    count('endpoint_test', help="Counted by the metrics endpoint test")
+    server = start_metrics_server('127.0.0.1', port)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+            assert response.status == 200
+            assert b'endpoint_test_total 1' in response.read()
+    finally:
+        server.shutdown()
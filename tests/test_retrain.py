@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import retrain
+import storage
+from conftest import make_records
+from model import FEATURES
+from rules import DEFAULT_RULES
+from train import read_manifest
+
+
+def corrected_records(n, seed=0, **fields):
+    # Corrected to class 0-2 by how many rules fire, as benchmark.py does
+    records = make_records(n, seed, **fields)
+    fired = DEFAULT_RULES.masks(pd.DataFrame(records)).sum(axis=1)
+    for record, label in zip(records, np.digitize(fired, [7, 9])):
+        record['corrected_state'] = str(label)
+    return records
+
+
+@pytest.fixture
+def output_path(tmp_path):
+    return str(tmp_path / 'noc_pipeline.joblib')
+
+
+def test_first_run_without_corrections_explains_what_is_needed(db_path, output_path):
+    # Model labels alone are never learned from
+    storage.save_reports_many(make_records(100, predicted_state='1'), db_path=db_path)
+    with pytest.raises(ValueError, match="Correct the model label"):
+        retrain.retrain_once(db_path, output_path)
+    assert read_manifest(output_path) is None
+
+
+def test_full_retrain_seeds_from_a_csv(db_path, output_path, tmp_path):
+    seed = pd.DataFrame(corrected_records(300, seed=1))
+    data_path = str(tmp_path / 'seed.csv')
+    seed[[*FEATURES, 'corrected_state']].rename(columns={'corrected_state': 'label'}).to_csv(data_path, index=False)
+    storage.save_reports_many(corrected_records(20), db_path=db_path)
+
+    manifest = retrain.train_full(db_path, output_path, data_path=data_path, label_column='label')
+    assert manifest['training_rows'] == 320
+    assert manifest['training_data'] == 'seed.csv+reports:reports.db'
+    assert manifest['trained_through_id'] == 20
+
+
+def test_incremental_update_learns_only_new_corrections(db_path, output_path, monkeypatch):
+    # The fit isn't seeded; keep every update regardless of its held-out score
+    monkeypatch.setattr(retrain, 'RETRAIN_MAX_REGRESSION', 1.0)
+    storage.save_reports_many(corrected_records(300), db_path=db_path)
+    assert retrain.train_full(db_path, output_path)['training_rows'] == 300
+
+    assert retrain.train_incremental(db_path, output_path, min_rows=1) is None
+    # Uncorrected reports don't count towards an update
+    storage.save_reports_many(make_records(50, seed=2, predicted_state='2'), db_path=db_path)
+    assert retrain.train_incremental(db_path, output_path, min_rows=1) is None
+
+    storage.save_reports_many(corrected_records(40, seed=3), db_path=db_path)
+    manifest = retrain.train_incremental(db_path, output_path, min_rows=1)
+    assert manifest['training_mode'] == 'incremental'
+    assert manifest['base_version'] == 1
+    assert manifest['training_rows'] == 340
+    assert manifest['trained_through_id'] == 390
+
+    # A correction made in the same second as the last run is still new
+    storage.set_corrected_state(1, '2', db_path=db_path)
+    _, y, ids = retrain.load_labelled_reports(
+        "(corrected_at, id) > (?, ?)", (manifest['trained_at'], manifest['trained_through_id']), db_path=db_path)
+    assert ids.tolist() == [1] and y.tolist() == ['2']
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rules import DEFAULT_RULES, rule_sections
+
+HEALTHY = {
+    'CPU_Utilization': 40, 'Memory_Usage': 40, 'Error_Rates': 1, 'Network_Traffic_Volume': 500,
+    'Cooling_Temperature': 22, 'Bandwidth_Utilization': 50, 'Latency': 20, 'Packet_Loss': 0.5,
+    'Jitter': 5, 'Network_Availability': 99.5, 'Transmission_Delay': 50,
+    'Connection_Establishment_Termination_Times': 200,
+}
+
+
+def baseline_state(row):
+    # The prediction tab's original criteria
+    return "Normal" if all([
+        row['CPU_Utilization'] < 80,
+        row['Memory_Usage'] < 80,
+        row['Error_Rates'] < 5,
+        row['Bandwidth_Utilization'] < 90,
+        row['Packet_Loss'] < 2,
+        row['Network_Availability'] > 98,
+        row['Latency'] < 100,
+        row['Jitter'] < 30,
+    ]) else "Abnormal"
+
+
+@pytest.mark.parametrize('metric, value, state', [
+    ('CPU_Utilization', 80, 'Abnormal'),
+    ('Memory_Usage', 80, 'Abnormal'),
+    ('Error_Rates', 5, 'Abnormal'),
+    ('Bandwidth_Utilization', 90, 'Abnormal'),
+    ('Latency', 100, 'Abnormal'),
+    ('Packet_Loss', 2, 'Abnormal'),
+    ('Jitter', 30, 'Abnormal'),
+    ('Network_Availability', 98, 'Abnormal'),
+    ('Network_Availability', 98.5, 'Normal'),
+    ('Transmission_Delay', 500, 'Normal'),
+    ('Cooling_Temperature', 40, 'Normal'),
+])
+def test_classify_keeps_the_prediction_tab_boundaries(metric, value, state):
+    row = dict(HEALTHY, **{metric: value})
+    assert DEFAULT_RULES.classify(row)[0] == state == baseline_state(row)
+
+
+def test_classify_matches_the_prediction_tab_on_random_rows():
+    rng = np.random.default_rng(0)
+    # Integer values so the boundaries themselves come up often
+    frame = pd.DataFrame({metric: rng.integers(0, 2 * max(value, 50), 5000) for metric, value in HEALTHY.items()})
+    frame['Network_Availability'] = rng.integers(95, 101, len(frame))
+    expected = [baseline_state(row) for row in frame.to_dict('records')]
+    assert DEFAULT_RULES.classify(frame).tolist() == expected
+
+
+@pytest.mark.parametrize('metric, value, fires', [
+    ('Bandwidth_Utilization', 90, False),
+    ('Bandwidth_Utilization', 91, True),
+    ('Latency', 100, False),
+    ('Packet_Loss', 2, False),
+    ('Jitter', 30, False),
+    ('Network_Availability', 99, False),
+    ('Network_Availability', 98.5, True),
+    ('CPU_Utilization', 80, True),
+])
+def test_report_checks_keep_the_report_boundaries(metric, value, fires):
+    hits = DEFAULT_RULES.hits(dict(HEALTHY, **{metric: value}))
+    assert hits[metric][0] == fires
+
+
+def test_slow_connections_get_a_remediation_but_no_diagnosis():
+    mask = DEFAULT_RULES.bitmask(dict(HEALTHY, Connection_Establishment_Termination_Times=1500))[0]
+    diagnosis, remediation = rule_sections(mask)
+    assert diagnosis == "No significant issues detected."
+    assert "connection pooling" in remediation
+
+
+def test_describe_lists_the_state_checks():
+    lines = DEFAULT_RULES.describe('critical').splitlines()
+    assert "- Network Availability <= 98" in lines
+    assert "- Packet Loss >= 2" in lines
+    assert len(lines) == 8
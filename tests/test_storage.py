@@ -0,0 +1,201 @@
+import threading
+
+import pandas as pd
+
+import storage
+from conftest import make_records
+from rules import DEFAULT_RULES
+
+
+def test_connections_are_reused_in_wal_mode(db_path):
+    conn = storage.get_connection(db_path)
+    assert storage.get_connection(db_path) is conn
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_new_threads_reuse_the_connections_of_finished_ones(db_path):
+    def connect(into):
+        into.append(storage.get_connection(db_path))
+        into.append(storage.get_connection(db_path))
+
+    first, second, main = [], [], storage.get_connection(db_path)
+    for into in (first, second):
+        # One thread per Streamlit rerun
+        thread = threading.Thread(target=connect, args=(into,))
+        thread.start()
+        thread.join()
+    assert first[0] is first[1] is second[0]
+    assert first[0] is not main
+    assert second[0].execute('SELECT COUNT(*) FROM reports').fetchone()[0] == 0
+
+
+def test_save_stores_rule_state_and_hits(db_path):
+    records = make_records(50)
+    storage.save_reports_many(records, db_path=db_path)
+
+    stored = storage.get_saved_reports(db_path).sort_values('id')
+    assert stored['System_State'].tolist() == DEFAULT_RULES.classify(records).tolist()
+    assert stored['rule_hits'].tolist() == DEFAULT_RULES.bitmask(records).tolist()
+
+
+def test_query_reports_pages_newest_first(db_path):
+    storage.save_reports_many(make_records(120), db_path=db_path)
+
+    seen, after = [], None
+    while True:
+        page, after = storage.query_reports(after=after, page_size=50, db_path=db_path)
+        seen.extend(page['id'].tolist())
+        if after is None:
+            break
+    assert len(seen) == len(set(seen)) == 120
+    times = storage.get_saved_reports(db_path).set_index('id')['Date_and_Time']
+    assert times[seen].is_monotonic_decreasing
+
+
+def test_query_reports_filters_in_sql(db_path):
+    records = make_records(120)
+    storage.save_reports_many(records, db_path=db_path)
+
+    page, _ = storage.query_reports(states=['Abnormal'], metric_ranges={'CPU_Utilization': (50, None)},
+                                    start='2025-01-01 01', page_size=500, db_path=db_path)
+    expected = [r for r in records if r['System_State'] == 'Abnormal' and r['CPU_Utilization'] >= 50
+                and r['Date_and_Time'] >= '2025-01-01 01']
+    assert sorted(page['Date_and_Time']) == sorted(r['Date_and_Time'] for r in expected)
+
+
+def test_search_matches_report_text_and_feedback(db_path):
+    records = make_records(20)
+    records[3]['report_text'] = 'Fan replaced in rack seven'
+    records[5]['feedback'] = 'Operators confirmed the rack overheating'
+    storage.save_reports_many(records, db_path=db_path)
+    ids = storage.get_saved_reports(db_path).sort_values('id')['id'].tolist()
+
+    page, _ = storage.search_reports('rack', page_size=100, db_path=db_path)
+    assert sorted(page['id']) == [ids[3], ids[5]]
+    page, _ = storage.query_reports(search='confirm*', db_path=db_path)
+    assert page['id'].tolist() == [ids[5]]
+    # A phrase and a stray parenthesis are matched as text, not FTS5 syntax
+    page, _ = storage.search_reports('"rack seven" seven)', db_path=db_path)
+    assert page['id'].tolist() == [ids[3]]
+
+    storage.delete_report(ids[3], db_path=db_path)
+    page, _ = storage.search_reports('rack', db_path=db_path)
+    assert page['id'].tolist() == [ids[5]]
+
+
+def test_rollups_follow_inserts_and_deletes(db_path):
+    records = make_records(90)
+    storage.save_reports_many(records, db_path=db_path)
+
+    daily = storage.query_rollups('day', db_path=db_path)
+    assert daily['count'].tolist() == [90]
+    assert daily['abnormal'].tolist() == [sum(r['System_State'] == 'Abnormal' for r in records)]
+    cpu = pd.Series([r['CPU_Utilization'] for r in records])
+    assert abs(daily['CPU_Utilization_mean'].iloc[0] - cpu.mean()) < 1e-6
+    assert daily['CPU_Utilization_max'].iloc[0] == cpu.max()
+
+    storage.delete_report(int(storage.get_saved_reports(db_path)['id'].iloc[0]), db_path=db_path)
+    assert storage.query_rollups('day', db_path=db_path)['count'].tolist() == [89]
+    assert storage.rebuild_rollups(db_path=db_path) == 1
+    assert storage.query_rollups('day', db_path=db_path)['count'].tolist() == [89]
+
+
+def test_rollups_are_backfilled_when_the_table_is_created(db_path):
+    storage.save_reports_many(make_records(90), db_path=db_path)
+    hourly = storage.query_rollups('hour', db_path=db_path)
+    conn = storage.get_connection(db_path)
+    with conn:
+        conn.execute("DROP TABLE report_rollups")
+
+    storage.create_database(db_path)
+    assert storage.query_rollups('hour', db_path=db_path).equals(hourly)
+
+
+def test_search_finds_unedited_reports_by_rule_text(db_path):
+    records = make_records(30, CPU_Utilization=95.0)
+    records[0]['report_text'] = 'edited by hand'
+    storage.save_reports_many(records, db_path=db_path)
+
+    page, _ = storage.search_reports('cpu', page_size=100, db_path=db_path)
+    assert len(page) == 29
+    assert all('**' in snippet for snippet in page['snippet'])
+    page, _ = storage.query_reports(search='edited', db_path=db_path)
+    assert len(page) == 1
+
+
+def test_migration_is_kept_when_fts5_is_unavailable(db_path, monkeypatch):
+    # A database from before rule hits and the full-text index
+    storage.save_reports_many(make_records(30, CPU_Utilization=95.0), db_path=db_path)
+    conn = storage.get_connection(db_path)
+    with conn:
+        for trigger in ('insert', 'delete', 'update'):
+            conn.execute(f"DROP TRIGGER reports_fts_{trigger}")
+        conn.execute("DROP TABLE reports_fts")
+        conn.execute("DROP VIEW reports_search")
+        conn.execute("DROP TABLE rule_text")
+        conn.execute("UPDATE reports SET rule_hits = NULL")
+
+    monkeypatch.setattr(storage, 'FTS_SCHEMA', ["CREATE VIRTUAL TABLE reports_fts USING no_such_module()"])
+    storage.create_database(db_path)
+    assert not storage.has_fts(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM reports WHERE rule_hits IS NULL").fetchone()[0] == 0
+    page, _ = storage.query_reports(search='cpu', page_size=100, db_path=db_path)
+    assert len(page) == 30
+
+
+def test_device_state_tracks_latest_report(db_path):
+    records = make_records(40)
+    for i, record in enumerate(records):
+        record['device_id'] = f'dev-{i % 4}'
+    storage.save_reports_many(records[:20], db_path=db_path)
+    storage.save_reports_many(records[20:], db_path=db_path)
+
+    fleet = storage.get_fleet_state(db_path).set_index('device_id')
+    assert fleet['report_count'].to_dict() == {f'dev-{i}': 10 for i in range(4)}
+    reports = storage.get_saved_reports(db_path)
+    newest = reports.sort_values(['Date_and_Time', 'id']).groupby('device_id').last()
+    assert fleet['report_id'].to_dict() == newest['id'].to_dict()
+    assert fleet['System_State'].to_dict() == newest['System_State'].to_dict()
+
+
+def test_device_state_ignores_late_arrivals(db_path):
+    storage.save_reports_many(make_records(3, device_id='dev', Date_and_Time='2025-01-02 00:00:00'),
+                              db_path=db_path)
+    newest = int(storage.get_saved_reports(db_path)['id'].max())
+    storage.save_reports_many(make_records(2, seed=1, device_id='dev'), db_path=db_path)
+
+    fleet = storage.get_fleet_state(db_path).set_index('device_id')
+    assert fleet.loc['dev', 'report_id'] == newest
+    assert fleet.loc['dev', 'report_count'] == 5
+
+
+def test_device_state_ids_after_deleting_the_newest_report(db_path):
+    # AUTOINCREMENT doesn't reuse the deleted id, so the next report's id is
+    # not MAX(id) + 1
+    storage.save_reports_many(make_records(5, device_id='dev'), db_path=db_path)
+    newest = int(storage.get_saved_reports(db_path)['id'].max())
+    storage.delete_report(newest, db_path=db_path)
+
+    storage.save_reports_many(make_records(3, seed=1, device_id='dev', Date_and_Time='2025-01-02 00:00:00'),
+                              db_path=db_path)
+    reports = storage.get_saved_reports(db_path)
+    assert reports['id'].max() == newest + 3
+    fleet = storage.get_fleet_state(db_path).set_index('device_id')
+    assert fleet.loc['dev', 'report_id'] == newest + 3
+    assert fleet.loc['dev', 'report_count'] == 7
+    daily = storage.query_rollups('day', db_path=db_path).set_index('bucket')['count']
+    assert daily.to_dict() == {'2025-01-01': 4, '2025-01-02': 3}
+
+
+def test_device_state_is_backfilled_when_the_table_is_created(db_path):
+    records = make_records(12)
+    for i, record in enumerate(records):
+        record['device_id'] = f'dev-{i % 3}'
+    storage.save_reports_many(records, db_path=db_path)
+    fleet = storage.get_fleet_state(db_path)
+    conn = storage.get_connection(db_path)
+    with conn:
+        conn.execute("DROP TABLE device_state")
+
+    storage.create_database(db_path)
+    assert storage.get_fleet_state(db_path).equals(fleet)
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import joblib
+import pandas as pd
+import sklearn
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from fileio import atomic_write, file_sha256
+from model import FEATURES, LEGACY_MODEL_PATH, PIPELINE_PATH
+
+LABEL_COLUMN = 'System_State'
+
+# Without training data the scaler is fitted on this many snapshots drawn
+# uniformly over the prediction tab's input ranges (model.FEATURE_RANGES)
+SYNTHETIC_SCALER_ROWS = 20000
+
+# Hyperparameters of the classifier shipped in noc_new.joblib
+CLASSIFIER_PARAMS = {
+    'learning_rate': 0.11388373393054482,
+    'max_depth': 12,
+    'n_estimators': 117,
+}
+
+
+def manifest_path(artifact_path):
+    return os.path.splitext(artifact_path)[0] + '.json'
+
+
+def read_manifest(artifact_path):
+    path = manifest_path(artifact_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_training_data(data_path, label_column=LABEL_COLUMN):
+    data = pd.read_csv(data_path)
+    missing = [name for name in FEATURES if name not in data.columns]
+    if missing:
+        raise ValueError(f"Training data is missing feature columns: {missing}")
+    labels = data[label_column] if label_column in data.columns else None
+    return data[FEATURES].to_numpy(dtype=float), labels
+
+
+def save_pipeline(pipeline, output_path=PIPELINE_PATH, **extra):
+    """
+    Save a fitted scaler + classifier pipeline as one versioned artifact.
+
+    A JSON manifest with the feature schema, version and scaler statistics
+    is written next to the artifact (noc_pipeline.joblib -> noc_pipeline.json).
+    """
+    previous = read_manifest(output_path)
+    version = (previous['version'] + 1) if previous else 1
+    scaler = pipeline.named_steps['scaler']
+
+    bundle = {
+        'format': 'noc-pipeline',
+        'version': version,
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'features': FEATURES,
+        'sklearn_version': sklearn.__version__,
+        'pipeline': pipeline,
+        **extra,
+    }
+    atomic_write(output_path, lambda path: joblib.dump(bundle, path))
+
+    manifest = {key: value for key, value in bundle.items() if key != 'pipeline'}
+    manifest.update({
+        'artifact': os.path.basename(output_path),
+        'sha256': file_sha256(output_path),
+        'classes': [str(label) for label in pipeline.classes_],
+        'scaler_mean': scaler.mean_.tolist(),
+        'scaler_scale': scaler.scale_.tolist(),
+    })
+
+    def write_manifest(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    atomic_write(manifest_path(output_path), write_manifest)
+    return manifest
+
+
+def export_pipeline(data_path=None, output_path=PIPELINE_PATH, classifier_path=LEGACY_MODEL_PATH,
+                    label_column=LABEL_COLUMN):
+    """
+    Fit the scaler on the training data and bundle it with a classifier.
+
+    The data behind noc_new.joblib is not in the repository. Without
+    `data_path` the scaler is fitted on snapshots drawn over the prediction
+    tab's input ranges instead, an estimate of the original scaling that
+    lets the shipped classifier be served until real data is available.
+
+    Parameters:
+    data_path (str): CSV with the 14 feature columns (and the label column when
+                     retraining), or None to estimate the scaler from the input ranges
+    output_path (str): Where to write the pipeline artifact
+    classifier_path (str): Existing trained classifier to reuse, or None to fit a new one
+    label_column (str): Label column used when fitting a new classifier
+    """
+    if data_path:
+        X, y = load_training_data(data_path, label_column)
+        training_data = os.path.basename(data_path)
+    else:
+        from compile_model import sample_inputs
+        X, y = sample_inputs(SYNTHETIC_SCALER_ROWS), None
+        training_data = 'synthetic:feature-ranges'
+    scaler = StandardScaler().fit(X)
+
+    if classifier_path:
+        classifier = joblib.load(classifier_path)
+    else:
+        if y is None:
+            raise ValueError(f"Training data with a {label_column!r} column is needed to fit a classifier")
+        classifier = GradientBoostingClassifier(**CLASSIFIER_PARAMS).fit(scaler.transform(X), y)
+
+    pipeline = Pipeline([('scaler', scaler), ('classifier', classifier)])
+    return save_pipeline(pipeline, output_path, training_data=training_data, training_rows=len(X))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the scaler + classifier pipeline used by model.py")
+    parser.add_argument('data', nargs='?',
+                        help="Training CSV with the 14 feature columns; without it the scaler is "
+                             "fitted on snapshots drawn over the prediction tab's input ranges")
+    parser.add_argument('--output', default=PIPELINE_PATH)
+    parser.add_argument('--classifier', default=LEGACY_MODEL_PATH,
+                        help="Trained classifier to bundle (default: %(default)s)")
+    parser.add_argument('--refit', action='store_true',
+                        help="Fit a new classifier on the training data instead of reusing --classifier")
+    parser.add_argument('--label-column', default=LABEL_COLUMN)
+    args = parser.parse_args()
+
+    manifest = export_pipeline(args.data, args.output,
+                               None if args.refit else args.classifier, args.label_column)
+    print(f"Saved pipeline version {manifest['version']} to {args.output} ({manifest['sha256'][:12]})")
+
+
+if __name__ == "__main__":
+    main()